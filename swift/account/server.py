@@ -18,15 +18,17 @@ from __future__ import with_statement
 import os
 import time
 import traceback
+import zlib
 from xml.sax import saxutils
 
 from eventlet import Timeout
 
 import swift.common.db
-from swift.common.db import AccountBroker
+from swift.common.db import AccountBroker, PendingFlusher, StatCache
 from swift.common.utils import get_logger, get_param, hash_path, public, \
     normalize_timestamp, storage_directory, config_true_value, \
-    validate_device_partition, json, timing_stats
+    validate_device_partition, json, timing_stats, joined_chunks, \
+    iter_listing
 from swift.common.constraints import ACCOUNT_LISTING_LIMIT, \
     check_mount, check_float, check_utf8, FORMAT2CONTENT_TYPE
 from swift.common.db_replicator import ReplicatorRpc
@@ -38,6 +40,9 @@ from swift.common.swob import HTTPAccepted, HTTPBadRequest, \
 
 
 DATADIR = 'accounts'
+#: Number of listing entries serialized into each chunk of a GET response;
+#: shorter listings are sent whole, with a Content-Length
+LISTING_CHUNK_ROWS = 100
 
 
 class AccountController(object):
@@ -54,12 +59,30 @@ class AccountController(object):
             conf.get('auto_create_account_prefix') or '.'
         swift.common.db.DB_PREALLOCATION = \
             config_true_value(conf.get('db_preallocation', 'f'))
+        swift.common.db.PENDING_FSYNC = \
+            config_true_value(conf.get('db_pending_fsync', 'f'))
+        swift.common.db.PENDING_FRAMED = \
+            config_true_value(conf.get('db_pending_framed', 'f'))
+        pending_flush_interval = float(conf.get('pending_flush_interval', 0))
+        if pending_flush_interval > 0:
+            self.pending_flusher = PendingFlusher(
+                pending_flush_interval,
+                int(conf.get('pending_flush_watermark', 65536)), self.logger)
+        else:
+            self.pending_flusher = None
+        stat_cache_size = int(conf.get('stat_cache_size', 0))
+        if stat_cache_size > 0:
+            self.stat_cache = StatCache(
+                stat_cache_size, float(conf.get('stat_cache_time', 30)))
+        else:
+            self.stat_cache = None
 
     def _get_account_broker(self, drive, part, account):
         hsh = hash_path(account)
         db_dir = storage_directory(DATADIR, part, hsh)
         db_path = os.path.join(self.root, drive, db_dir, hsh + '.db')
-        return AccountBroker(db_path, account=account, logger=self.logger)
+        return AccountBroker(db_path, account=account, logger=self.logger,
+                             defer_pending=bool(self.pending_flusher))
 
     @public
     @timing_stats()
@@ -78,6 +101,8 @@ class AccountController(object):
             return HTTPBadRequest(body='Missing timestamp', request=req,
                                   content_type='text/plain')
         broker = self._get_account_broker(drive, part, account)
+        if self.stat_cache and not container:
+            self.stat_cache.invalidate(broker)
         if broker.is_deleted():
             return HTTPNotFound(request=req)
         broker.delete_db(req.headers['x-timestamp'])
@@ -96,6 +121,8 @@ class AccountController(object):
         if self.mount_check and not check_mount(self.root, drive):
             return HTTPInsufficientStorage(drive=drive, request=req)
         broker = self._get_account_broker(drive, part, account)
+        if self.stat_cache and not container:
+            self.stat_cache.invalidate(broker)
         if container:   # put account container
             if 'x-trans-id' in req.headers:
                 broker.pending_timeout = 3
@@ -110,6 +137,8 @@ class AccountController(object):
                                  req.headers['x-delete-timestamp'],
                                  req.headers['x-object-count'],
                                  req.headers['x-bytes-used'])
+            if self.pending_flusher:
+                self.pending_flusher.add(broker)
             if req.headers['x-delete-timestamp'] > \
                     req.headers['x-put-timestamp']:
                 return HTTPNoContent(request=req)
@@ -138,6 +167,20 @@ class AccountController(object):
             else:
                 return HTTPAccepted(request=req)
 
+    def _get_stat(self, broker):
+        """
+        Get whether the account is deleted, and its info and metadata;
+        through the stat cache if there is one.
+
+        :param broker: DB broker of the account
+        :returns: tuple of (deleted, info, metadata)
+        """
+        if self.stat_cache:
+            return self.stat_cache.get(broker)
+        if broker.is_deleted():
+            return True, None, None
+        return False, broker.get_info(), broker.metadata
+
     @public
     @timing_stats()
     def HEAD(self, req):
@@ -153,9 +196,9 @@ class AccountController(object):
         broker = self._get_account_broker(drive, part, account)
         broker.pending_timeout = 0.1
         broker.stale_reads_ok = True
-        if broker.is_deleted():
+        deleted, info, metadata = self._get_stat(broker)
+        if deleted:
             return HTTPNotFound(request=req)
-        info = broker.get_info()
         headers = {
             'X-Account-Container-Count': info['container_count'],
             'X-Account-Object-Count': info['object_count'],
@@ -164,7 +207,7 @@ class AccountController(object):
             'X-PUT-Timestamp': info['put_timestamp']}
         headers.update((key, value)
                        for key, (value, timestamp) in
-                       broker.metadata.iteritems() if value != '')
+                       metadata.iteritems() if value != '')
         if get_param(req, 'format'):
             req.accept = FORMAT2CONTENT_TYPE.get(
                 get_param(req, 'format').lower(), FORMAT2CONTENT_TYPE['plain'])
@@ -174,6 +217,43 @@ class AccountController(object):
             return HTTPNotAcceptable(request=req)
         return HTTPNoContent(request=req, headers=headers, charset='utf-8')
 
+    def _json_listing_iter(self, account_list):
+        """
+        Serialize a listing as JSON, one entry at a time.
+
+        :param account_list: rows returned by list_containers_iter
+        """
+        yield '['
+        separator = ''
+        for (name, object_count, bytes_used, is_subdir) in account_list:
+            if is_subdir:
+                entry = {'subdir': name}
+            else:
+                entry = {'name': name, 'count': object_count,
+                         'bytes': bytes_used}
+            yield separator + json.dumps(entry)
+            separator = ', '
+        yield ']'
+
+    def _xml_listing_iter(self, account, account_list):
+        """
+        Serialize a listing as XML, one entry at a time.
+
+        :param account: account name
+        :param account_list: rows returned by list_containers_iter
+        """
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield '<account name="%s">' % account
+        for (name, object_count, bytes_used, is_subdir) in account_list:
+            name = saxutils.escape(name)
+            if is_subdir:
+                yield '\n<subdir name="%s" />' % name
+            else:
+                yield '\n<container><name>%s</name><count>%s</count>' \
+                    '<bytes>%s</bytes></container>' % \
+                    (name, object_count, bytes_used)
+        yield '\n</account>'
+
     @public
     @timing_stats()
     def GET(self, req):
@@ -189,9 +269,9 @@ class AccountController(object):
         broker = self._get_account_broker(drive, part, account)
         broker.pending_timeout = 0.1
         broker.stale_reads_ok = True
-        if broker.is_deleted():
+        deleted, info, metadata = self._get_stat(broker)
+        if deleted:
             return HTTPNotFound(request=req)
-        info = broker.get_info()
         resp_headers = {
             'X-Account-Container-Count': info['container_count'],
             'X-Account-Object-Count': info['object_count'],
@@ -200,7 +280,7 @@ class AccountController(object):
             'X-PUT-Timestamp': info['put_timestamp']}
         resp_headers.update((key, value)
                             for key, (value, timestamp) in
-                            broker.metadata.iteritems() if value != '')
+                            metadata.iteritems() if value != '')
         try:
             prefix = get_param(req, 'prefix')
             delimiter = get_param(req, 'delimiter')
@@ -228,36 +308,33 @@ class AccountController(object):
             ['text/plain', 'application/json', 'application/xml', 'text/xml'])
         if not out_content_type:
             return HTTPNotAcceptable(request=req)
-        account_list = broker.list_containers_iter(limit, marker, end_marker,
-                                                   prefix, delimiter)
+
+        def list_page(marker, limit):
+            return broker.list_containers_iter(limit, marker, end_marker,
+                                               prefix, delimiter)
+
+        account_list = list_page(marker, min(limit, LISTING_CHUNK_ROWS))
+        streamed = len(account_list) == LISTING_CHUNK_ROWS < limit
+        if streamed:
+            # stream long listings a page at a time rather than read them
+            # and build the body in memory
+            account_list = iter_listing(
+                list_page, account_list, limit, LISTING_CHUNK_ROWS)
         if out_content_type == 'application/json':
-            data = []
-            for (name, object_count, bytes_used, is_subdir) in account_list:
-                if is_subdir:
-                    data.append({'subdir': name})
-                else:
-                    data.append({'name': name, 'count': object_count,
-                                'bytes': bytes_used})
-            account_list = json.dumps(data)
+            body_iter = self._json_listing_iter(account_list)
         elif out_content_type.endswith('/xml'):
-            output_list = ['<?xml version="1.0" encoding="UTF-8"?>',
-                           '<account name="%s">' % account]
-            for (name, object_count, bytes_used, is_subdir) in account_list:
-                name = saxutils.escape(name)
-                if is_subdir:
-                    output_list.append('<subdir name="%s" />' % name)
-                else:
-                    item = '<container><name>%s</name><count>%s</count>' \
-                           '<bytes>%s</bytes></container>' % \
-                           (name, object_count, bytes_used)
-                    output_list.append(item)
-            output_list.append('</account>')
-            account_list = '\n'.join(output_list)
+            body_iter = self._xml_listing_iter(account, account_list)
         else:
             if not account_list:
                 return HTTPNoContent(request=req, headers=resp_headers)
-            account_list = '\n'.join(r[0] for r in account_list) + '\n'
-        ret = Response(body=account_list, request=req, headers=resp_headers)
+            body_iter = ('%s\n' % r[0] for r in account_list)
+        if streamed:
+            ret = Response(app_iter=joined_chunks(body_iter,
+                                                  LISTING_CHUNK_ROWS),
+                           request=req, headers=resp_headers)
+        else:
+            ret = Response(body=''.join(body_iter), request=req,
+                           headers=resp_headers)
         ret.content_type = out_content_type
         ret.charset = 'utf-8'
         return ret
@@ -279,8 +356,11 @@ class AccountController(object):
         if self.mount_check and not check_mount(self.root, drive):
             return HTTPInsufficientStorage(drive=drive, request=req)
         try:
-            args = json.load(req.environ['wsgi.input'])
-        except ValueError, err:
+            body = req.environ['wsgi.input'].read()
+            if req.headers.get('Content-Encoding') == 'deflate':
+                body = zlib.decompress(body)
+            args = json.loads(body)
+        except (ValueError, zlib.error), err:
             return HTTPBadRequest(body=str(err), content_type='text/plain')
         ret = self.replicator_rpc.dispatch(post_args, args)
         ret.request = req
@@ -304,6 +384,8 @@ class AccountController(object):
         if self.mount_check and not check_mount(self.root, drive):
             return HTTPInsufficientStorage(drive=drive, request=req)
         broker = self._get_account_broker(drive, part, account)
+        if self.stat_cache:
+            self.stat_cache.invalidate(broker)
         if broker.is_deleted():
             return HTTPNotFound(request=req)
         timestamp = normalize_timestamp(req.headers['x-timestamp'])
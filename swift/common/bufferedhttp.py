@@ -108,6 +108,110 @@ class BufferedHTTPConnection(HTTPConnection):
         return response
 
 
+class BufferedHTTPConnectionPool(object):
+    """
+    Keeps idle HTTP/1.1 keep-alive BufferedHTTPConnections around, per
+    (ip, port), so that a caller making many backend requests to the same
+    nodes does not pay for a fresh TCP connection every time.
+
+    A connection may only be handed back with :meth:`put` once its response
+    has been read completely.
+
+    :param max_idle_per_node: maximum number of idle connections kept for
+                              any one node
+    :param idle_timeout: seconds after which an idle connection is closed
+                         rather than reused
+    """
+
+    def __init__(self, max_idle_per_node=4, idle_timeout=60):
+        self.max_idle_per_node = max_idle_per_node
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._last_eviction = time.time()
+
+    def get(self, ipaddr, port):
+        """
+        Get a connection to a node, reusing an idle one if possible.  The
+        returned connection's ``reused`` attribute tells the caller whether
+        it may have been closed by the other end in the meantime.
+
+        :param ipaddr: IP address of the node
+        :param port: port of the node
+        :returns: BufferedHTTPConnection object
+        """
+        idle = self._idle.get((ipaddr, int(port)))
+        now = time.time()
+        while idle:
+            conn, last_used = idle.pop()
+            if conn.sock is not None and \
+                    now - last_used < self.idle_timeout:
+                conn.reused = True
+                return conn
+            conn.close()
+        conn = BufferedHTTPConnection('%s:%s' % (ipaddr, port))
+        conn.reused = False
+        return conn
+
+    def put(self, conn):
+        """
+        Return a connection to the pool.  Connections the server asked to
+        close, and connections beyond max_idle_per_node, are closed instead.
+
+        :param conn: connection obtained from :meth:`get`
+        """
+        if conn.sock is None:
+            return
+        now = time.time()
+        if now - self._last_eviction >= self.idle_timeout:
+            self.evict_idle(now)
+        idle = self._idle.setdefault((conn.host, conn.port), [])
+        if len(idle) >= self.max_idle_per_node:
+            conn.close()
+            return
+        idle.append((conn, now))
+
+    def evict_idle(self, now=None):
+        """
+        Close the connections that have been idle for idle_timeout seconds
+        or more, for every node.  This also happens on its own from
+        :meth:`put` once every idle_timeout seconds.
+
+        :param now: current time, defaults to time.time()
+        """
+        if now is None:
+            now = time.time()
+        self._last_eviction = now
+        for node, idle in self._idle.items():
+            keep = []
+            for conn, last_used in idle:
+                if now - last_used < self.idle_timeout:
+                    keep.append((conn, last_used))
+                else:
+                    conn.close()
+            if keep:
+                self._idle[node] = keep
+            else:
+                del self._idle[node]
+
+    def purge(self, ipaddr, port):
+        """
+        Close all idle connections to a node, e.g. once it has started
+        returning errors.
+
+        :param ipaddr: IP address of the node
+        :param port: port of the node
+        """
+        for conn, _junk in self._idle.pop((ipaddr, int(port)), []):
+            conn.close()
+
+    def close(self):
+        """Close all idle connections."""
+        idle, self._idle = self._idle, {}
+        for conns in idle.itervalues():
+            for conn, _junk in conns:
+                conn.close()
+
+
 def http_connect(ipaddr, port, device, partition, method, path,
                  headers=None, query_string=None, ssl=False):
     """
@@ -126,14 +230,53 @@ def http_connect(ipaddr, port, device, partition, method, path,
     :param ssl: set True if SSL should be used (default: False)
     :returns: HTTPConnection object
     """
+    path = _device_path(device, partition, path)
+    return http_connect_raw(
+        ipaddr, port, method, path, headers, query_string, ssl)
+
+
+def http_connect_pooled(pool, ipaddr, port, device, partition, method, path,
+                        headers=None, query_string=None):
+    """
+    Like :func:`http_connect`, but the connection is taken from a
+    :class:`BufferedHTTPConnectionPool`.  Hand it back to the pool with
+    pool.put(conn) once the response has been read.
+
+    :param pool: BufferedHTTPConnectionPool to take the connection from
+    :param ipaddr: IPv4 address to connect to
+    :param port: port to connect to
+    :param device: device of the node to query
+    :param partition: partition on the device
+    :param method: HTTP method to request ('GET', 'PUT', 'POST', etc.)
+    :param path: request path
+    :param headers: dictionary of headers
+    :param query_string: request query string
+    :returns: BufferedHTTPConnection object
+    """
+    conn = pool.get(ipaddr, port)
+    _send_request(conn, method, _device_path(device, partition, path),
+                  headers, query_string)
+    return conn
+
+
+def _device_path(device, partition, path):
     if isinstance(path, unicode):
         try:
             path = path.encode("utf-8")
         except UnicodeError, e:
             logging.exception(_('Error encoding to UTF-8: %s'), e.message)
-    path = quote('/' + device + '/' + str(partition) + path)
-    return http_connect_raw(
-        ipaddr, port, method, path, headers, query_string, ssl)
+    return quote('/' + device + '/' + str(partition) + path)
+
+
+def _send_request(conn, method, path, headers, query_string):
+    if query_string:
+        path += '?' + query_string
+    conn.path = path
+    conn.putrequest(method, path, skip_host=(headers and 'Host' in headers))
+    if headers:
+        for header, value in headers.iteritems():
+            conn.putheader(header, str(value))
+    conn.endheaders()
 
 
 def http_connect_raw(ipaddr, port, method, path, headers=None,
@@ -158,12 +301,5 @@ def http_connect_raw(ipaddr, port, method, path, headers=None,
         conn = HTTPSConnection('%s:%s' % (ipaddr, port))
     else:
         conn = BufferedHTTPConnection('%s:%s' % (ipaddr, port))
-    if query_string:
-        path += '?' + query_string
-    conn.path = path
-    conn.putrequest(method, path, skip_host=(headers and 'Host' in headers))
-    if headers:
-        for header, value in headers.iteritems():
-            conn.putheader(header, str(value))
-    conn.endheaders()
+    _send_request(conn, method, path, headers, query_string)
     return conn
@@ -20,6 +20,9 @@ from contextlib import contextmanager
 import hashlib
 import logging
 import os
+import re
+import struct
+from zlib import crc32
 from uuid import uuid4
 import sys
 import time
@@ -27,11 +30,12 @@ import cPickle as pickle
 import errno
 from tempfile import mkstemp
 
-from eventlet import sleep, Timeout
+from eventlet import sleep, spawn, Timeout
+from eventlet.event import Event
 import sqlite3
 
 from swift.common.utils import json, normalize_timestamp, renamer, \
-    mkdirs, lock_parent_directory, fallocate
+    mkdirs, lock_parent_directory, fallocate, fsync, LRUCache
 from swift.common.exceptions import LockTimeout
 
 
@@ -41,14 +45,115 @@ DB_PREALLOCATION = True
 BROKER_TIMEOUT = 25
 #: Pickle protocol to use
 PICKLE_PROTOCOL = 2
-#: Max number of pending entries
+#: Rows of a subdirectory a delimiter listing reads past before it seeks to
+#: the end of the subdirectory with a new query
+DELIMITER_SCAN_ROWS = 16
+#: Max size of a .pending file, in bytes, before updates are merged directly
 PENDING_CAP = 131072
+#: Number of .pending entries merged into the database per transaction
+PENDING_COMMIT_BATCH = 1000
+#: Whether appends to .pending files are fsynced
+PENDING_FSYNC = False
+#: Whether .pending entries are written framed rather than base64 encoded.
+#: Versions before the framed format only read base64 entries, so this is
+#: turned on only once every process on the node reads both.
+PENDING_FRAMED = False
+#: Marks the start of each framed entry in a .pending file
+PENDING_MAGIC = '\x00\xffSP'
+#: Header of each framed entry: marker, length and CRC-32 of the pickle
+PENDING_HEADER = struct.Struct('!4sII')
+# .pending entries as written by older versions: base64 pickles, each
+# preceded by a colon
+LEGACY_PENDING_ENTRY = re.compile(r':([A-Za-z0-9+/=\n]*)')
+
+# entries waiting to be appended to a .pending file, by file, along with the
+# events of the greenthreads that queued them
+_pending_groups = {}
 
 
 def utf8encode(*args):
     return [(s.encode('utf8') if isinstance(s, unicode) else s) for s in args]
 
 
+def pending_entry(data):
+    """
+    Encode a pickled record to be appended to a .pending file, in the format
+    chosen by PENDING_FRAMED.
+
+    :param data: pickled record
+    :returns: the encoded entry
+    """
+    if PENDING_FRAMED:
+        return PENDING_HEADER.pack(
+            PENDING_MAGIC, len(data), crc32(data) & 0xffffffff) + data
+    return ':' + data.encode('base64')
+
+
+def iter_pending_entries(fp, chunk_size=65536, on_corrupt=None):
+    """
+    Yield the pickled entries of a .pending file, reading it chunk_size bytes
+    at a time.  Both framed and base64 entries are read.  A framed entry that
+    is cut short, say by a crash while it was being appended, or that fails
+    its checksum is skipped along with anything up to the next marker, so the
+    entries appended after it are still read.
+
+    :param fp: file object of the .pending file
+    :param chunk_size: size of the reads from fp
+    :param on_corrupt: called with the number of bytes skipped, if any
+    """
+    buf = ''
+    pos = 0
+    eof = False
+    skipped = 0
+    want = PENDING_HEADER.size
+    while True:
+        while not eof and len(buf) - pos < want:
+            chunk = fp.read(max(chunk_size, want - len(buf) + pos))
+            if chunk:
+                buf = buf[pos:] + chunk
+                pos = 0
+            else:
+                eof = True
+        if pos == len(buf):
+            if skipped and on_corrupt:
+                on_corrupt(skipped)
+            return
+        want = PENDING_HEADER.size
+        if buf[pos] == ':':
+            match = LEGACY_PENDING_ENTRY.match(buf, pos)
+            if match.end() == len(buf) and not eof:
+                # the entry may go on past what has been read so far
+                want = len(buf) - pos + chunk_size
+                continue
+            pos = match.end()
+            if match.group(1):
+                try:
+                    yield match.group(1).decode('base64')
+                except Exception:
+                    yield match.group(1)
+            continue
+        if buf.startswith(PENDING_MAGIC, pos) and \
+                len(buf) - pos >= PENDING_HEADER.size:
+            _junk, length, crc = PENDING_HEADER.unpack_from(buf, pos)
+            start = pos + PENDING_HEADER.size
+            if start + length > len(buf) and not eof:
+                want = PENDING_HEADER.size + length
+                continue
+            data = buf[start:start + length]
+            if len(data) == length and crc32(data) & 0xffffffff == crc:
+                pos = start + length
+                yield data
+                continue
+        # not the start of a whole entry: skip to the next marker
+        found = buf.find(PENDING_MAGIC, pos + 1)
+        if found < 0:
+            # keep a tail that may be the start of a marker cut by the read
+            found = len(buf) if eof else \
+                max(pos + 1, len(buf) - len(PENDING_MAGIC) + 1)
+        skipped += found - pos
+        pos = found
+
+
 class DatabaseConnectionError(sqlite3.DatabaseError):
     """More friendly error messages for DB Errors."""
 
@@ -149,18 +254,156 @@ def get_db_connection(path, timeout=30, okay_to_create=False):
     return conn
 
 
+class PendingFlusher(object):
+    """
+    Merges the .pending files of the databases a server queues updates to in
+    a greenthread of its own: every interval seconds, or as soon as one of
+    them has grown past watermark bytes.  The server's brokers are then made
+    with defer_pending: get_info, is_deleted and listings then read the
+    committed rows, up to interval seconds behind, rather than merge recent
+    updates inline.
+
+    :param interval: seconds between flushes
+    :param watermark: size of a .pending file, in bytes, that triggers an
+                      early flush
+    :param logger: logger to use
+    """
+
+    def __init__(self, interval, watermark, logger):
+        self.interval = interval
+        self.watermark = watermark
+        self.logger = logger
+        self.dirty = {}
+        self.wakeup = Event()
+        self.thread = None
+
+    def add(self, broker):
+        """
+        Note that a broker has updates queued in its .pending file.
+
+        :param broker: the DatabaseBroker that queued the updates
+        """
+        self.dirty[broker.pending_file] = broker
+        if self.thread is None:
+            self.thread = spawn(self.run_forever)
+        if self.wakeup.ready():
+            return
+        try:
+            if os.path.getsize(broker.pending_file) > self.watermark:
+                self.wakeup.send()
+        except OSError, err:
+            if err.errno != errno.ENOENT:
+                raise
+
+    def run_forever(self):
+        """Flush the noted .pending files until killed."""
+        while True:
+            with Timeout(self.interval, False):
+                self.wakeup.wait()
+            self.wakeup = Event()
+            self.flush()
+
+    def flush(self):
+        """
+        Merge every noted .pending file; files whose lock is busy are kept
+        for the next flush.
+        """
+        dirty, self.dirty = self.dirty, {}
+        for pending_file, broker in dirty.iteritems():
+            try:
+                broker._commit_puts()
+            except LockTimeout:
+                self.dirty.setdefault(pending_file, broker)
+            except (Exception, Timeout):
+                self.logger.exception(
+                    _('ERROR flushing pending updates of %s'), pending_file)
+            sleep()
+
+
+class StatCache(object):
+    """
+    In-process cache of what HEADs and GETs read from the stat table of a
+    database: whether it is deleted, its info and its metadata.  An entry is
+    only used while the DB file, and the .pending file unless the broker
+    defers pending updates, keep the mtime and size they had when it was
+    made, so answering a HEAD from the cache costs a stat call or two rather
+    than opening the database.
+
+    :param max_size: maximum number of databases cached
+    :param ttl: seconds an entry is used for at most
+    """
+
+    def __init__(self, max_size, ttl):
+        self.entries = LRUCache(max_size, ttl)
+
+    def _stamp(self, broker):
+        """
+        :returns: the mtimes and sizes of the files the broker reads from, or
+                  None if the database does not exist
+        """
+        if broker.defer_pending:
+            paths = (broker.db_file,)
+        else:
+            paths = (broker.db_file, broker.pending_file)
+        stamp = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError, err:
+                if err.errno != errno.ENOENT:
+                    raise
+                if path == broker.db_file:
+                    return None
+                stamp.append(None)
+            else:
+                stamp.append((st.st_mtime, st.st_size))
+        return tuple(stamp)
+
+    def get(self, broker):
+        """
+        Get the state of a database, from the cache if still valid.
+
+        :param broker: DatabaseBroker of the database
+        :returns: tuple of (deleted, info, metadata); info and metadata are
+                  None if the database is deleted
+        """
+        stamp = self._stamp(broker)
+        if stamp is not None:
+            entry = self.entries.get(broker.db_file)
+            if entry and entry[0] == stamp:
+                return entry[1]
+        if broker.is_deleted():
+            value = (True, None, None)
+        else:
+            value = (False, broker.get_info(), broker.metadata)
+        # the reads may have merged pending updates, or raced with a write;
+        # only cache what is known to match the stamp
+        if stamp is not None and self._stamp(broker) == stamp:
+            self.entries.set(broker.db_file, (stamp, value))
+        return value
+
+    def invalidate(self, broker):
+        """
+        Drop the entry of a database, ahead of a write to it.
+
+        :param broker: DatabaseBroker of the database
+        """
+        self.entries.delete(broker.db_file)
+
+
 class DatabaseBroker(object):
     """Encapsulates working with a database."""
 
     def __init__(self, db_file, timeout=BROKER_TIMEOUT, logger=None,
                  account=None, container=None, pending_timeout=10,
-                 stale_reads_ok=False):
+                 stale_reads_ok=False, defer_pending=False):
         """ Encapsulates working with a database. """
         self.conn = None
         self.db_file = db_file
         self.pending_file = self.db_file + '.pending'
         self.pending_timeout = pending_timeout
         self.stale_reads_ok = stale_reads_ok
+        self.defer_pending = defer_pending
         self.db_dir = os.path.dirname(db_file)
         self.timeout = timeout
         self.logger = logger or logging.getLogger()
@@ -477,8 +720,167 @@ class DatabaseBroker(object):
             curs.row_factory = dict_factory
             return curs.fetchone()
 
-    def _commit_puts(self):
-        pass    # stub to be overridden if need be
+    def _commit_puts(self, item_list=None):
+        """
+        Merge the entries of the .pending file, and those of item_list, into
+        the database PENDING_COMMIT_BATCH at a time, then empty the file.
+
+        :param item_list: records to merge along with the pending entries
+        """
+        if self.db_file == ':memory:' or not os.path.exists(self.pending_file):
+            return
+        if item_list is None:
+            item_list = []
+        with lock_parent_directory(self.pending_file, self.pending_timeout):
+            self._preallocate()
+            if not os.path.getsize(self.pending_file):
+                if item_list:
+                    self.merge_items(item_list)
+                return
+
+            def on_corrupt(size):
+                self.logger.error(
+                    _('Skipped %(size)d corrupt bytes of %(file)s'),
+                    {'size': size, 'file': self.pending_file})
+
+            with open(self.pending_file, 'r+b') as fp:
+                for entry in iter_pending_entries(fp, on_corrupt=on_corrupt):
+                    try:
+                        self._commit_puts_load(item_list, entry)
+                    except Exception:
+                        self.logger.exception(
+                            _('Invalid pending entry %(file)s: %(entry)s'),
+                            {'file': self.pending_file, 'entry': entry})
+                    if len(item_list) >= PENDING_COMMIT_BATCH:
+                        self.merge_items(item_list)
+                        item_list = []
+                if item_list:
+                    self.merge_items(item_list)
+                try:
+                    os.ftruncate(fp.fileno(), 0)
+                except OSError, err:
+                    if err.errno != errno.ENOENT:
+                        raise
+
+    def _commit_puts_load(self, item_list, entry):
+        """
+        Unmarshall an entry of the .pending file and append it to item_list;
+        to be overridden by brokers that use put_record.
+
+        :param item_list: list of records being merged
+        :param entry: pickled entry read from the .pending file
+        """
+        raise NotImplementedError
+
+    def make_tuple_for_pickle(self, record):
+        """
+        Turn a record into the tuple stored in the .pending file; to be
+        overridden by brokers that use put_record.
+
+        :param record: dict of the record
+        """
+        raise NotImplementedError
+
+    def _load_incoming(self, conn, table, columns, rows):
+        """
+        Load the rows being merged into a temporary table of the connection
+        in one executemany, so merge_items can resolve them against the
+        database with a few set-based statements.  Must be called before
+        anything else is done in the transaction, as creating the table
+        commits whatever is pending.
+
+        :param conn: DB connection object
+        :param table: name of the temporary table
+        :param columns: column definitions of the temporary table
+        :param rows: sequence of tuples to load
+        """
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS %s (%s)' %
+                     (table, ', '.join(columns)))
+        conn.execute('DELETE FROM %s' % table)
+        conn.executemany('INSERT INTO %s VALUES (%s)' %
+                         (table, ', '.join('?' * len(columns))), rows)
+
+    def _merge_incoming_sync(self, conn, item_list, source):
+        """
+        Record the highest remote ROWID merged from source.
+
+        :param conn: DB connection object
+        :param item_list: records that were merged
+        :param source: id of the remote database
+        """
+        max_rowid = max([rec['ROWID'] for rec in item_list] or [-1])
+        try:
+            conn.execute('''
+                INSERT INTO incoming_sync (sync_point, remote_id)
+                VALUES (?, ?)
+            ''', (max_rowid, source))
+        except sqlite3.IntegrityError:
+            conn.execute('''
+                UPDATE incoming_sync SET sync_point=max(?, sync_point)
+                WHERE remote_id=?
+            ''', (max_rowid, source))
+
+    def put_record(self, record):
+        """
+        Queue a record to be merged into the database by appending it to the
+        .pending file, or merge it straight away along with the rest of the
+        file once the file has grown past PENDING_CAP.
+
+        :param record: dict of the record, as taken by merge_items
+        """
+        if self.db_file == ':memory:':
+            self.merge_items([record])
+            return
+        if not os.path.exists(self.db_file):
+            raise DatabaseConnectionError(self.db_file, "DB doesn't exist")
+        pending_size = 0
+        try:
+            pending_size = os.path.getsize(self.pending_file)
+        except OSError, err:
+            if err.errno != errno.ENOENT:
+                raise
+        if pending_size > PENDING_CAP:
+            self._commit_puts([record])
+        else:
+            entry = pickle.dumps(self.make_tuple_for_pickle(record),
+                                 protocol=PICKLE_PROTOCOL)
+            self._append_pending(pending_entry(entry))
+
+    def _append_pending(self, entry):
+        """
+        Append an entry to the .pending file.  Appends to the same file made
+        while another greenthread is waiting for its lock are left to that
+        greenthread, which writes them all at once: a hot container then
+        takes one lock, and with PENDING_FSYNC one fsync, per group of
+        updates rather than per update.
+
+        :param entry: encoded entry to append
+        """
+        group = _pending_groups.get(self.pending_file)
+        if group is not None:
+            event = Event()
+            group.append((entry, event))
+            event.wait()
+            return
+        group = [(entry, None)]
+        _pending_groups[self.pending_file] = group
+        try:
+            with lock_parent_directory(self.pending_file,
+                                       self.pending_timeout):
+                del _pending_groups[self.pending_file]
+                with open(self.pending_file, 'a+b') as fp:
+                    fp.write(''.join(queued for queued, _junk in group))
+                    fp.flush()
+                    if PENDING_FSYNC:
+                        fsync(fp.fileno())
+        except (Exception, Timeout), err:
+            if _pending_groups.get(self.pending_file) is group:
+                del _pending_groups[self.pending_file]
+            for _junk, event in group[1:]:
+                event.send_exception(err)
+            raise
+        for _junk, event in group[1:]:
+            event.send()
 
     def merge_syncs(self, sync_points, incoming=True):
         """
@@ -788,41 +1190,21 @@ class ContainerBroker(DatabaseBroker):
                 'SELECT object_count from container_stat').fetchone()
             return (row[0] == 0)
 
-    def _commit_puts(self, item_list=None):
-        """Handles committing rows in .pending files."""
-        if self.db_file == ':memory:' or not os.path.exists(self.pending_file):
-            return
-        if item_list is None:
-            item_list = []
-        with lock_parent_directory(self.pending_file, self.pending_timeout):
-            self._preallocate()
-            if not os.path.getsize(self.pending_file):
-                if item_list:
-                    self.merge_items(item_list)
-                return
-            with open(self.pending_file, 'r+b') as fp:
-                for entry in fp.read().split(':'):
-                    if entry:
-                        try:
-                            (name, timestamp, size, content_type, etag,
-                                deleted) = pickle.loads(entry.decode('base64'))
-                            item_list.append({'name': name,
-                                              'created_at': timestamp,
-                                              'size': size,
-                                              'content_type': content_type,
-                                              'etag': etag,
-                                              'deleted': deleted})
-                        except Exception:
-                            self.logger.exception(
-                                _('Invalid pending entry %(file)s: %(entry)s'),
-                                {'file': self.pending_file, 'entry': entry})
-                if item_list:
-                    self.merge_items(item_list)
-                try:
-                    os.ftruncate(fp.fileno(), 0)
-                except OSError, err:
-                    if err.errno != errno.ENOENT:
-                        raise
+    def _commit_puts_load(self, item_list, entry):
+        """See :func:`swift.common.db.DatabaseBroker._commit_puts_load`"""
+        (name, timestamp, size, content_type, etag, deleted) = \
+            pickle.loads(entry)
+        item_list.append({'name': name,
+                          'created_at': timestamp,
+                          'size': size,
+                          'content_type': content_type,
+                          'etag': etag,
+                          'deleted': deleted})
+
+    def make_tuple_for_pickle(self, record):
+        """See :func:`swift.common.db.DatabaseBroker.make_tuple_for_pickle`"""
+        return (record['name'], record['created_at'], record['size'],
+                record['content_type'], record['etag'], record['deleted'])
 
     def reclaim(self, object_timestamp, sync_timestamp):
         """
@@ -881,30 +1263,7 @@ class ContainerBroker(DatabaseBroker):
         record = {'name': name, 'created_at': timestamp, 'size': size,
                   'content_type': content_type, 'etag': etag,
                   'deleted': deleted}
-        if self.db_file == ':memory:':
-            self.merge_items([record])
-            return
-        if not os.path.exists(self.db_file):
-            raise DatabaseConnectionError(self.db_file, "DB doesn't exist")
-        pending_size = 0
-        try:
-            pending_size = os.path.getsize(self.pending_file)
-        except OSError, err:
-            if err.errno != errno.ENOENT:
-                raise
-        if pending_size > PENDING_CAP:
-            self._commit_puts([record])
-        else:
-            with lock_parent_directory(
-                    self.pending_file, self.pending_timeout):
-                with open(self.pending_file, 'a+b') as fp:
-                    # Colons aren't used in base64 encoding; so they are our
-                    # delimiter
-                    fp.write(':')
-                    fp.write(pickle.dumps(
-                        (name, timestamp, size, content_type, etag, deleted),
-                        protocol=PICKLE_PROTOCOL).encode('base64'))
-                    fp.flush()
+        self.put_record(record)
 
     def is_deleted(self, timestamp=None):
         """
@@ -914,11 +1273,12 @@ class ContainerBroker(DatabaseBroker):
         """
         if self.db_file != ':memory:' and not os.path.exists(self.db_file):
             return True
-        try:
-            self._commit_puts()
-        except LockTimeout:
-            if not self.stale_reads_ok:
-                raise
+        if not self.defer_pending:
+            try:
+                self._commit_puts()
+            except LockTimeout:
+                if not self.stale_reads_ok:
+                    raise
         with self.get() as conn:
             row = conn.execute('''
                 SELECT put_timestamp, delete_timestamp, object_count
@@ -944,11 +1304,12 @@ class ContainerBroker(DatabaseBroker):
                   If include_metadata is set, metadata is included as a key
                   pointing to a dict of tuples of the metadata
         """
-        try:
-            self._commit_puts()
-        except LockTimeout:
-            if not self.stale_reads_ok:
-                raise
+        if not self.defer_pending:
+            try:
+                self._commit_puts()
+            except LockTimeout:
+                if not self.stale_reads_ok:
+                    raise
         with self.get() as conn:
             data = None
             trailing1 = 'metadata'
@@ -1066,11 +1427,12 @@ class ContainerBroker(DatabaseBroker):
         """
         (marker, end_marker, prefix, delimiter, path) = utf8encode(
             marker, end_marker, prefix, delimiter, path)
-        try:
-            self._commit_puts()
-        except LockTimeout:
-            if not self.stale_reads_ok:
-                raise
+        if not self.defer_pending:
+            try:
+                self._commit_puts()
+            except LockTimeout:
+                if not self.stale_reads_ok:
+                    raise
         if path is not None:
             prefix = path
             if path:
@@ -1080,7 +1442,13 @@ class ContainerBroker(DatabaseBroker):
             prefix = ''
         orig_marker = marker
         with self.get() as conn:
+            if self.get_db_version(conn) < 1:
+                deleted_clause = ' +deleted = 0'
+            else:
+                deleted_clause = ' deleted = 0'
             results = []
+            # where the rows of the subdirectory being skipped end
+            skip_to = None
             while len(results) < limit:
                 query = '''SELECT name, created_at, size, content_type, etag
                            FROM object WHERE'''
@@ -1094,11 +1462,7 @@ class ContainerBroker(DatabaseBroker):
                 elif prefix:
                     query += ' name >= ? AND'
                     query_args.append(prefix)
-                if self.get_db_version(conn) < 1:
-                    query += ' +deleted = 0'
-                else:
-                    query += ' deleted = 0'
-                query += ' ORDER BY name LIMIT ?'
+                query += deleted_clause + ' ORDER BY name LIMIT ?'
                 query_args.append(limit - len(results))
                 curs = conn.execute(query, query_args)
                 curs.row_factory = None
@@ -1108,9 +1472,21 @@ class ContainerBroker(DatabaseBroker):
                 if not delimiter:
                     return [r for r in curs if r[0].startswith(prefix)]
                 rowcount = 0
+                skipped = 0
                 for row in curs:
                     rowcount += 1
-                    marker = name = row[0]
+                    name = row[0]
+                    if skip_to is not None:
+                        # a few more rows of a subdirectory are cheaper to
+                        # read through than a new query is to run
+                        if name <= skip_to:
+                            skipped += 1
+                            if skipped < DELIMITER_SCAN_ROWS:
+                                continue
+                            curs.close()
+                            break
+                        skip_to = None
+                    marker = name
                     if len(results) >= limit or not name.startswith(prefix):
                         curs.close()
                         return results
@@ -1119,19 +1495,21 @@ class ContainerBroker(DatabaseBroker):
                         if name == path:
                             continue
                         if end >= 0 and len(name) > end + len(delimiter):
-                            marker = name[:end] + chr(ord(delimiter) + 1)
-                            curs.close()
-                            break
+                            marker = skip_to = \
+                                name[:end] + chr(ord(delimiter) + 1)
+                            skipped = 0
+                            continue
                     elif end > 0:
-                        marker = name[:end] + chr(ord(delimiter) + 1)
+                        marker = skip_to = name[:end] + chr(ord(delimiter) + 1)
+                        skipped = 0
                         dir_name = name[:end + 1]
                         if dir_name != orig_marker:
                             results.append([dir_name, '0', 0, None, ''])
-                        curs.close()
-                        break
+                        continue
                     results.append(row)
                 if not rowcount:
                     break
+                skip_to = None
             return results
 
     def merge_items(self, item_list, source=None):
@@ -1142,39 +1520,42 @@ class ContainerBroker(DatabaseBroker):
                           'size', 'content_type', 'etag', 'deleted'}
         :param source: if defined, update incoming_sync with the source
         """
+        # Only the newest incoming row of each name can survive; on a tie
+        # the first one wins, and it keeps its place in the insert order.
+        incoming = {}
+        for seq, rec in enumerate(item_list):
+            prev = incoming.get(rec['name'])
+            if prev is None or prev[1] < rec['created_at']:
+                incoming[rec['name']] = (
+                    seq, rec['created_at'], rec['name'], rec['size'],
+                    rec['content_type'], rec['etag'], rec['deleted'])
         with self.get() as conn:
-            max_rowid = -1
-            for rec in item_list:
-                query = '''
-                    DELETE FROM object
-                    WHERE name = ? AND (created_at < ?)
-                '''
-                if self.get_db_version(conn) >= 1:
-                    query += ' AND deleted IN (0, 1)'
-                conn.execute(query, (rec['name'], rec['created_at']))
-                query = 'SELECT 1 FROM object WHERE name = ?'
-                if self.get_db_version(conn) >= 1:
-                    query += ' AND deleted IN (0, 1)'
-                if not conn.execute(query, (rec['name'],)).fetchall():
-                    conn.execute('''
-                        INSERT INTO object (name, created_at, size,
-                            content_type, etag, deleted)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', ([rec['name'], rec['created_at'], rec['size'],
-                          rec['content_type'], rec['etag'], rec['deleted']]))
-                if source:
-                    max_rowid = max(max_rowid, rec['ROWID'])
+            self._load_incoming(
+                conn, 'incoming_object',
+                ('seq INTEGER', 'created_at TEXT', 'name TEXT PRIMARY KEY',
+                 'size INTEGER', 'content_type TEXT', 'etag TEXT',
+                 'deleted INTEGER'),
+                incoming.itervalues())
+            deleted_clause = ''
+            if self.get_db_version(conn) >= 1:
+                deleted_clause = 'deleted IN (0, 1) AND '
+            conn.execute('''
+                DELETE FROM object
+                WHERE %sname IN (SELECT name FROM incoming_object)
+                AND created_at < (SELECT created_at FROM incoming_object
+                                  WHERE incoming_object.name = object.name)
+            ''' % deleted_clause)
+            conn.execute('''
+                INSERT INTO object (name, created_at, size, content_type,
+                                    etag, deleted)
+                SELECT name, created_at, size, content_type, etag, deleted
+                FROM incoming_object
+                WHERE NOT EXISTS (SELECT 1 FROM object
+                                  WHERE %sobject.name = incoming_object.name)
+                ORDER BY seq
+            ''' % deleted_clause)
             if source:
-                try:
-                    conn.execute('''
-                        INSERT INTO incoming_sync (sync_point, remote_id)
-                        VALUES (?, ?)
-                    ''', (max_rowid, source))
-                except sqlite3.IntegrityError:
-                    conn.execute('''
-                        UPDATE incoming_sync SET sync_point=max(?, sync_point)
-                        WHERE remote_id=?
-                    ''', (max_rowid, source))
+                self._merge_incoming_sync(conn, item_list, source)
             conn.commit()
 
 
@@ -1315,43 +1696,22 @@ class AccountBroker(DatabaseBroker):
                 status_changed_at = ?
             WHERE delete_timestamp < ? """, (timestamp, timestamp, timestamp))
 
-    def _commit_puts(self, item_list=None):
-        """Handles committing rows in .pending files."""
-        if self.db_file == ':memory:' or not os.path.exists(self.pending_file):
-            return
-        if item_list is None:
-            item_list = []
-        with lock_parent_directory(self.pending_file, self.pending_timeout):
-            self._preallocate()
-            if not os.path.getsize(self.pending_file):
-                if item_list:
-                    self.merge_items(item_list)
-                return
-            with open(self.pending_file, 'r+b') as fp:
-                for entry in fp.read().split(':'):
-                    if entry:
-                        try:
-                            (name, put_timestamp, delete_timestamp,
-                             object_count, bytes_used, deleted) = \
-                                pickle.loads(entry.decode('base64'))
-                            item_list.append(
-                                {'name': name,
-                                 'put_timestamp': put_timestamp,
-                                 'delete_timestamp': delete_timestamp,
-                                 'object_count': object_count,
-                                 'bytes_used': bytes_used,
-                                 'deleted': deleted})
-                        except Exception:
-                            self.logger.exception(
-                                _('Invalid pending entry %(file)s: %(entry)s'),
-                                {'file': self.pending_file, 'entry': entry})
-                if item_list:
-                    self.merge_items(item_list)
-                try:
-                    os.ftruncate(fp.fileno(), 0)
-                except OSError, err:
-                    if err.errno != errno.ENOENT:
-                        raise
+    def _commit_puts_load(self, item_list, entry):
+        """See :func:`swift.common.db.DatabaseBroker._commit_puts_load`"""
+        (name, put_timestamp, delete_timestamp,
+         object_count, bytes_used, deleted) = pickle.loads(entry)
+        item_list.append({'name': name,
+                          'put_timestamp': put_timestamp,
+                          'delete_timestamp': delete_timestamp,
+                          'object_count': object_count,
+                          'bytes_used': bytes_used,
+                          'deleted': deleted})
+
+    def make_tuple_for_pickle(self, record):
+        """See :func:`swift.common.db.DatabaseBroker.make_tuple_for_pickle`"""
+        return (record['name'], record['put_timestamp'],
+                record['delete_timestamp'], record['object_count'],
+                record['bytes_used'], record['deleted'])
 
     def empty(self):
         """
@@ -1424,31 +1784,7 @@ class AccountBroker(DatabaseBroker):
                   'object_count': object_count,
                   'bytes_used': bytes_used,
                   'deleted': deleted}
-        if self.db_file == ':memory:':
-            self.merge_items([record])
-            return
-        if not os.path.exists(self.db_file):
-            raise DatabaseConnectionError(self.db_file, "DB doesn't exist")
-        pending_size = 0
-        try:
-            pending_size = os.path.getsize(self.pending_file)
-        except OSError, err:
-            if err.errno != errno.ENOENT:
-                raise
-        if pending_size > PENDING_CAP:
-            self._commit_puts([record])
-        else:
-            with lock_parent_directory(self.pending_file,
-                                       self.pending_timeout):
-                with open(self.pending_file, 'a+b') as fp:
-                    # Colons aren't used in base64 encoding; so they are our
-                    # delimiter
-                    fp.write(':')
-                    fp.write(pickle.dumps(
-                        (name, put_timestamp, delete_timestamp, object_count,
-                         bytes_used, deleted),
-                        protocol=PICKLE_PROTOCOL).encode('base64'))
-                    fp.flush()
+        self.put_record(record)
 
     def can_delete_db(self, cutoff):
         """
@@ -1482,11 +1818,12 @@ class AccountBroker(DatabaseBroker):
         """
         if self.db_file != ':memory:' and not os.path.exists(self.db_file):
             return True
-        try:
-            self._commit_puts()
-        except LockTimeout:
-            if not self.stale_reads_ok:
-                raise
+        if not self.defer_pending:
+            try:
+                self._commit_puts()
+            except LockTimeout:
+                if not self.stale_reads_ok:
+                    raise
         with self.get() as conn:
             row = conn.execute('''
                 SELECT put_timestamp, delete_timestamp, container_count, status
@@ -1511,11 +1848,12 @@ class AccountBroker(DatabaseBroker):
                   delete_timestamp, container_count, object_count,
                   bytes_used, hash, id
         """
-        try:
-            self._commit_puts()
-        except LockTimeout:
-            if not self.stale_reads_ok:
-                raise
+        if not self.defer_pending:
+            try:
+                self._commit_puts()
+            except LockTimeout:
+                if not self.stale_reads_ok:
+                    raise
         with self.get() as conn:
             return dict(conn.execute('''
                 SELECT account, created_at,  put_timestamp, delete_timestamp,
@@ -1540,11 +1878,12 @@ class AccountBroker(DatabaseBroker):
         """
         (marker, end_marker, prefix, delimiter) = utf8encode(
             marker, end_marker, prefix, delimiter)
-        try:
-            self._commit_puts()
-        except LockTimeout:
-            if not self.stale_reads_ok:
-                raise
+        if not self.defer_pending:
+            try:
+                self._commit_puts()
+            except LockTimeout:
+                if not self.stale_reads_ok:
+                    raise
         if delimiter and not prefix:
             prefix = ''
         orig_marker = marker
@@ -1598,6 +1937,31 @@ class AccountBroker(DatabaseBroker):
                     break
             return results
 
+    def _merge_container_row(self, row, record):
+        """
+        Fold an existing container row into a newer record: missing values
+        are taken from the row, the newest timestamps are kept, and the
+        deleted flag is worked out again from the result.
+
+        :param row: existing (name, put_timestamp, delete_timestamp,
+                    object_count, bytes_used, deleted) sequence
+        :param record: the record as a list of the same fields; updated in
+                       place
+        """
+        for i in xrange(5):
+            if record[i] is None and row[i] is not None:
+                record[i] = row[i]
+        if row[1] > record[1]:  # Keep newest put_timestamp
+            record[1] = row[1]
+        if row[2] > record[2]:  # Keep newest delete_timestamp
+            record[2] = row[2]
+        # If deleted, mark as such
+        if record[2] > record[1] and \
+                record[3] in (None, '', 0, '0'):
+            record[5] = 1
+        else:
+            record[5] = 0
+
     def merge_items(self, item_list, source=None):
         """
         Merge items into the container table.
@@ -1607,58 +1971,45 @@ class AccountBroker(DatabaseBroker):
                           'deleted'}
         :param source: if defined, update incoming_sync with the source
         """
+        # Repeated names are folded together first; the result takes the
+        # place of the last of them in the insert order.
+        incoming = {}
+        for seq, rec in enumerate(item_list):
+            record = [rec['name'], rec['put_timestamp'],
+                      rec['delete_timestamp'], rec['object_count'],
+                      rec['bytes_used'], rec['deleted']]
+            prev = incoming.get(rec['name'])
+            if prev is not None:
+                self._merge_container_row(prev[1], record)
+            incoming[rec['name']] = (seq, record)
         with self.get() as conn:
-            max_rowid = -1
-            for rec in item_list:
-                record = [rec['name'], rec['put_timestamp'],
-                          rec['delete_timestamp'], rec['object_count'],
-                          rec['bytes_used'], rec['deleted']]
-                query = '''
-                    SELECT name, put_timestamp, delete_timestamp,
-                           object_count, bytes_used, deleted
-                    FROM container WHERE name = ?
-                '''
-                if self.get_db_version(conn) >= 1:
-                    query += ' AND deleted IN (0, 1)'
-                curs = conn.execute(query, (rec['name'],))
-                curs.row_factory = None
-                row = curs.fetchone()
-                if row:
-                    row = list(row)
-                    for i in xrange(5):
-                        if record[i] is None and row[i] is not None:
-                            record[i] = row[i]
-                    if row[1] > record[1]:  # Keep newest put_timestamp
-                        record[1] = row[1]
-                    if row[2] > record[2]:  # Keep newest delete_timestamp
-                        record[2] = row[2]
-                    # If deleted, mark as such
-                    if record[2] > record[1] and \
-                            record[3] in (None, '', 0, '0'):
-                        record[5] = 1
-                    else:
-                        record[5] = 0
-                conn.execute('''
-                    DELETE FROM container WHERE name = ? AND
-                                                deleted IN (0, 1)
-                ''', (record[0],))
-                conn.execute('''
-                    INSERT INTO container (name, put_timestamp,
-                        delete_timestamp, object_count, bytes_used,
-                        deleted)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', record)
-                if source:
-                    max_rowid = max(max_rowid, rec['ROWID'])
+            self._load_incoming(
+                conn, 'incoming_container',
+                ('seq INTEGER', 'name TEXT PRIMARY KEY'),
+                ((seq, record[0]) for seq, record in incoming.itervalues()))
+            query = '''
+                SELECT name, put_timestamp, delete_timestamp,
+                       object_count, bytes_used, deleted
+                FROM container
+                WHERE name IN (SELECT name FROM incoming_container)
+            '''
+            if self.get_db_version(conn) >= 1:
+                query += ' AND deleted IN (0, 1)'
+            curs = conn.execute(query)
+            curs.row_factory = None
+            for row in curs:
+                self._merge_container_row(row, incoming[row[0]][1])
+            conn.execute('''
+                DELETE FROM container
+                WHERE deleted IN (0, 1)
+                AND name IN (SELECT name FROM incoming_container)
+            ''')
+            conn.executemany('''
+                INSERT INTO container (name, put_timestamp,
+                    delete_timestamp, object_count, bytes_used,
+                    deleted)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [record for _junk, record in sorted(incoming.itervalues())])
             if source:
-                try:
-                    conn.execute('''
-                        INSERT INTO incoming_sync (sync_point, remote_id)
-                        VALUES (?, ?)
-                    ''', (max_rowid, source))
-                except sqlite3.IntegrityError:
-                    conn.execute('''
-                        UPDATE incoming_sync SET sync_point=max(?, sync_point)
-                        WHERE remote_id=?
-                    ''', (max_rowid, source))
+                self._merge_incoming_sync(conn, item_list, source)
             conn.commit()
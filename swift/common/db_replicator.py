@@ -22,6 +22,10 @@ import shutil
 import uuid
 import errno
 import re
+import signal
+import zlib
+from functools import partial
+from tempfile import mkstemp
 
 from eventlet import GreenPool, sleep, Timeout
 from eventlet.green import subprocess
@@ -111,10 +115,11 @@ class ReplConnection(BufferedHTTPConnection):
     Helper to simplify REPLICATEing to a remote server.
     """
 
-    def __init__(self, node, partition, hash_, logger):
+    def __init__(self, node, partition, hash_, logger, compress=False):
         ""
         self.logger = logger
         self.node = node
+        self.compress = compress
         BufferedHTTPConnection.__init__(self, '%(ip)s:%(port)s' % node)
         self.path = '/%s/%s/%s' % (node['device'], partition, hash_)
 
@@ -128,8 +133,11 @@ class ReplConnection(BufferedHTTPConnection):
         """
         try:
             body = simplejson.dumps(args)
-            self.request('REPLICATE', self.path, body,
-                         {'Content-Type': 'application/json'})
+            headers = {'Content-Type': 'application/json'}
+            if self.compress:
+                body = zlib.compress(body)
+                headers['Content-Encoding'] = 'deflate'
+            self.request('REPLICATE', self.path, body, headers)
             response = self.getresponse()
             response.data = response.read()
             return response
@@ -151,11 +159,15 @@ class Replicator(Daemon):
         self.mount_check = config_true_value(conf.get('mount_check', 'true'))
         self.port = int(conf.get('bind_port', self.default_port))
         concurrency = int(conf.get('concurrency', 8))
+        self.device_workers = int(conf.get('device_workers', 0))
         self.cpool = GreenPool(size=concurrency)
         swift_dir = conf.get('swift_dir', '/etc/swift')
         self.ring = ring.Ring(swift_dir, ring_name=self.server_type)
         self.per_diff = int(conf.get('per_diff', 1000))
         self.max_diffs = int(conf.get('max_diffs') or 100)
+        self.diffs_in_flight = int(conf.get('diffs_in_flight', 1))
+        self.compact_diffs = config_true_value(
+            conf.get('compact_diffs', 'false'))
         self.interval = int(conf.get('interval') or
                             conf.get('run_pause') or 30)
         self.vm_test_mode = config_true_value(conf.get('vm_test_mode', 'no'))
@@ -259,15 +271,51 @@ class Replicator(Daemon):
             response = http.replicate(replicate_method, local_id)
         return response and response.status >= 200 and response.status < 300
 
-    def _usync_db(self, point, broker, http, remote_id, local_id):
+    def _send_diff(self, http, objects, source):
+        """
+        Send a batch of rows to be merged by the remote replica.
+
+        :param http: ReplConnection object for the remote server
+        :param objects: rows as returned by get_items_since
+        :param source: database id to record the rows as coming from, if any
+
+        :returns: boolean indicating success
+        """
+        with Timeout(self.node_timeout):
+            if self.compact_diffs:
+                columns = objects[0].keys()
+                response = http.replicate(
+                    'merge_rows', columns,
+                    [[obj[col] for col in columns] for obj in objects],
+                    source)
+            else:
+                response = http.replicate('merge_items', objects, source)
+        if not response or response.status >= 300 or response.status < 200:
+            if response:
+                self.logger.error(_('ERROR Bad response %(status)s from '
+                                    '%(host)s'),
+                                  {'status': response.status,
+                                   'host': http.host})
+            return False
+        return True
+
+    def _usync_db(self, point, broker, http, remote_id, local_id,
+                  connect=None):
         """
         Sync a db by sending all records since the last sync.
 
+        With diffs_in_flight above 1, up to that many batches are sent at
+        once over extra connections made with connect.  They may then be
+        merged out of order, so the remote replica only learns how far it
+        has been synced once they have all been accepted.
+
         :param point: synchronization high water mark between the replicas
         :param broker: database broker object
         :param http: ReplConnection object for the remote server
         :param remote_id: database id for the remote replica
         :param local_id: database id for the local replica
+        :param connect: callable returning another ReplConnection to the
+                        remote server, used to pipeline batches
 
         :returns: boolean indicating completion and success
         """
@@ -277,19 +325,38 @@ class Replicator(Daemon):
         sync_table = broker.get_syncs()
         objects = broker.get_items_since(point, self.per_diff)
         diffs = 0
+        pool = None
+        if self.diffs_in_flight > 1 and connect:
+            pool = GreenPool(self.diffs_in_flight)
+            idle = [http]
+            failures = []
+
+            def send(objects):
+                try:
+                    conn = idle.pop() if idle else connect()
+                    if self._send_diff(conn, objects, None):
+                        idle.append(conn)
+                        return
+                except (Exception, Timeout):
+                    self.logger.exception(
+                        _('ERROR syncing chunks with %s'), http.host)
+                failures.append(objects)
+
         while len(objects) and diffs < self.max_diffs:
             diffs += 1
-            with Timeout(self.node_timeout):
-                response = http.replicate('merge_items', objects, local_id)
-            if not response or response.status >= 300 or response.status < 200:
-                if response:
-                    self.logger.error(_('ERROR Bad response %(status)s from '
-                                        '%(host)s'),
-                                      {'status': response.status,
-                                       'host': http.host})
+            if pool:
+                if failures:
+                    break
+                pool.spawn_n(send, objects)
+            elif not self._send_diff(http, objects, local_id):
                 return False
             point = objects[-1]['ROWID']
             objects = broker.get_items_since(point, self.per_diff)
+        if pool:
+            pool.waitall()
+            if failures:
+                return False
+            sync_table.append({'remote_id': local_id, 'sync_point': point})
         if objects:
             self.logger.debug(_(
                 'Synchronization for %s has fallen more than '
@@ -297,6 +364,10 @@ class Replicator(Daemon):
                 (broker.db_file, self.max_diffs * self.per_diff))
             self.stats['diff_capped'] += 1
             self.logger.increment('diff_caps')
+            if pool:
+                # keep the progress made for the next pass
+                with Timeout(self.node_timeout):
+                    http.replicate('merge_syncs', sync_table[-1:])
         else:
             with Timeout(self.node_timeout):
                 response = http.replicate('merge_syncs', sync_table)
@@ -343,7 +414,7 @@ class Replicator(Daemon):
         """
         return ReplConnection(node, partition,
                               os.path.basename(db_file).split('.', 1)[0],
-                              self.logger)
+                              self.logger, compress=self.compact_diffs)
 
     def _repl_to_node(self, node, broker, partition, info):
         """
@@ -392,7 +463,9 @@ class Replicator(Daemon):
                                       replicate_timeout=(info['count'] / 2000))
             # else send diffs over to the remote server
             return self._usync_db(max(rinfo['point'], local_sync),
-                                  broker, http, rinfo['id'], info['id'])
+                                  broker, http, rinfo['id'], info['id'],
+                                  connect=partial(self._http_connect, node,
+                                                  partition, broker.db_file))
 
     def _replicate_object(self, partition, object_file, node_id):
         """
@@ -500,6 +573,65 @@ class Replicator(Daemon):
     def report_up_to_date(self, full_info):
         return True
 
+    def _replicate_dirs(self, dirs):
+        """
+        Replicate every db found in the given data dirs.
+
+        :param dirs: list of (datadir, node_id) to walk
+        """
+        for part, object_file, node_id in roundrobin_datadirs(dirs):
+            self.cpool.spawn_n(
+                self._replicate_object, part, object_file, node_id)
+        self.cpool.waitall()
+
+    def _load_stats(self, filename):
+        """
+        Add the stats a worker process left in filename to our own.
+
+        :param filename: file the worker dumped its stats to
+        """
+        try:
+            with open(filename) as fp:
+                stats = simplejson.load(fp)
+            for key, value in stats.iteritems():
+                if key != 'start':
+                    self.stats[key] = self.stats.get(key, 0) + value
+        except Exception:
+            self.logger.exception(
+                _('ERROR loading replication stats from %s'), filename)
+        finally:
+            os.unlink(filename)
+
+    def _replicate_in_workers(self, dirs):
+        """
+        Spread the data dirs over device_workers processes, so a slow db
+        on one device does not hold up the dbs of the others, and gather
+        their stats.
+
+        :param dirs: list of (datadir, node_id) to walk
+        """
+        pid2filename = {}
+        for i in xrange(min(self.device_workers, len(dirs))):
+            fd, tmpfilename = mkstemp()
+            os.close(fd)
+            pid = os.fork()
+            if pid:
+                pid2filename[pid] = tmpfilename
+                continue
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                self._zero_stats()
+                self._replicate_dirs(dirs[i::self.device_workers])
+                with open(tmpfilename, 'w') as fp:
+                    simplejson.dump(self.stats, fp)
+            except (Exception, Timeout):
+                self.logger.exception(_('ERROR trying to replicate'))
+            finally:
+                os._exit(0)
+        while pid2filename:
+            pid = os.wait()[0]
+            self._load_stats(pid2filename.pop(pid))
+
     def run_once(self, *args, **kwargs):
         """Run a replication pass once."""
         self._zero_stats()
@@ -522,10 +654,10 @@ class Replicator(Daemon):
                 if os.path.isdir(datadir):
                     dirs.append((datadir, node['id']))
         self.logger.info(_('Beginning replication run'))
-        for part, object_file, node_id in roundrobin_datadirs(dirs):
-            self.cpool.spawn_n(
-                self._replicate_object, part, object_file, node_id)
-        self.cpool.waitall()
+        if self.device_workers > 0:
+            self._replicate_in_workers(dirs)
+        else:
+            self._replicate_dirs(dirs)
         self.logger.info(_('Replication run OVER'))
         self._report_stats()
 
@@ -637,6 +769,11 @@ class ReplicatorRpc(object):
         broker.merge_items(args[0], args[1])
         return HTTPAccepted()
 
+    def merge_rows(self, broker, args):
+        columns, rows, source = args
+        broker.merge_items([dict(zip(columns, row)) for row in rows], source)
+        return HTTPAccepted()
+
     def complete_rsync(self, drive, db_file, args):
         old_filename = os.path.join(self.root, drive, 'tmp', args[0])
         if os.path.exists(db_file):
@@ -58,6 +58,10 @@ class ChunkReadTimeout(Timeout):
     pass
 
 
+class ChunkReadError(SwiftException):
+    pass
+
+
 class ChunkWriteTimeout(Timeout):
     pass
 
@@ -29,6 +29,9 @@ class ReconMiddleware(object):
 
     /recon/load|mem|async... will return various system metrics.
 
+    In a proxy's pipeline, /recon/node_scores returns the proxy's scores of
+    the storage nodes when sorting_method = score.
+
     Needs to be added to the pipeline and a requires a filter
     declaration in the object-server.conf:
 
@@ -50,6 +53,8 @@ class ReconMiddleware(object):
                                                   'container.recon')
         self.account_recon_cache = os.path.join(self.recon_cache_path,
                                                 'account.recon')
+        self.proxy_recon_cache = os.path.join(self.recon_cache_path,
+                                              'proxy.recon')
         self.account_ring_path = os.path.join(swift_dir, 'account.ring.gz')
         self.container_ring_path = os.path.join(swift_dir, 'container.ring.gz')
         self.object_ring_path = os.path.join(swift_dir, 'object.ring.gz')
@@ -114,6 +119,32 @@ class ReconMiddleware(object):
         return self._from_recon_cache(['async_pending'],
                                       self.object_recon_cache)
 
+    def get_node_scores(self, openr=open):
+        """get the proxy's latency and error scores of storage nodes
+
+        Each proxy worker writes the scores it has seen under a key of its
+        own; a device's entry is taken from the worker that heard from it
+        last.
+        """
+        try:
+            with openr(self.proxy_recon_cache, 'r') as f:
+                recondata = json.load(f)
+        except IOError:
+            self.logger.exception(_('Error reading recon cache file'))
+            return {'proxy_node_scores': None}
+        except ValueError:
+            self.logger.exception(_('Error parsing recon cache file'))
+            return {'proxy_node_scores': None}
+        scores = {}
+        for key, worker_scores in recondata.iteritems():
+            if not key.startswith('proxy_node_scores_'):
+                continue
+            for device, entry in worker_scores.iteritems():
+                if device not in scores or \
+                        entry['updated'] > scores[device]['updated']:
+                    scores[device] = entry
+        return {'proxy_node_scores': scores}
+
     def get_replication_info(self, recon_type):
         """get replication info"""
         if recon_type == 'account':
@@ -128,7 +159,8 @@ class ReconMiddleware(object):
                                           self.container_recon_cache)
         elif recon_type == 'object':
             return self._from_recon_cache(['object_replication_time',
-                                           'object_replication_last'],
+                                           'object_replication_last',
+                                           'object_replication_queue'],
                                           self.object_recon_cache)
         else:
             return None
@@ -305,6 +337,8 @@ class ReconMiddleware(object):
             content = self.get_quarantine_count()
         elif rcheck == "sockstat":
             content = self.get_socket_info()
+        elif rcheck == "node_scores":
+            content = self.get_node_scores()
         else:
             content = "Invalid path: %s" % req.path
             return Response(request=req, status="404 Not Found",
@@ -41,6 +41,7 @@ import cPickle as pickle
 import glob
 from urlparse import urlparse as stdlib_urlparse, ParseResult
 import itertools
+from collections import deque
 
 import eventlet
 from eventlet import GreenPool, sleep, Timeout
@@ -67,6 +68,10 @@ SysLogHandler.priority_map['NOTICE'] = 'notice'
 # These are lazily pulled from libc elsewhere
 _sys_fallocate = None
 _posix_fadvise = None
+_sys_sendfile = None
+
+# ioctl request code of FICLONE, from linux/fs.h
+FICLONE = 0x40049409
 
 # If set to non-zero, fallocate routines will fail based on free space
 # available being at or below this amount, in bytes.
@@ -258,6 +263,50 @@ def fdatasync(fd):
         fsync(fd)
 
 
+def sendfile(out_fd, in_fd, offset, count):
+    """
+    Copy bytes from one file descriptor to another inside the kernel with
+    sendfile(2), without reading them into user space.
+
+    :param out_fd: file descriptor to write to (usually a socket)
+    :param in_fd: file descriptor to read from
+    :param offset: offset in in_fd to start reading at
+    :param count: maximum number of bytes to copy
+    :returns: number of bytes copied
+    :raises OSError: if sendfile fails (including EAGAIN on a non-blocking
+                     out_fd), or ENOSYS if libc has no sendfile
+    """
+    global _sys_sendfile
+    if _sys_sendfile is None:
+        func = load_libc_function('sendfile', log_error=False)
+        if func is not noop_libc_function:
+            func.argtypes = [ctypes.c_int, ctypes.c_int,
+                             ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+            func.restype = ctypes.c_ssize_t
+        _sys_sendfile = func
+    if _sys_sendfile is noop_libc_function:
+        raise OSError(errno.ENOSYS, 'sendfile is not available')
+    ret = _sys_sendfile(out_fd, in_fd, ctypes.byref(ctypes.c_int64(offset)),
+                        count)
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return ret
+
+
+def reflink(src_fd, dst_fd):
+    """
+    Make dst_fd share the data blocks of src_fd (a copy-on-write clone,
+    FICLONE), so the data is duplicated without being copied.  Only
+    filesystems such as btrfs or XFS with reflink support can do this.
+
+    :param src_fd: file descriptor to clone
+    :param dst_fd: file descriptor of the (empty) file to clone into
+    :raises IOError: if the filesystem cannot clone the file
+    """
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
 def drop_buffer_cache(fd, offset, length):
     """
     Drop 'buffer' cache for the given range of the given file.
@@ -1625,6 +1674,44 @@ def reiterate(iterable):
             return []
 
 
+def joined_chunks(iterable, count):
+    """
+    Yield the strings of iterable joined count at a time, so that a body
+    made of many small pieces goes out in fewer, larger writes.
+
+    :param iterable: iterable of strings
+    :param count: number of strings joined into each chunk
+    """
+    chunk = []
+    for piece in iterable:
+        chunk.append(piece)
+        if len(chunk) >= count:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def iter_listing(list_page, rows, limit, page_size):
+    """
+    Yield the rows of a database listing a page at a time, so a long
+    listing is never held in memory whole.
+
+    :param list_page: called as list_page(marker, limit) to get the rows
+                      after marker
+    :param rows: the first page of rows, the name of each row first
+    :param limit: total number of rows to yield at most
+    :param page_size: number of rows asked for at a time
+    """
+    while rows:
+        for row in rows:
+            yield row
+        limit -= len(rows)
+        if len(rows) < page_size or limit <= 0:
+            return
+        rows = list_page(rows[-1][0], min(limit, page_size))
+
+
 class InputProxy(object):
     """
     File-like object that counts bytes read.
@@ -1665,6 +1752,75 @@ class InputProxy(object):
         return line
 
 
+class LRUCache(object):
+    """
+    Small in-process cache that keeps each value for at most ttl seconds and
+    holds at most max_size of them, evicting the least recently used first.
+    Meant as a local tier in front of memcache for hot, short-lived entries.
+
+    :param max_size: maximum number of entries kept
+    :param ttl: seconds an entry is returned for after it was set
+    """
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> (expires, value, tick of last use); the order of use is
+        # kept in a queue of (tick, key) next to it, as collections has no
+        # OrderedDict on Python 2.6.  Queue items whose tick is no longer
+        # the entry's are stale and skipped.
+        self.entries = {}
+        self.uses = deque()
+        self.ticks = itertools.count()
+
+    def _use(self, key, expires, value):
+        tick = self.ticks.next()
+        self.entries[key] = (expires, value, tick)
+        self.uses.append((tick, key))
+        if len(self.uses) > 2 * len(self.entries) + 16:
+            self.uses = deque(sorted(
+                (tick, key)
+                for key, (_junk, _junk, tick) in self.entries.iteritems()))
+
+    def get(self, key):
+        """
+        Get a value from the cache.
+
+        :param key: key of the entry
+        :returns: the value, or None if absent or expired
+        """
+        try:
+            expires, value, _junk = self.entries[key]
+        except KeyError:
+            return None
+        if expires <= time.time():
+            del self.entries[key]
+            return None
+        self._use(key, expires, value)
+        return value
+
+    def set(self, key, value):
+        """
+        Set a value in the cache, evicting the least recently used entries
+        if the cache is full.
+
+        :param key: key of the entry
+        :param value: value to store
+        """
+        self._use(key, time.time() + self.ttl, value)
+        while len(self.entries) > self.max_size:
+            tick, key = self.uses.popleft()
+            if self.entries.get(key, (None, None, None))[2] == tick:
+                del self.entries[key]
+
+    def delete(self, key):
+        """
+        Remove an entry from the cache, if present.
+
+        :param key: key of the entry
+        """
+        self.entries.pop(key, None)
+
+
 def import_class(import_str):
     """
     Returns a class from a string including module and class.
@@ -16,6 +16,7 @@
 """WSGI tools for use with swift."""
 
 import errno
+import inspect
 import os
 import signal
 import time
@@ -148,8 +149,17 @@ def run_wsgi(conf_file, app_section, *args, **kwargs):
         app = loadapp('config:%s' % conf_file,
                       global_conf={'log_name': log_name})
         pool = GreenPool(size=1024)
+        server_kwargs = {'custom_pool': pool}
+        # keep-alive connections are closed once idle for keepalive_timeout
+        # seconds; eventlet only takes a socket_timeout from 0.14 on
+        if 'socket_timeout' in inspect.getargspec(wsgi.server)[0]:
+            server_kwargs['socket_timeout'] = \
+                float(conf.get('keepalive_timeout', 60)) or None
+        elif 'keepalive_timeout' in conf:
+            logger.warning(_('keepalive_timeout needs eventlet 0.14 or '
+                             'newer; ignoring it'))
         try:
-            wsgi.server(sock, app, NullLogger(), custom_pool=pool)
+            wsgi.server(sock, app, NullLogger(), **server_kwargs)
         except socket.error, err:
             if err[0] != errno.EINVAL:
                 raise
@@ -18,16 +18,18 @@ from __future__ import with_statement
 import os
 import time
 import traceback
+import zlib
 from xml.sax import saxutils
 from datetime import datetime
 
 from eventlet import Timeout
 
 import swift.common.db
-from swift.common.db import ContainerBroker
+from swift.common.db import ContainerBroker, PendingFlusher, StatCache
 from swift.common.utils import get_logger, get_param, hash_path, public, \
     normalize_timestamp, storage_directory, validate_sync_to, \
-    config_true_value, validate_device_partition, json, timing_stats
+    config_true_value, validate_device_partition, json, timing_stats, \
+    joined_chunks, iter_listing
 from swift.common.constraints import CONTAINER_LISTING_LIMIT, \
     check_mount, check_float, check_utf8, FORMAT2CONTENT_TYPE
 from swift.common.bufferedhttp import http_connect
@@ -40,6 +42,9 @@ from swift.common.swob import HTTPAccepted, HTTPBadRequest, HTTPConflict, \
     HTTPInsufficientStorage, HTTPNotAcceptable
 
 DATADIR = 'containers'
+#: Number of listing entries serialized into each chunk of a GET response;
+#: shorter listings are sent whole, with a Content-Length
+LISTING_CHUNK_ROWS = 100
 
 
 class ContainerController(object):
@@ -68,6 +73,23 @@ class ContainerController(object):
             self.save_headers.append('x-versions-location')
         swift.common.db.DB_PREALLOCATION = \
             config_true_value(conf.get('db_preallocation', 'f'))
+        swift.common.db.PENDING_FSYNC = \
+            config_true_value(conf.get('db_pending_fsync', 'f'))
+        swift.common.db.PENDING_FRAMED = \
+            config_true_value(conf.get('db_pending_framed', 'f'))
+        pending_flush_interval = float(conf.get('pending_flush_interval', 0))
+        if pending_flush_interval > 0:
+            self.pending_flusher = PendingFlusher(
+                pending_flush_interval,
+                int(conf.get('pending_flush_watermark', 65536)), self.logger)
+        else:
+            self.pending_flusher = None
+        stat_cache_size = int(conf.get('stat_cache_size', 0))
+        if stat_cache_size > 0:
+            self.stat_cache = StatCache(
+                stat_cache_size, float(conf.get('stat_cache_time', 30)))
+        else:
+            self.stat_cache = None
 
     def _get_container_broker(self, drive, part, account, container):
         """
@@ -83,7 +105,8 @@ class ContainerController(object):
         db_dir = storage_directory(DATADIR, part, hsh)
         db_path = os.path.join(self.root, drive, db_dir, hsh + '.db')
         return ContainerBroker(db_path, account=account, container=container,
-                               logger=self.logger)
+                               logger=self.logger,
+                               defer_pending=bool(self.pending_flusher))
 
     def account_update(self, req, account, container, broker):
         """
@@ -179,6 +202,8 @@ class ContainerController(object):
         if self.mount_check and not check_mount(self.root, drive):
             return HTTPInsufficientStorage(drive=drive, request=req)
         broker = self._get_container_broker(drive, part, account, container)
+        if self.stat_cache and not obj:
+            self.stat_cache.invalidate(broker)
         if account.startswith(self.auto_create_account_prefix) and obj and \
                 not os.path.exists(broker.db_file):
             broker.initialize(normalize_timestamp(
@@ -187,6 +212,8 @@ class ContainerController(object):
             return HTTPNotFound()
         if obj:     # delete object
             broker.delete_object(obj, req.headers.get('x-timestamp'))
+            if self.pending_flusher:
+                self.pending_flusher.add(broker)
             return HTTPNoContent(request=req)
         else:
             # delete container
@@ -227,6 +254,8 @@ class ContainerController(object):
             return HTTPInsufficientStorage(drive=drive, request=req)
         timestamp = normalize_timestamp(req.headers['x-timestamp'])
         broker = self._get_container_broker(drive, part, account, container)
+        if self.stat_cache and not obj:
+            self.stat_cache.invalidate(broker)
         if obj:     # put container object
             if account.startswith(self.auto_create_account_prefix) and \
                     not os.path.exists(broker.db_file):
@@ -236,6 +265,8 @@ class ContainerController(object):
             broker.put_object(obj, timestamp, int(req.headers['x-size']),
                               req.headers['x-content-type'],
                               req.headers['x-etag'])
+            if self.pending_flusher:
+                self.pending_flusher.add(broker)
             return HTTPCreated(request=req)
         else:   # put container
             if not os.path.exists(broker.db_file):
@@ -267,6 +298,20 @@ class ContainerController(object):
             else:
                 return HTTPAccepted(request=req)
 
+    def _get_stat(self, broker):
+        """
+        Get whether the container is deleted, and its info and metadata;
+        through the stat cache if there is one.
+
+        :param broker: DB broker of the container
+        :returns: tuple of (deleted, info, metadata)
+        """
+        if self.stat_cache:
+            return self.stat_cache.get(broker)
+        if broker.is_deleted():
+            return True, None, None
+        return False, broker.get_info(), broker.metadata
+
     @public
     @timing_stats(sample_rate=0.1)
     def HEAD(self, req):
@@ -282,9 +327,9 @@ class ContainerController(object):
         broker = self._get_container_broker(drive, part, account, container)
         broker.pending_timeout = 0.1
         broker.stale_reads_ok = True
-        if broker.is_deleted():
+        deleted, info, metadata = self._get_stat(broker)
+        if deleted:
             return HTTPNotFound(request=req)
-        info = broker.get_info()
         headers = {
             'X-Container-Object-Count': info['object_count'],
             'X-Container-Bytes-Used': info['bytes_used'],
@@ -293,7 +338,7 @@ class ContainerController(object):
         }
         headers.update(
             (key, value)
-            for key, (value, timestamp) in broker.metadata.iteritems()
+            for key, (value, timestamp) in metadata.iteritems()
             if value != '' and (key.lower() in self.save_headers or
                                 key.lower().startswith('x-container-meta-')))
         if get_param(req, 'format'):
@@ -325,6 +370,61 @@ class ContainerController(object):
                     self.logger.exception("Invalid swift_bytes")
         return content_type, size
 
+    def _created_at_isoformat(self, created_at):
+        created_at = datetime.utcfromtimestamp(float(created_at)).isoformat()
+        # python isoformat() doesn't include msecs when zero
+        if len(created_at) < len("1970-01-01T00:00:00.000000"):
+            created_at += ".000000"
+        return created_at
+
+    def _json_listing_iter(self, container_list):
+        """
+        Serialize a listing as JSON, one entry at a time.
+
+        :param container_list: rows returned by list_objects_iter
+        """
+        yield '['
+        separator = ''
+        for (name, created_at, size, content_type, etag) in container_list:
+            if content_type is None:
+                entry = {"subdir": name}
+            else:
+                content_type, size = self.derive_content_type_metadata(
+                    content_type, size)
+                entry = {'last_modified':
+                         self._created_at_isoformat(created_at),
+                         'bytes': size, 'content_type': content_type,
+                         'hash': etag, 'name': name}
+            yield separator + json.dumps(entry)
+            separator = ', '
+        yield ']'
+
+    def _xml_listing_iter(self, container, container_list):
+        """
+        Serialize a listing as XML, one entry at a time.
+
+        :param container: container name
+        :param container_list: rows returned by list_objects_iter
+        """
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield '<container name=%s>' % saxutils.quoteattr(container)
+        for (name, created_at, size, content_type, etag) in container_list:
+            # escape name and format date here
+            name = saxutils.escape(name)
+            if content_type is None:
+                yield '<subdir name="%s"><name>%s</name></subdir>' % \
+                    (name, name)
+            else:
+                content_type, size = self.derive_content_type_metadata(
+                    content_type, size)
+                content_type = saxutils.escape(content_type)
+                yield '<object><name>%s</name><hash>%s</hash>' \
+                    '<bytes>%d</bytes><content_type>%s</content_type>' \
+                    '<last_modified>%s</last_modified></object>' % \
+                    (name, etag, size, content_type,
+                     self._created_at_isoformat(created_at))
+        yield '</container>'
+
     @public
     @timing_stats()
     def GET(self, req):
@@ -340,9 +440,9 @@ class ContainerController(object):
         broker = self._get_container_broker(drive, part, account, container)
         broker.pending_timeout = 0.1
         broker.stale_reads_ok = True
-        if broker.is_deleted():
+        deleted, info, metadata = self._get_stat(broker)
+        if deleted:
             return HTTPNotFound(request=req)
-        info = broker.get_info()
         resp_headers = {
             'X-Container-Object-Count': info['object_count'],
             'X-Container-Bytes-Used': info['bytes_used'],
@@ -351,7 +451,7 @@ class ContainerController(object):
         }
         resp_headers.update(
             (key, value)
-            for key, (value, timestamp) in broker.metadata.iteritems()
+            for key, (value, timestamp) in metadata.iteritems()
             if value != '' and (key.lower() in self.save_headers or
                                 key.lower().startswith('x-container-meta-')))
         try:
@@ -382,56 +482,33 @@ class ContainerController(object):
             ['text/plain', 'application/json', 'application/xml', 'text/xml'])
         if not out_content_type:
             return HTTPNotAcceptable(request=req)
-        container_list = broker.list_objects_iter(limit, marker, end_marker,
-                                                  prefix, delimiter, path)
+
+        def list_page(marker, limit):
+            return broker.list_objects_iter(limit, marker, end_marker,
+                                            prefix, delimiter, path)
+
+        container_list = list_page(marker, min(limit, LISTING_CHUNK_ROWS))
+        streamed = len(container_list) == LISTING_CHUNK_ROWS < limit
+        if streamed:
+            # stream long listings a page at a time rather than read them
+            # and build the body in memory
+            container_list = iter_listing(
+                list_page, container_list, limit, LISTING_CHUNK_ROWS)
         if out_content_type == 'application/json':
-            data = []
-            for (name, created_at, size, content_type, etag) in container_list:
-                if content_type is None:
-                    data.append({"subdir": name})
-                else:
-                    created_at = datetime.utcfromtimestamp(
-                        float(created_at)).isoformat()
-                    # python isoformat() doesn't include msecs when zero
-                    if len(created_at) < len("1970-01-01T00:00:00.000000"):
-                        created_at += ".000000"
-                    content_type, size = self.derive_content_type_metadata(
-                        content_type, size)
-                    data.append({'last_modified': created_at, 'bytes': size,
-                                'content_type': content_type, 'hash': etag,
-                                'name': name})
-            container_list = json.dumps(data)
+            body_iter = self._json_listing_iter(container_list)
         elif out_content_type.endswith('/xml'):
-            xml_output = []
-            for (name, created_at, size, content_type, etag) in container_list:
-                # escape name and format date here
-                name = saxutils.escape(name)
-                created_at = datetime.utcfromtimestamp(
-                    float(created_at)).isoformat()
-                # python isoformat() doesn't include msecs when zero
-                if len(created_at) < len("1970-01-01T00:00:00.000000"):
-                    created_at += ".000000"
-                if content_type is None:
-                    xml_output.append('<subdir name="%s"><name>%s</name>'
-                                      '</subdir>' % (name, name))
-                else:
-                    content_type, size = self.derive_content_type_metadata(
-                        content_type, size)
-                    content_type = saxutils.escape(content_type)
-                    xml_output.append(
-                        '<object><name>%s</name><hash>%s</hash>'
-                        '<bytes>%d</bytes><content_type>%s</content_type>'
-                        '<last_modified>%s</last_modified></object>' %
-                        (name, etag, size, content_type, created_at))
-            container_list = ''.join([
-                '<?xml version="1.0" encoding="UTF-8"?>\n',
-                '<container name=%s>' % saxutils.quoteattr(container),
-                ''.join(xml_output), '</container>'])
+            body_iter = self._xml_listing_iter(container, container_list)
         else:
             if not container_list:
                 return HTTPNoContent(request=req, headers=resp_headers)
-            container_list = '\n'.join(r[0] for r in container_list) + '\n'
-        ret = Response(body=container_list, request=req, headers=resp_headers)
+            body_iter = ('%s\n' % r[0] for r in container_list)
+        if streamed:
+            ret = Response(app_iter=joined_chunks(body_iter,
+                                                  LISTING_CHUNK_ROWS),
+                           request=req, headers=resp_headers)
+        else:
+            ret = Response(body=''.join(body_iter), request=req,
+                           headers=resp_headers)
         ret.content_type = out_content_type
         ret.charset = 'utf-8'
         return ret
@@ -452,8 +529,11 @@ class ContainerController(object):
         if self.mount_check and not check_mount(self.root, drive):
             return HTTPInsufficientStorage(drive=drive, request=req)
         try:
-            args = json.load(req.environ['wsgi.input'])
-        except ValueError, err:
+            body = req.environ['wsgi.input'].read()
+            if req.headers.get('Content-Encoding') == 'deflate':
+                body = zlib.decompress(body)
+            args = json.loads(body)
+        except (ValueError, zlib.error), err:
             return HTTPBadRequest(body=str(err), content_type='text/plain')
         ret = self.replicator_rpc.dispatch(post_args, args)
         ret.request = req
@@ -481,6 +561,8 @@ class ContainerController(object):
         if self.mount_check and not check_mount(self.root, drive):
             return HTTPInsufficientStorage(drive=drive, request=req)
         broker = self._get_container_broker(drive, part, account, container)
+        if self.stat_cache:
+            self.stat_cache.invalidate(broker)
         if broker.is_deleted():
             return HTTPNotFound(request=req)
         timestamp = normalize_timestamp(req.headers['x-timestamp'])
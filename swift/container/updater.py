@@ -21,7 +21,8 @@ import time
 from random import random, shuffle
 from tempfile import mkstemp
 
-from eventlet import spawn, patcher, Timeout
+from eventlet import spawn, patcher, sleep, GreenPool, Timeout
+from eventlet.semaphore import Semaphore
 
 import swift.common.db
 from swift.container.server import DATADIR
@@ -46,6 +47,8 @@ class ContainerUpdater(Daemon):
         self.interval = int(conf.get('interval', 300))
         self.account_ring = None
         self.concurrency = int(conf.get('concurrency', 4))
+        self.update_concurrency = int(conf.get('update_concurrency', 1))
+        self.account_locks = {}
         self.slowdown = float(conf.get('slowdown', 0.01))
         self.node_timeout = int(conf.get('node_timeout', 3))
         self.conn_timeout = float(conf.get('conn_timeout', 0.5))
@@ -186,15 +189,19 @@ class ContainerUpdater(Daemon):
 
     def container_sweep(self, path):
         """
-        Walk the path looking for container DBs and process them.
+        Walk the path looking for container DBs and process them, up to
+        update_concurrency at a time.
 
         :param path: path to walk
         """
+        pool = GreenPool(self.update_concurrency)
         for root, dirs, files in os.walk(path):
             for file in files:
                 if file.endswith('.db'):
-                    self.process_container(os.path.join(root, file))
-                    time.sleep(self.slowdown)
+                    pool.spawn_n(self.process_container,
+                                 os.path.join(root, file))
+                    sleep(self.slowdown)
+        pool.waitall()
 
     def process_container(self, dbfile):
         """
@@ -217,17 +224,31 @@ class ContainerUpdater(Daemon):
                 info['bytes_used'] != info['reported_bytes_used']:
             container = '/%s/%s' % (info['account'], info['container'])
             part, nodes = self.get_account_ring().get_nodes(info['account'])
-            events = [spawn(self.container_report, node, part, container,
-                            info['put_timestamp'], info['delete_timestamp'],
-                            info['object_count'], info['bytes_used'])
-                      for node in nodes]
-            successes = 0
-            failures = 0
-            for event in events:
-                if is_success(event.wait()):
-                    successes += 1
-                else:
-                    failures += 1
+            # Updates for the same account are sent one after the other, so
+            # they do not contend for the account database, and the ones
+            # queued behind a failure are held back by its suppression.
+            lock = self.account_locks.setdefault(info['account'], Semaphore())
+            try:
+                with lock:
+                    if self.account_suppressions.get(info['account'], 0) > \
+                            time.time():
+                        return
+                    events = [spawn(self.container_report, node, part,
+                                    container, info['put_timestamp'],
+                                    info['delete_timestamp'],
+                                    info['object_count'], info['bytes_used'])
+                              for node in nodes]
+                    successes = 0
+                    failures = 0
+                    for event in events:
+                        if is_success(event.wait()):
+                            successes += 1
+                        else:
+                            failures += 1
+            finally:
+                if lock.balance == 1 and \
+                        self.account_locks.get(info['account']) is lock:
+                    del self.account_locks[info['account']]
             if successes > failures:
                 self.logger.increment('successes')
                 self.successes += 1
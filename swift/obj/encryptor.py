@@ -30,6 +30,10 @@ class CryptoDriver(object):
                         store encryption keys
     """
 
+    #: True if encrypt and decrypt return data unchanged, so the bytes on
+    #: disk can be sent to clients as they are.
+    transparent = False
+
     def __init__(self, conf, key_manager):
         self.conf = conf
         self.key_manager = key_manager
@@ -84,6 +88,8 @@ class DummyDriver(CryptoDriver):
     encryption/decryption it just return original string.
     """
 
+    transparent = True
+
     def encrypted_chunk_size(self, context, original_size):
         """
         Return original chunk size.
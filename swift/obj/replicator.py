@@ -24,26 +24,32 @@ import itertools
 import cPickle as pickle
 import errno
 import uuid
+from multiprocessing.pool import ThreadPool
 
 import eventlet
 from eventlet import GreenPool, tpool, Timeout, sleep, hubs
+from eventlet.queue import LightQueue
 from eventlet.green import subprocess
 from eventlet.support.greenlets import GreenletExit
 
 from swift.common.ring import Ring
 from swift.common.utils import whataremyips, unlink_older_than, lock_path, \
     compute_eta, get_logger, write_pickle, renamer, dump_recon_cache, \
-    rsync_ip, mkdirs, config_true_value, list_from_csv, get_hub
-from swift.common.bufferedhttp import http_connect
+    rsync_ip, mkdirs, config_true_value, list_from_csv, get_hub, json
+from swift.common.bufferedhttp import http_connect, http_connect_pooled, \
+    BufferedHTTPConnectionPool
 from swift.common.daemon import Daemon
-from swift.common.http import HTTP_OK, HTTP_INSUFFICIENT_STORAGE
+from swift.common.http import HTTP_OK, HTTP_INSUFFICIENT_STORAGE, \
+    is_success
 from swift.common.exceptions import PathNotDir
+from swift.obj import ssync
 
 hubs.use_hub(get_hub())
 
 PICKLE_PROTOCOL = 2
 ONE_WEEK = 604800
 HASH_FILE = 'hashes.pkl'
+HASH_INVALIDATIONS_FILE = 'hashes.invalid'
 
 
 def quarantine_renamer(device_path, corrupted_file_path):
@@ -139,27 +145,63 @@ def invalidate_hash(suffix_dir):
     """
     Invalidates the hash for a suffix_dir in the partition's hashes file.
 
+    Rather than rewriting the pickled hashes file, the suffix is appended to
+    the partition's invalidations journal as a fixed-width record (the three
+    character suffix followed by a newline).  The journal is folded into the
+    hashes file the next time :func:`get_hashes` runs for the partition.
+
     :param suffix_dir: absolute path to suffix dir whose hash needs
                        invalidating
     """
 
     suffix = os.path.basename(suffix_dir)
     partition_dir = os.path.dirname(suffix_dir)
+    invalidations_file = join(partition_dir, HASH_INVALIDATIONS_FILE)
+    with lock_path(partition_dir):
+        with open(invalidations_file, 'ab') as fp:
+            fp.write(suffix + '\n')
+
+
+def consolidate_hashes(partition_dir):
+    """
+    Fold the partition's invalidations journal into its hashes file and
+    truncate the journal.
+
+    :param partition_dir: absolute path of partition to consolidate
+    :returns: dictionary of hashes, or None if there is no usable hashes
+              file (in which case the journal is simply emptied, since every
+              suffix has to be rehashed anyway)
+    """
     hashes_file = join(partition_dir, HASH_FILE)
+    invalidations_file = join(partition_dir, HASH_INVALIDATIONS_FILE)
     with lock_path(partition_dir):
         try:
             with open(hashes_file, 'rb') as fp:
                 hashes = pickle.load(fp)
-            if suffix in hashes and not hashes[suffix]:
-                return
         except Exception:
-            return
-        hashes[suffix] = None
-        write_pickle(hashes, hashes_file, partition_dir, PICKLE_PROTOCOL)
+            hashes = None
+        modified = False
+        try:
+            with open(invalidations_file, 'rb') as fp:
+                for line in fp:
+                    suffix = line.strip()
+                    if hashes is None or len(suffix) != 3:
+                        continue
+                    if suffix not in hashes or hashes[suffix]:
+                        hashes[suffix] = None
+                        modified = True
+        except IOError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            return hashes
+        if modified:
+            write_pickle(hashes, hashes_file, partition_dir, PICKLE_PROTOCOL)
+        open(invalidations_file, 'wb').close()
+        return hashes
 
 
 def get_hashes(partition_dir, recalculate=[], do_listdir=False,
-               reclaim_age=ONE_WEEK):
+               reclaim_age=ONE_WEEK, hash_pool=None):
     """
     Get a list of hashes for the suffix dir.  do_listdir causes it to mistrust
     the hash cache for suffix existence at the (unexpectedly high) cost of a
@@ -169,6 +211,8 @@ def get_hashes(partition_dir, recalculate=[], do_listdir=False,
     :param recalculate: list of suffixes which should be recalculated when got
     :param do_listdir: force existence check for all hashes in the partition
     :param reclaim_age: age at which to remove tombstones
+    :param hash_pool: optional thread pool (anything with an imap_unordered
+                      method) used to hash invalid suffixes concurrently
 
     :returns: tuple of (number of suffix dirs hashed, dictionary of hashes)
     """
@@ -180,10 +224,12 @@ def get_hashes(partition_dir, recalculate=[], do_listdir=False,
     hashes = {}
     mtime = -1
     try:
-        with open(hashes_file, 'rb') as fp:
-            hashes = pickle.load(fp)
+        hashes = consolidate_hashes(partition_dir)
+        if hashes is None:
+            raise ValueError('no usable hashes file')
         mtime = os.path.getmtime(hashes_file)
     except Exception:
+        hashes = {}
         do_listdir = True
         force_rewrite = True
     if do_listdir:
@@ -192,17 +238,29 @@ def get_hashes(partition_dir, recalculate=[], do_listdir=False,
                 hashes.setdefault(suff, None)
         modified = True
     hashes.update((hash_, None) for hash_ in recalculate)
-    for suffix, hash_ in hashes.items():
-        if not hash_:
-            suffix_dir = join(partition_dir, suffix)
-            try:
-                hashes[suffix] = hash_suffix(suffix_dir, reclaim_age)
-                hashed += 1
-            except PathNotDir:
-                del hashes[suffix]
-            except OSError:
-                logging.exception(_('Error hashing suffix'))
-            modified = True
+
+    def hash_one(suffix):
+        try:
+            return suffix, hash_suffix(join(partition_dir, suffix),
+                                       reclaim_age)
+        except PathNotDir:
+            return suffix, PathNotDir
+        except OSError:
+            logging.exception(_('Error hashing suffix'))
+            return suffix, None
+
+    invalid = [suffix for suffix, hash_ in hashes.items() if not hash_]
+    if hash_pool is not None and len(invalid) > 1:
+        results = hash_pool.imap_unordered(hash_one, invalid)
+    else:
+        results = itertools.imap(hash_one, invalid)
+    for suffix, hash_ in results:
+        if hash_ is PathNotDir:
+            del hashes[suffix]
+        elif hash_ is not None:
+            hashes[suffix] = hash_
+            hashed += 1
+        modified = True
     if modified:
         with lock_path(partition_dir):
             if force_rewrite or not os.path.exists(hashes_file) or \
@@ -211,7 +269,7 @@ def get_hashes(partition_dir, recalculate=[], do_listdir=False,
                     hashes, hashes_file, partition_dir, PICKLE_PROTOCOL)
                 return hashed, hashes
         return get_hashes(partition_dir, recalculate, do_listdir,
-                          reclaim_age)
+                          reclaim_age, hash_pool)
     else:
         return hashed, hashes
 
@@ -267,6 +325,35 @@ class ObjectReplicator(Daemon):
         self.recon_cache_path = conf.get('recon_cache_path',
                                          '/var/cache/swift')
         self.rcache = os.path.join(self.recon_cache_path, "object.recon")
+        self.suffix_hash_threads_per_disk = int(
+            conf.get('suffix_hash_threads_per_disk', 1))
+        self.suffix_hash_pools = {}
+        self.sync_method = conf.get('sync_method', 'rsync')
+        if self.sync_method not in ('rsync', 'ssync'):
+            raise ValueError('Unknown sync_method %r' % self.sync_method)
+        self.network_chunk_size = int(conf.get('network_chunk_size', 65536))
+        self.conn_pool = BufferedHTTPConnectionPool(
+            max_idle_per_node=self.concurrency,
+            idle_timeout=self.http_timeout)
+        self.max_jobs_per_device = int(conf.get('max_jobs_per_device', 0))
+        self.failed_nodes = set()
+        self.last_failed_nodes = set()
+        self.pending_jobs = []
+
+    def get_suffix_hash_pool(self, device):
+        """
+        Get the thread pool used to hash suffixes on a device, creating it
+        the first time the device is seen.
+
+        :param device: name of the local device
+        :returns: a ThreadPool, or None if suffixes should be hashed serially
+        """
+        if self.suffix_hash_threads_per_disk <= 1:
+            return None
+        if device not in self.suffix_hash_pools:
+            self.suffix_hash_pools[device] = ThreadPool(
+                self.suffix_hash_threads_per_disk)
+        return self.suffix_hash_pools[device]
 
     def _rsync(self, args):
         """
@@ -351,6 +438,105 @@ class ObjectReplicator(Daemon):
                     'objects', job['partition']))
         return self._rsync(args) == 0
 
+    def ssync(self, node, job, suffixes):
+        """
+        Synchronize local suffix directories from a partition with a remote
+        node over the object server's REPLICATE verb, without rsync.  Only
+        files the remote node is missing are sent; see
+        :mod:`swift.obj.ssync`.
+
+        :param node: the "dev" entry for the remote node to sync with
+        :param job: information about the partition being synced
+        :param suffixes: a list of suffixes which need to be pushed
+
+        :returns: boolean indicating success or failure
+        """
+        if not os.path.exists(job['path']):
+            return False
+        listing = tpool_reraise(ssync.list_suffix_files, job['path'],
+                                suffixes)
+        if not listing:
+            return False
+        start_time = time.time()
+        try:
+            with Timeout(self.http_timeout):
+                status, body = self._ssync_request(
+                    node, job, 'missing_check', json.dumps(listing),
+                    retry=True)
+            if status != HTTP_OK:
+                self.logger.error(_('Bad ssync missing check response '
+                                    '%(status)s from %(ip)s/%(device)s'),
+                                  dict(node, status=status))
+                return False
+            missing = json.loads(body)
+            if missing:
+                with Timeout(self.rsync_timeout):
+                    status, body = self._ssync_request(
+                        node, job, 'push',
+                        ssync.iter_records(job['path'], missing,
+                                           self.network_chunk_size))
+                if not is_success(status):
+                    self.logger.error(_('Bad ssync push response '
+                                        '%(status)s from %(ip)s/%(device)s'),
+                                      dict(node, status=status))
+                    return False
+        except (Exception, Timeout):
+            self.logger.exception(_('Error in ssync of %(path)s to '
+                                    '%(ip)s/%(device)s'),
+                                  dict(node, path=job['path']))
+            return False
+        self.logger.debug(
+            _('Successful ssync of %(path)s to %(ip)s/%(device)s: %(count)d '
+              'files (%(time).03f)'),
+            dict(node, path=job['path'], count=len(missing),
+                 time=time.time() - start_time))
+        return True
+
+    def _ssync_request(self, node, job, op, body, retry=False):
+        """
+        Make one ssync REPLICATE request over a pooled connection.
+
+        :param body: a string, or an iterable of strings to send chunked
+        :param retry: if True and a reused connection turns out to have been
+                      closed by the remote end, retry once on a new one
+        :returns: tuple of (status, response body)
+        """
+        headers = {ssync.SSYNC_OP_HEADER: op}
+        if isinstance(body, str):
+            headers['Content-Length'] = len(body)
+        else:
+            headers['Transfer-Encoding'] = 'chunked'
+        conn = None
+        try:
+            conn = http_connect_pooled(
+                self.conn_pool, node['ip'], node['port'], node['device'],
+                job['partition'], 'REPLICATE', '', headers=headers)
+            if isinstance(body, str):
+                conn.send(body)
+            else:
+                for chunk in body:
+                    conn.send('%x\r\n%s\r\n' % (len(chunk), chunk))
+                conn.send('0\r\n\r\n')
+            resp = conn.getresponse()
+            resp_body = resp.read()
+        except (Exception, Timeout):
+            if conn is not None:
+                conn.close()
+                if retry and conn.reused:
+                    return self._ssync_request(node, job, op, body)
+            raise
+        self.conn_pool.put(conn)
+        return resp.status, resp_body
+
+    def sync(self, node, job, suffixes):
+        """
+        Synchronize local suffix directories with a remote node, using the
+        configured sync_method.
+
+        :returns: boolean indicating success or failure
+        """
+        return getattr(self, self.sync_method)(node, job, suffixes)
+
     def check_ring(self):
         """
         Check to see if the ring has been updated
@@ -382,7 +568,7 @@ class ObjectReplicator(Daemon):
             suffixes = tpool.execute(tpool_get_suffixes, job['path'])
             if suffixes:
                 for node in job['nodes']:
-                    success = self.rsync(node, job, suffixes)
+                    success = self.sync(node, job, suffixes)
                     if success:
                         with Timeout(self.http_timeout):
                             http_connect(
@@ -412,10 +598,11 @@ class ObjectReplicator(Daemon):
         self.logger.increment('partition.update.count.%s' % (job['device'],))
         begin = time.time()
         try:
+            hash_pool = self.get_suffix_hash_pool(job['device'])
             hashed, local_hash = tpool_reraise(
                 get_hashes, job['path'],
                 do_listdir=(self.replication_count % 10) == 0,
-                reclaim_age=self.reclaim_age)
+                reclaim_age=self.reclaim_age, hash_pool=hash_pool)
             self.suffix_hash += hashed
             self.logger.update_stats('suffix.hashes', hashed)
             attempts_left = len(job['nodes'])
@@ -435,6 +622,7 @@ class ObjectReplicator(Daemon):
                         if resp.status == HTTP_INSUFFICIENT_STORAGE:
                             self.logger.error(_('%(ip)s/%(device)s responded'
                                                 ' as unmounted'), node)
+                            self.node_failed(node)
                             attempts_left += 1
                             continue
                         if resp.status != HTTP_OK:
@@ -453,13 +641,13 @@ class ObjectReplicator(Daemon):
                     hashed, recalc_hash = tpool_reraise(
                         get_hashes,
                         job['path'], recalculate=suffixes,
-                        reclaim_age=self.reclaim_age)
+                        reclaim_age=self.reclaim_age, hash_pool=hash_pool)
                     self.logger.update_stats('suffix.hashes', hashed)
                     local_hash = recalc_hash
                     suffixes = [suffix for suffix in local_hash if
                                 local_hash[suffix] !=
                                 remote_hash.get(suffix, -1)]
-                    self.rsync(node, job, suffixes)
+                    self.sync(node, job, suffixes)
                     with Timeout(self.http_timeout):
                         conn = http_connect(
                             node['ip'], node['port'],
@@ -470,6 +658,7 @@ class ObjectReplicator(Daemon):
                     self.suffix_sync += len(suffixes)
                     self.logger.update_stats('suffix.syncs', len(suffixes))
                 except (Exception, Timeout):
+                    self.node_failed(node)
                     self.logger.exception(_("Error syncing with node: %s") %
                                           node)
             self.suffix_count += len(local_hash)
@@ -479,6 +668,55 @@ class ObjectReplicator(Daemon):
             self.partition_times.append(time.time() - begin)
             self.logger.timing_since('partition.update.timing', begin)
 
+    def node_failed(self, node):
+        """
+        Remember that a node failed during this pass, so that the next pass
+        can prioritize the partitions that have a replica on it.
+
+        :param node: the "dev" entry for the remote node
+        """
+        self.failed_nodes.add((node['ip'], node['port'], node['device']))
+
+    def job_priority(self, job):
+        """
+        Sort key for a job: handoff partitions come first, then partitions
+        with the most replicas on nodes that failed during the last pass,
+        i.e. the fewest live replicas, then everything else.
+
+        :param job: a dict containing info about the partition
+        """
+        if job['delete']:
+            return (0, 0)
+        failed = self.last_failed_nodes
+        return (1, -sum(1 for node in job['nodes'] if
+                        (node['ip'], node['port'], node['device']) in failed))
+
+    def queue_stats(self):
+        """
+        Summarize the jobs not yet started in this pass, for recon.
+
+        :returns: dict with the number of pending handoff, degraded (some
+                  replicas on failed nodes) and other jobs, and of pending
+                  jobs per device
+        """
+        stats = {'handoff': 0, 'degraded': 0, 'primary': 0, 'devices': {}}
+        for job in self.pending_jobs:
+            priority = self.job_priority(job)
+            if priority[0] == 0:
+                stats['handoff'] += 1
+            elif priority[1]:
+                stats['degraded'] += 1
+            else:
+                stats['primary'] += 1
+            stats['devices'][job['device']] = \
+                stats['devices'].get(job['device'], 0) + 1
+        return stats
+
+    def dump_queue_stats(self):
+        """Write the current replication queue depth to the recon cache."""
+        dump_recon_cache({'object_replication_queue': self.queue_stats()},
+                         self.rcache, self.logger)
+
     def stats_line(self):
         """
         Logs various stats for the currently running replication pass.
@@ -532,6 +770,7 @@ class ObjectReplicator(Daemon):
         while True:
             eventlet.sleep(self.stats_interval)
             self.stats_line()
+            self.dump_queue_stats()
 
     def detect_lockups(self):
         """
@@ -549,7 +788,8 @@ class ObjectReplicator(Daemon):
     def collect_jobs(self):
         """
         Returns a sorted list of jobs (dictionaries) that specify the
-        partitions, nodes, etc to be rsynced.
+        partitions, nodes, etc to be rsynced.  Jobs are shuffled and then
+        ordered by :meth:`job_priority`.
         """
         jobs = []
         ips = whataremyips()
@@ -592,9 +832,36 @@ class ObjectReplicator(Daemon):
                 except (ValueError, OSError):
                     continue
         random.shuffle(jobs)
+        jobs.sort(key=self.job_priority)
         self.job_count = len(jobs)
         return jobs
 
+    def next_job(self, running):
+        """
+        Take the highest priority pending job whose device is below
+        max_jobs_per_device.
+
+        :param running: dict of device name to number of running jobs
+        :returns: a job, or None if every pending job's device is busy
+        """
+        for i, job in enumerate(self.pending_jobs):
+            if not self.max_jobs_per_device or \
+                    running.get(job['device'], 0) < self.max_jobs_per_device:
+                return self.pending_jobs.pop(i)
+        return None
+
+    def run_job(self, job, finished):
+        """
+        Replicate a single partition, then report its device on finished.
+        """
+        try:
+            if job['delete']:
+                self.update_deleted(job)
+            else:
+                self.update(job)
+        finally:
+            finished.put(job['device'])
+
     def replicate(self, override_devices=[], override_partitions=[]):
         """Run a replication pass"""
         self.start = time.time()
@@ -609,12 +876,21 @@ class ObjectReplicator(Daemon):
         eventlet.sleep()  # Give spawns a cycle
         try:
             self.run_pool = GreenPool(size=self.concurrency)
-            jobs = self.collect_jobs()
-            for job in jobs:
-                if override_devices and job['device'] not in override_devices:
-                    continue
-                if override_partitions and \
-                        job['partition'] not in override_partitions:
+            self.pending_jobs = [
+                job for job in self.collect_jobs()
+                if (not override_devices or
+                    job['device'] in override_devices) and
+                (not override_partitions or
+                 job['partition'] in override_partitions)]
+            self.dump_queue_stats()
+            running = {}
+            finished = LightQueue()
+            while self.pending_jobs:
+                while not finished.empty():
+                    running[finished.get()] -= 1
+                job = self.next_job(running)
+                if job is None:
+                    running[finished.get()] -= 1
                     continue
                 dev_path = join(self.devices_dir, job['device'])
                 if self.mount_check and not os.path.ismount(dev_path):
@@ -624,10 +900,8 @@ class ObjectReplicator(Daemon):
                     self.logger.info(_("Ring change detected. Aborting "
                                        "current replication pass."))
                     return
-                if job['delete']:
-                    self.run_pool.spawn(self.update_deleted, job)
-                else:
-                    self.run_pool.spawn(self.update, job)
+                running[job['device']] = running.get(job['device'], 0) + 1
+                self.run_pool.spawn(self.run_job, job, finished)
             with Timeout(self.lockup_timeout):
                 self.run_pool.waitall()
         except (Exception, Timeout):
@@ -636,6 +910,10 @@ class ObjectReplicator(Daemon):
         finally:
             stats.kill()
             lockup_detector.kill()
+            self.conn_pool.close()
+            self.last_failed_nodes, self.failed_nodes = \
+                self.failed_nodes, set()
+            self.pending_jobs = []
             self.stats_line()
 
     def run_once(self, *args, **kwargs):
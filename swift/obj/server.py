@@ -26,15 +26,18 @@ from hashlib import md5
 from tempfile import mkstemp
 from urllib import unquote
 from contextlib import contextmanager
+from ssl import SSLSocket
 
 from xattr import getxattr, setxattr
 from eventlet import sleep, Timeout, tpool
+from eventlet.green import socket
+from eventlet.hubs import trampoline
 
 from swift.common.utils import mkdirs, normalize_timestamp, public, \
     storage_directory, hash_path, renamer, fallocate, fsync, fdatasync, \
     split_path, drop_buffer_cache, get_logger, write_pickle, \
     config_true_value, validate_device_partition, timing_stats, \
-    create_instance
+    create_instance, json, sendfile, reflink
 from swift.common.bufferedhttp import http_connect
 from swift.common.constraints import check_object_creation, check_mount, \
     check_float, check_utf8
@@ -42,12 +45,13 @@ from swift.common.exceptions import ConnectionTimeout, DiskFileError, \
     DiskFileNotExist
 from swift.obj.replicator import tpool_reraise, invalidate_hash, \
     quarantine_renamer, get_hashes
+from swift.obj import ssync
 from swift.common.http import is_success
 from swift.common.swob import HTTPAccepted, HTTPBadRequest, HTTPCreated, \
     HTTPInternalServerError, HTTPNoContent, HTTPNotFound, HTTPNotModified, \
     HTTPPreconditionFailed, HTTPRequestTimeout, HTTPUnprocessableEntity, \
     HTTPClientDisconnect, HTTPMethodNotAllowed, Request, Response, UTC, \
-    HTTPInsufficientStorage, multi_range_iterator
+    HTTPInsufficientStorage, HTTPConflict, multi_range_iterator
 from swift.common.key_manager.drivers.base import KeyDriver
 from swift.obj.encryptor import CryptoDriver
 
@@ -109,12 +113,16 @@ class DiskFile(object):
     :param keep_data_fp: if True, don't close the fp, otherwise close it
     :param disk_chunk_size: size of chunks on file reads
     :param iter_hook: called when __iter__ returns a chunk
+    :param sendfile_sock: client socket to send the data file to with
+                          sendfile(2) rather than by yielding it; only valid
+                          when the crypto driver is transparent
     """
 
     def __init__(self, path, device, partition, account, container, obj,
                  logger, keep_data_fp=False, disk_chunk_size=65536,
                  origin_disk_chunk_size=65536, iter_hook=None,
-                 encryption_context=None, crypto_driver=None):
+                 encryption_context=None, crypto_driver=None,
+                 sendfile_sock=None):
         self.disk_chunk_size = disk_chunk_size
         self.origin_disk_chunk_size = origin_disk_chunk_size
         self.iter_hook = iter_hook
@@ -138,6 +146,7 @@ class DiskFile(object):
         self.suppress_file_closing = False
         self.encryption_context = encryption_context
         self.crypto_driver = crypto_driver
+        self.sendfile_sock = sendfile_sock
         if not os.path.exists(self.datadir):
             return
         files = sorted(os.listdir(self.datadir), reverse=True)
@@ -170,6 +179,11 @@ class DiskFile(object):
 
     def __iter__(self):
         """Returns an iterator over the data file."""
+        if self.sendfile_sock is not None:
+            return self._sendfile_iter()
+        return self._read_iter()
+
+    def _read_iter(self):
         try:
             dropped_cache = 0
             read = 0
@@ -203,8 +217,54 @@ class DiskFile(object):
             if not self.suppress_file_closing:
                 self.close()
 
+    def _sendfile_iter(self, length=None):
+        """
+        Yield the first chunk from the current position, so the WSGI server
+        sends the response headers, then have the kernel copy the rest
+        straight from the data file to the client socket.  The ETag is not
+        checked on this path; the object auditor verifies it out of band.
+
+        :param length: number of bytes to send, or None to send up to EOF
+        """
+        try:
+            fd = self.fp.fileno()
+            offset = self.fp.tell()
+            if length is None:
+                length = os.fstat(fd).st_size - offset
+            start = offset
+            chunk = self.fp.read(min(self.disk_chunk_size, length))
+            yield chunk
+            offset += len(chunk)
+            length -= len(chunk)
+            sock_fd = self.sendfile_sock.fileno()
+            while length > 0:
+                try:
+                    sent = sendfile(sock_fd, fd, offset, length)
+                except OSError, err:
+                    if err.errno != errno.EAGAIN:
+                        raise
+                    trampoline(sock_fd, write=True,
+                               timeout=self.sendfile_sock.gettimeout(),
+                               timeout_exc=socket.timeout)
+                    continue
+                if not sent:
+                    break
+                offset += sent
+                length -= sent
+            self.drop_cache(fd, start, offset - start)
+        finally:
+            if not self.suppress_file_closing:
+                self.close()
+
     def app_iter_range(self, start, stop):
         """Returns an iterator over the data file for range (start, stop)"""
+        if self.sendfile_sock is not None:
+            self.fp.seek(start)
+            return self._sendfile_iter(
+                None if stop is None else stop - start)
+        return self._read_iter_range(start, stop)
+
+    def _read_iter_range(self, start, stop):
         start_offset = start % self.origin_disk_chunk_size
         if start or start == 0:
             start_block = ((start / self.origin_disk_chunk_size) *
@@ -232,6 +292,8 @@ class DiskFile(object):
         if not ranges:
             yield ''
         else:
+            # the multipart boundaries have to go through the WSGI server
+            self.sendfile_sock = None
             try:
                 self.suppress_file_closing = True
                 for chunk in multi_range_iterator(
@@ -445,6 +507,18 @@ class ObjectController(object):
         encryption_context = self.crypto_driver.encryption_context(key_id)
         self.disk_chunk_size = self.crypto_driver.encrypted_chunk_size(
             encryption_context, self.origin_disk_chunk_size)
+        self.zero_copy_gets = config_true_value(
+            conf.get('zero_copy_gets', 'false'))
+        if self.zero_copy_gets and not self.crypto_driver.transparent:
+            self.logger.warning(_('zero_copy_gets is ignored with the '
+                                  'encrypting crypto_driver %s'),
+                                crypto_driver)
+            self.zero_copy_gets = False
+        if self.zero_copy_gets and 'cert_file' in conf:
+            # sendfile(2) would write plaintext under the TLS session
+            self.logger.warning(_('zero_copy_gets is ignored when the server '
+                                  'terminates SSL itself (cert_file)'))
+            self.zero_copy_gets = False
         self.keep_cache_size = int(conf.get('keep_cache_size', 5242880))
         self.keep_cache_private = \
             config_true_value(conf.get('keep_cache_private', 'false'))
@@ -655,6 +729,127 @@ class ObjectController(object):
         file.put_metadata(metadata)
         return HTTPAccepted(request=request)
 
+    def _copy_local(self, request, device, account, fd):
+        """
+        Duplicates into fd the data file of the object named by the
+        X-Backend-Copy-From header of a PUT, as "partition/container/object"
+        on the same device, so a copy does not pass the data through the
+        proxy.  The source must be the version named by
+        X-Backend-Copy-From-Timestamp and be encrypted with the key id the
+        copy is written with.
+
+        :returns: the metadata of the source, or None if this device does not
+                  have the expected source
+        """
+        try:
+            src_partition, src_container, src_obj = \
+                unquote(request.headers['x-backend-copy-from']).split('/', 2)
+            validate_device_partition(device, src_partition)
+        except ValueError:
+            return None
+        source = DiskFile(self.devices, device, src_partition, account,
+                          src_container, src_obj, self.logger,
+                          keep_data_fp=True, crypto_driver=self.crypto_driver)
+        try:
+            if source.is_deleted() or source.is_expired() or \
+                    source.metadata.get('X-Timestamp') != \
+                    request.headers.get('x-backend-copy-from-timestamp') or \
+                    source.metadata.get('X-Object-Meta-Key-Id') != \
+                    request.headers.get('x-object-meta-key-id'):
+                return None
+            try:
+                source.get_data_file_size()
+            except (DiskFileError, DiskFileNotExist):
+                source.quarantine()
+                return None
+            self._clone_data(source.fp.fileno(), fd,
+                             int(source.metadata['Content-Length']))
+            return source.metadata
+        finally:
+            source.close(verify_file=False)
+
+    def _clone_data(self, src_fd, fd, length):
+        """
+        Duplicates the first length bytes of src_fd into fd: as a reflink if
+        the filesystem supports them, else copied inside the kernel with
+        sendfile(2), else read and written.
+        """
+        try:
+            reflink(src_fd, fd)
+            return
+        except (IOError, OSError):
+            pass
+        use_sendfile = True
+        offset = 0
+        while offset < length:
+            count = min(self.network_chunk_size, length - offset)
+            copied = 0
+            if use_sendfile:
+                try:
+                    copied = sendfile(fd, src_fd, offset, count)
+                except OSError, err:
+                    if err.errno not in (errno.ENOSYS, errno.EINVAL):
+                        raise
+                    use_sendfile = False
+            if not use_sendfile:
+                os.lseek(src_fd, offset, os.SEEK_SET)
+                chunk = os.read(src_fd, count)
+                copied = len(chunk)
+                while chunk:
+                    chunk = chunk[os.write(fd, chunk):]
+            if not copied:
+                raise DiskFileError('Data file shorter than its metadata')
+            offset += copied
+            sleep()
+
+    def _write_upload(self, request, device, fd, encryption_context):
+        """
+        Encrypts the body of a PUT into fd.
+
+        :returns: a tuple of (error response or None, etag of the stored
+                  data, etag of the body, size of the body)
+        """
+        upload_expiration = time.time() + self.max_upload_time
+        etag = md5()
+        etag_orig = md5()
+        upload_size = 0
+        last_sync = 0
+        elasped_time = 0
+        try:
+            fallocate(fd, int(request.headers.get('content-length', 0)))
+        except OSError:
+            return (HTTPInsufficientStorage(drive=device, request=request),
+                    None, None, None)
+        reader = request.environ['wsgi.input'].read
+        for chunk in iter(lambda: reader(self.network_chunk_size), ''):
+            start_time = time.time()
+            etag_orig.update(chunk)
+            upload_size += len(chunk)
+            chunk = self.crypto_driver.encrypt(encryption_context, chunk)
+            if time.time() > upload_expiration:
+                self.logger.increment('PUT.timeouts')
+                return HTTPRequestTimeout(request=request), None, None, None
+            etag.update(chunk)
+            while chunk:
+                written = os.write(fd, chunk)
+                chunk = chunk[written:]
+            # For large files sync every 512MB (by default) written
+            if upload_size - last_sync >= self.bytes_per_sync:
+                tpool.execute(fdatasync, fd)
+                drop_buffer_cache(fd, last_sync, upload_size - last_sync)
+                last_sync = upload_size
+            sleep()
+            elasped_time += time.time() - start_time
+
+        if upload_size:
+            self.logger.transfer_rate(
+                'PUT.' + device + '.timing', elasped_time, upload_size)
+
+        if 'content-length' in request.headers and \
+                int(request.headers['content-length']) != upload_size:
+            return HTTPClientDisconnect(request=request), None, None, None
+        return None, etag.hexdigest(), etag_orig.hexdigest(), upload_size
+
     @public
     @timing_stats()
     def PUT(self, request):
@@ -689,47 +884,23 @@ class ObjectController(object):
                         encryption_context=encryption_context,
                         crypto_driver=self.crypto_driver)
         orig_timestamp = file.metadata.get('X-Timestamp')
-        upload_expiration = time.time() + self.max_upload_time
-        etag = md5()
-        etag_orig = md5()
-        upload_size = 0
-        last_sync = 0
-        elasped_time = 0
         with file.mkstemp() as fd:
-            try:
-                fallocate(fd, int(request.headers.get('content-length', 0)))
-            except OSError:
-                return HTTPInsufficientStorage(drive=device, request=request)
-            reader = request.environ['wsgi.input'].read
-            for chunk in iter(lambda: reader(self.network_chunk_size), ''):
-                start_time = time.time()
-                etag_orig.update(chunk)
-                upload_size += len(chunk)
-                chunk = self.crypto_driver.encrypt(encryption_context, chunk)
-                if time.time() > upload_expiration:
-                    self.logger.increment('PUT.timeouts')
-                    return HTTPRequestTimeout(request=request)
-                etag.update(chunk)
-                while chunk:
-                    written = os.write(fd, chunk)
-                    chunk = chunk[written:]
-                # For large files sync every 512MB (by default) written
-                if upload_size - last_sync >= self.bytes_per_sync:
-                    tpool.execute(fdatasync, fd)
-                    drop_buffer_cache(fd, last_sync, upload_size - last_sync)
-                    last_sync = upload_size
-                sleep()
-                elasped_time += time.time() - start_time
-
-            if upload_size:
-                self.logger.transfer_rate(
-                    'PUT.' + device + '.timing', elasped_time, upload_size)
-
-            if 'content-length' in request.headers and \
-                    int(request.headers['content-length']) != upload_size:
-                return HTTPClientDisconnect(request=request)
-            etag = etag.hexdigest()
-            etag_orig = etag_orig.hexdigest()
+            if 'x-backend-copy-from' in request.headers:
+                source_metadata = self._copy_local(request, device, account,
+                                                   fd)
+                if source_metadata is None:
+                    return HTTPConflict(request=request)
+                etag = source_metadata['ETag']
+                etag_orig = source_metadata.get('Original-Etag', etag)
+                upload_size = int(source_metadata.get(
+                    'Original-Content-Length',
+                    source_metadata['Content-Length']))
+            else:
+                error_response, etag, etag_orig, upload_size = \
+                    self._write_upload(request, device, fd,
+                                       encryption_context)
+                if error_response:
+                    return error_response
             if ('etag' in request.headers and
                     request.headers['etag'].lower() != etag_orig):
                 return HTTPUnprocessableEntity(request=request)
@@ -836,6 +1007,15 @@ class ObjectController(object):
                 if_modified_since:
             file.close()
             return HTTPNotModified(request=request)
+        eventlet_input = request.environ.get('eventlet.input')
+        if self.zero_copy_gets and hasattr(eventlet_input, 'get_socket'):
+            sock = eventlet_input.get_socket()
+            # sendfile(2) would bypass the encryption of an SSL socket
+            if not isinstance(sock, SSLSocket):
+                file.sendfile_sock = sock
+                # every chunk we yield has to be on the wire before sendfile
+                # writes to the socket behind the server's back
+                request.environ['eventlet.minimum_write_chunk_size'] = 0
         response = Response(app_iter=file,
                             request=request, conditional_response=True)
         response.headers['Content-Type'] = file.metadata.get(
@@ -968,10 +1148,42 @@ class ObjectController(object):
         path = os.path.join(self.devices, device, DATADIR, partition)
         if not os.path.exists(path):
             mkdirs(path)
+        ssync_op = request.headers.get(ssync.SSYNC_OP_HEADER)
+        if ssync_op:
+            return self._ssync(request, device, path, ssync_op)
         suffixes = suffix.split('-') if suffix else []
         _junk, hashes = tpool_reraise(get_hashes, path, recalculate=suffixes)
         return Response(body=pickle.dumps(hashes))
 
+    def _ssync(self, request, device, path, ssync_op):
+        """
+        Handle the receiving side of an ssync REPLICATE request; see
+        :mod:`swift.obj.ssync`.
+        """
+        if ssync_op == 'missing_check':
+            try:
+                listing = json.loads(request.body)
+            except ValueError, e:
+                return HTTPBadRequest(body=str(e), request=request,
+                                      content_type='text/plain')
+            missing = tpool_reraise(ssync.find_missing, path, listing)
+            return Response(body=json.dumps(missing), request=request,
+                            content_type='application/json')
+        if ssync_op == 'push':
+            tmp_dir = os.path.join(self.devices, device, 'tmp')
+            try:
+                written = ssync.receive_records(
+                    path, tmp_dir, request.environ['wsgi.input'],
+                    self.network_chunk_size)
+            except ssync.SsyncProtocolError, e:
+                return HTTPBadRequest(body=str(e), request=request,
+                                      content_type='text/plain')
+            self.logger.update_stats('ssync.files', written)
+            return HTTPNoContent(request=request)
+        return HTTPBadRequest(body='Unknown %s %r' % (ssync.SSYNC_OP_HEADER,
+                                                      ssync_op),
+                              request=request, content_type='text/plain')
+
     def __call__(self, env, start_response):
         """WSGI Application entry point for the Swift Object Server."""
         start_time = time.time()
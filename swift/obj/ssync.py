@@ -0,0 +1,225 @@
+# Copyright (c) 2010-2012 OpenStack, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-process object replication transport, used by the object replicator in
+place of rsync when ``sync_method = ssync``.
+
+Both steps ride on the object server's REPLICATE verb, distinguished by the
+``X-Ssync-Op`` header:
+
+``missing_check``
+    The body is a JSON object mapping ``suffix/hash`` to the names of the
+    files the sender has in that hash directory.  The response is a JSON
+    list of the ``suffix/hash/filename`` paths the receiver does not have.
+
+``push``
+    The (chunked) body is a stream of records, one per missing file::
+
+        <suffix/hash/filename> <data length> <xattr count>\\n
+        <xattr name> <value length>\\n<value>     (xattr count times)
+        <data>
+
+Like ``rsync --ignore-existing --xattrs``, files already present on the
+receiver are never overwritten and ``user.`` extended attributes are copied
+verbatim, so encrypted objects stay readable with the key ids in their
+metadata.
+"""
+
+import errno
+import os
+import re
+from tempfile import mkstemp
+
+import xattr
+from eventlet import sleep
+
+from swift.common.utils import fsync, mkdirs, renamer
+
+
+SSYNC_OP_HEADER = 'X-Ssync-Op'
+MAX_LINE_LENGTH = 4096
+RELPATH_RE = re.compile(r'^([0-9a-f]{3})/([0-9a-f]{29}\1)/'
+                        r'(\d+\.\d+\.(?:data|meta|ts))$')
+
+
+class SsyncProtocolError(Exception):
+    pass
+
+
+def list_suffix_files(partition_dir, suffixes):
+    """
+    List the files under the given suffixes of a partition.
+
+    :param partition_dir: absolute path of the partition
+    :param suffixes: list of suffixes to list
+    :returns: dict of ``suffix/hash`` to a list of file names
+    """
+    listing = {}
+    for suffix in suffixes:
+        suffix_dir = os.path.join(partition_dir, suffix)
+        try:
+            hashes = os.listdir(suffix_dir)
+        except OSError, err:
+            if err.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            continue
+        for hsh in hashes:
+            try:
+                files = os.listdir(os.path.join(suffix_dir, hsh))
+            except OSError, err:
+                if err.errno not in (errno.ENOENT, errno.ENOTDIR):
+                    raise
+                continue
+            if files:
+                listing['%s/%s' % (suffix, hsh)] = files
+    return listing
+
+
+def find_missing(partition_dir, listing):
+    """
+    Receiver side of ``missing_check``.
+
+    :param partition_dir: absolute path of the local partition
+    :param listing: the sender's listing, as built by
+                    :func:`list_suffix_files`
+    :returns: sorted list of ``suffix/hash/filename`` paths not present
+              locally
+    """
+    missing = []
+    for hash_path, files in listing.iteritems():
+        try:
+            local = set(os.listdir(os.path.join(partition_dir, hash_path)))
+        except OSError, err:
+            if err.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            local = set()
+        missing.extend('%s/%s' % (hash_path, filename)
+                       for filename in files if filename not in local)
+    missing.sort()
+    return missing
+
+
+def iter_records(partition_dir, relpaths, chunk_size=65536):
+    """
+    Sender side of ``push``; yields the encoded stream of records for the
+    given files.  Files that have disappeared since the missing check are
+    skipped.
+
+    :param partition_dir: absolute path of the local partition
+    :param relpaths: ``suffix/hash/filename`` paths to send
+    :param chunk_size: size of the data chunks to yield
+    """
+    for relpath in relpaths:
+        try:
+            fp = open(os.path.join(partition_dir, relpath), 'rb')
+        except IOError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            continue
+        with fp:
+            # only the user namespace is ours to copy; security.* and
+            # trusted.* belong to the local system and the receiver
+            # refuses them
+            attrs = [(name, xattr.getxattr(fp, name))
+                     for name in xattr.listxattr(fp)
+                     if name.startswith('user.')]
+            size = os.fstat(fp.fileno()).st_size
+            header = ['%s %d %d\n' % (relpath, size, len(attrs))]
+            for name, value in attrs:
+                header.append('%s %d\n' % (name, len(value)))
+                header.append(value)
+            yield ''.join(header)
+            while size > 0:
+                chunk = fp.read(min(chunk_size, size))
+                if not chunk:
+                    raise SsyncProtocolError(
+                        '%s shrank while being sent' % relpath)
+                size -= len(chunk)
+                yield chunk
+
+
+def _read_exactly(fp, length, chunk_size):
+    while length > 0:
+        chunk = fp.read(min(chunk_size, length))
+        if not chunk:
+            raise SsyncProtocolError('Early EOF in push stream')
+        length -= len(chunk)
+        yield chunk
+
+
+def _read_line(fp):
+    line = fp.readline(MAX_LINE_LENGTH)
+    if line and not line.endswith('\n'):
+        raise SsyncProtocolError('Line too long in push stream')
+    return line[:-1]
+
+
+def receive_records(partition_dir, tmp_dir, fp, chunk_size=65536):
+    """
+    Receiver side of ``push``; writes every record read from fp into the
+    partition, unless a file of the same name is already there.
+
+    :param partition_dir: absolute path of the local partition
+    :param tmp_dir: directory on the same device for temporary files
+    :param fp: file-like object the stream is read from
+    :param chunk_size: size of the reads of file data
+    :returns: number of files written
+    :raises SsyncProtocolError: on a malformed stream
+    """
+    written = 0
+    mkdirs(tmp_dir)
+    while True:
+        line = _read_line(fp)
+        if not line:
+            return written
+        try:
+            relpath, size, attr_count = line.split(' ')
+            size = int(size)
+            attr_count = int(attr_count)
+        except ValueError:
+            raise SsyncProtocolError('Bad record header %r' % line)
+        if not RELPATH_RE.match(relpath):
+            raise SsyncProtocolError('Bad record path %r' % relpath)
+        attrs = []
+        for _junk in xrange(attr_count):
+            try:
+                name, length = _read_line(fp).split(' ')
+                length = int(length)
+            except ValueError:
+                raise SsyncProtocolError('Bad xattr header for %r' % relpath)
+            if not name.startswith('user.'):
+                raise SsyncProtocolError('Bad xattr name %r' % name)
+            attrs.append((name, ''.join(_read_exactly(fp, length,
+                                                      chunk_size))))
+        fd, tmppath = mkstemp(dir=tmp_dir)
+        try:
+            for chunk in _read_exactly(fp, size, chunk_size):
+                while chunk:
+                    chunk = chunk[os.write(fd, chunk):]
+                sleep()
+            for name, value in attrs:
+                xattr.setxattr(fd, name, value)
+            fsync(fd)
+            dest = os.path.join(partition_dir, relpath)
+            if not os.path.exists(dest):
+                renamer(tmppath, dest)
+                written += 1
+        finally:
+            os.close(fd)
+            try:
+                os.unlink(tmppath)
+            except OSError:
+                pass
@@ -96,7 +96,7 @@ class AccountController(Controller):
                    'Connection': 'close'}
         self.transfer_headers(req.headers, headers)
         if self.app.memcache:
-            self.app.memcache.delete(
+            self.clear_cached_info(
                 get_account_memcache_key(self.account_name))
         resp = self.make_requests(
             req, self.app.account_ring, account_partition, 'PUT',
@@ -116,7 +116,7 @@ class AccountController(Controller):
                    'Connection': 'close'}
         self.transfer_headers(req.headers, headers)
         if self.app.memcache:
-            self.app.memcache.delete(
+            self.clear_cached_info(
                 get_account_memcache_key(self.account_name))
         resp = self.make_requests(
             req, self.app.account_ring, account_partition, 'POST',
@@ -150,7 +150,7 @@ class AccountController(Controller):
                    'X-Trans-Id': self.trans_id,
                    'Connection': 'close'}
         if self.app.memcache:
-            self.app.memcache.delete(
+            self.clear_cached_info(
                 get_account_memcache_key(self.account_name))
         resp = self.make_requests(
             req, self.app.account_ring, account_partition, 'DELETE',
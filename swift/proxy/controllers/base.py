@@ -24,20 +24,24 @@
 #   These shenanigans are to ensure all related objects can be garbage
 # collected. We've seen objects hang around forever otherwise.
 
+import socket
 import time
 import functools
 import inspect
+from math import ceil
 
 from eventlet import spawn_n, GreenPile
+from eventlet.green.httplib import HTTPException
 from eventlet.queue import Queue, Empty, Full
 from eventlet.timeout import Timeout
 
 from swift.common.wsgi import make_pre_authed_request
 from swift.common.utils import normalize_timestamp, config_true_value, \
     public, split_path, cache_from_env
-from swift.common.bufferedhttp import http_connect
+from swift.common.bufferedhttp import http_connect, http_connect_pooled
 from swift.common.constraints import MAX_ACCOUNT_NAME_LENGTH
-from swift.common.exceptions import ChunkReadTimeout, ConnectionTimeout
+from swift.common.exceptions import ChunkReadError, ChunkReadTimeout, \
+    ConnectionTimeout
 from swift.common.http import is_informational, is_success, is_redirection, \
     is_server_error, HTTP_OK, HTTP_PARTIAL_CONTENT, HTTP_MULTIPLE_CHOICES, \
     HTTP_BAD_REQUEST, HTTP_NOT_FOUND, HTTP_SERVICE_UNAVAILABLE, \
@@ -58,7 +62,8 @@ def update_headers(response, headers):
         if name == 'etag':
             response.headers[name] = value.replace('"', '')
         elif name not in ('date', 'content-length', 'content-type',
-                          'connection', 'x-put-timestamp', 'x-delete-after'):
+                          'connection', 'transfer-encoding',
+                          'x-put-timestamp', 'x-delete-after'):
             response.headers[name] = value
 
 
@@ -125,6 +130,7 @@ def headers_to_container_info(headers, status_int=HTTP_OK):
         'sync_key': headers.get('x-container-sync-key'),
         'object_count': headers.get('x-container-object-count'),
         'bytes': headers.get('x-container-bytes-used'),
+        'put_timestamp': headers.get('x-put-timestamp'),
         'versions': headers.get('x-versions-location'),
         'cors': {
             'allow_origin': headers.get(
@@ -264,6 +270,50 @@ def get_account_info(env, app, swift_source=None):
     return env[env_key]
 
 
+class ReadAheadQueue(Queue):
+    """
+    Queue of the chunks of a backend response waiting to be sent to the
+    client, bounded in bytes rather than in chunks.  It starts out one chunk
+    deep, like a plain Queue(1), and deepens up to max_bytes so that it can
+    hold what the client, at the rate it has been draining the queue, would
+    consume during the longest backend read stall seen so far.  A client
+    that keeps up is then not held up by the odd slow read from the object
+    server, while slow clients and steady backends keep the buffer small.
+
+    :param chunk_size: largest chunk that will be put in the queue
+    :param max_bytes: upper bound on the bytes the queue holds
+    """
+
+    def __init__(self, chunk_size, max_bytes):
+        Queue.__init__(self, 1)
+        self.chunk_size = chunk_size
+        self.max_chunks = max(1, max_bytes // chunk_size)
+        self.longest_stall = 0.0
+        self.client_bytes = 0
+        self.client_time = 0.0
+
+    def client_sent(self, nbytes, elapsed):
+        """
+        Record that the client took elapsed seconds to accept nbytes.
+        """
+        self.client_bytes += nbytes
+        self.client_time += elapsed
+
+    def backend_read(self, elapsed):
+        """
+        Record that a read from the backend took elapsed seconds, and resize
+        the queue to match the rates seen so far.
+        """
+        self.longest_stall = max(self.longest_stall, elapsed)
+        if not self.client_time or self.maxsize is None:
+            return
+        target = self.client_bytes / self.client_time * self.longest_stall
+        depth = min(self.max_chunks,
+                    max(1, int(ceil(target / self.chunk_size))))
+        if depth != self.maxsize:
+            self.resize(depth)
+
+
 class Controller(object):
     """Base WSGI controller class for the proxy"""
     server_type = 'Base'
@@ -306,6 +356,7 @@ class Controller(object):
         """
         node['errors'] = node.get('errors', 0) + 1
         node['last_error'] = time.time()
+        self.app.record_node_error(node)
 
     def error_occurred(self, node, msg):
         """
@@ -315,6 +366,7 @@ class Controller(object):
         :param msg: error message
         """
         self.error_increment(node)
+        self.purge_node_conns(node)
         self.app.logger.error(_('%(msg)s %(ip)s:%(port)s'),
                               {'msg': msg, 'ip': node['ip'],
                               'port': node['port']})
@@ -327,6 +379,8 @@ class Controller(object):
         :param typ: server type
         :param additional_info: additional information to log
         """
+        self.purge_node_conns(node)
+        self.app.record_node_error(node)
         self.app.logger.exception(
             _('ERROR with %(type)s server %(ip)s:%(port)s/%(device)s re: '
               '%(info)s'),
@@ -363,6 +417,132 @@ class Controller(object):
         """
         node['errors'] = self.app.error_suppression_limit + 1
         node['last_error'] = time.time()
+        self.purge_node_conns(node)
+        self.app.record_node_error(node)
+
+    def purge_node_conns(self, node):
+        """
+        Close any idle keep-alive connections to a node, so that requests
+        to a node that is misbehaving start from a fresh connection.
+
+        :param node: dictionary of node to drop the connections of
+        """
+        if self.app.conn_pool is not None:
+            self.app.conn_pool.purge(node['ip'], node['port'])
+
+    def backend_connect(self, node, part, method, path, headers=None,
+                        query_string=None):
+        """
+        Connect to a backend node and send the request line and headers,
+        through the proxy's keep-alive connection pool if it has one.
+
+        :param node: dictionary of the node to connect to
+        :param part: partition on the node's device
+        :param method: HTTP method
+        :param path: request path
+        :param headers: dictionary of headers
+        :param query_string: request query string
+        :returns: HTTPConnection object
+        """
+        if self.app.conn_pool is None:
+            return http_connect(node['ip'], node['port'], node['device'],
+                                part, method, path, headers, query_string)
+        if headers:
+            headers = dict((key, value) for key, value in headers.iteritems()
+                           if key.lower() != 'connection')
+        return http_connect_pooled(
+            self.app.conn_pool, node['ip'], node['port'], node['device'],
+            part, method, path, headers=headers, query_string=query_string)
+
+    def backend_response(self, node, part, method, path, headers=None,
+                         query_string=None, expect=False):
+        """
+        Make a backend request with :meth:`backend_connect` and wait for its
+        response.  A pooled connection the node closed while it sat idle is
+        discarded and the request made again on another one.
+
+        :param expect: get the response to ``Expect: 100-continue`` with
+                       getexpect() rather than the final response
+        :returns: tuple of (connection, response)
+        """
+        while True:
+            start_node_timing = time.time()
+            with ConnectionTimeout(self.app.conn_timeout):
+                conn = self.backend_connect(node, part, method, path,
+                                            headers, query_string)
+            self.app.set_node_timing(node, time.time() - start_node_timing)
+            try:
+                with Timeout(self.app.node_timeout):
+                    if expect:
+                        resp = conn.getexpect()
+                    else:
+                        resp = conn.getresponse()
+                self.app.record_node_latency(
+                    node, time.time() - start_node_timing)
+                return conn, resp
+            except (socket.error, HTTPException):
+                if not getattr(conn, 'reused', False):
+                    raise
+                conn.close()
+
+    def release_conn(self, conn, resp):
+        """
+        Hand a backend connection back to the keep-alive pool once its
+        response has been read completely; otherwise close it.
+
+        :param conn: connection from :meth:`backend_connect`
+        :param resp: the connection's response
+        """
+        if self.app.conn_pool is None:
+            return
+        if resp.isclosed() and not resp.will_close:
+            self.app.conn_pool.put(conn)
+        else:
+            conn.close()
+
+    def get_cached_info(self, cache_key):
+        """
+        Look up account or container info in the proxy's local info cache
+        and then in memcache, filling the local cache on a memcache hit.
+
+        :param cache_key: memcache key of the info
+        :returns: the cached value, or None
+        """
+        info_cache = self.app.info_cache
+        if info_cache:
+            cache_value = info_cache.get(cache_key)
+            if cache_value is not None:
+                return dict(cache_value) if isinstance(cache_value, dict) \
+                    else cache_value
+        cache_value = self.app.memcache.get(cache_key)
+        if info_cache and cache_value is not None:
+            info_cache.set(cache_key, dict(cache_value)
+                           if isinstance(cache_value, dict) else cache_value)
+        return cache_value
+
+    def set_cached_info(self, cache_key, info, cache_timeout):
+        """
+        Store account or container info in memcache and in the proxy's
+        local info cache.
+
+        :param cache_key: memcache key of the info
+        :param info: info dict to cache
+        :param cache_timeout: memcache expiry, in seconds
+        """
+        self.app.memcache.set(cache_key, info, time=cache_timeout)
+        if self.app.info_cache:
+            self.app.info_cache.set(cache_key, dict(info))
+
+    def clear_cached_info(self, cache_key):
+        """
+        Drop account or container info from memcache and from the proxy's
+        local info cache, ahead of a request that changes it.
+
+        :param cache_key: memcache key of the info
+        """
+        self.app.memcache.delete(cache_key)
+        if self.app.info_cache:
+            self.app.info_cache.delete(cache_key)
 
     def account_info(self, account, autocreate=False):
         """
@@ -381,7 +561,7 @@ class Controller(object):
         # 0 = no responses, 200 = found, 404 = not found, -1 = mixed responses
         if self.app.memcache:
             cache_key = get_account_memcache_key(account)
-            cache_value = self.app.memcache.get(cache_key)
+            cache_value = self.get_cached_info(cache_key)
             if not isinstance(cache_value, dict):
                 result_code = cache_value
                 container_count = 0
@@ -404,15 +584,11 @@ class Controller(object):
                 break
             attempts_left -= 1
             try:
-                start_node_timing = time.time()
-                with ConnectionTimeout(self.app.conn_timeout):
-                    conn = http_connect(node['ip'], node['port'],
-                                        node['device'], partition, 'HEAD',
-                                        path, headers)
-                self.app.set_node_timing(node, time.time() - start_node_timing)
+                conn, resp = self.backend_response(node, partition, 'HEAD',
+                                                   path, headers)
                 with Timeout(self.app.node_timeout):
-                    resp = conn.getresponse()
                     resp.read()
+                    self.release_conn(conn, resp)
                     if is_success(resp.status):
                         result_code = HTTP_OK
                         account_info.update(
@@ -452,14 +628,13 @@ class Controller(object):
             else:
                 cache_timeout = self.app.recheck_account_existence * 0.1
             account_info.update(status=result_code)
-            self.app.memcache.set(cache_key,
-                                  account_info,
-                                  time=cache_timeout)
+            self.set_cached_info(cache_key, account_info, cache_timeout)
         if result_code == HTTP_OK:
             return partition, nodes, account_info['container_count']
         return None, None, None
 
-    def container_info(self, account, container, account_autocreate=False):
+    def container_info(self, account, container, account_autocreate=False,
+                       cached=True):
         """
         Get container information and thusly verify container existence.
         This will also make a call to account_info to verify that the
@@ -467,6 +642,8 @@ class Controller(object):
 
         :param account: account name for the container
         :param container: container name to look up
+        :param cached: if False, the container servers are asked even when
+                       the information is cached, and the cache is refreshed
         :returns: dict containing at least container partition ('partition'),
                   container nodes ('containers'), container read
                   acl ('read_acl'), container write acl ('write_acl'),
@@ -482,7 +659,7 @@ class Controller(object):
                           'nodes': None}
         if self.app.memcache:
             cache_key = get_container_memcache_key(account, container)
-            cache_value = self.app.memcache.get(cache_key)
+            cache_value = cached and self.get_cached_info(cache_key)
             if isinstance(cache_value, dict):
                 if 'container_size' in cache_value:
                     cache_value['count'] = cache_value['container_size']
@@ -497,15 +674,11 @@ class Controller(object):
         headers = {'x-trans-id': self.trans_id, 'Connection': 'close'}
         for node in self.iter_nodes(part, nodes, self.app.container_ring):
             try:
-                start_node_timing = time.time()
-                with ConnectionTimeout(self.app.conn_timeout):
-                    conn = http_connect(node['ip'], node['port'],
-                                        node['device'], part, 'HEAD',
-                                        path, headers)
-                self.app.set_node_timing(node, time.time() - start_node_timing)
+                conn, resp = self.backend_response(node, part, 'HEAD', path,
+                                                   headers)
                 with Timeout(self.app.node_timeout):
-                    resp = conn.getresponse()
                     resp.read()
+                self.release_conn(conn, resp)
                 if is_success(resp.status):
                     container_info.update(
                         headers_to_container_info(resp.getheaders()))
@@ -525,13 +698,13 @@ class Controller(object):
                 break
         if self.app.memcache:
             if container_info['status'] == HTTP_OK:
-                self.app.memcache.set(
+                self.set_cached_info(
                     cache_key, container_info,
-                    time=self.app.recheck_container_existence)
+                    self.app.recheck_container_existence)
             elif container_info['status'] == HTTP_NOT_FOUND:
-                self.app.memcache.set(
+                self.set_cached_info(
                     cache_key, container_info,
-                    time=self.app.recheck_container_existence * 0.1)
+                    self.app.recheck_container_existence * 0.1)
         if container_info['status'] == HTTP_OK:
             container_info['partition'] = part
             container_info['nodes'] = nodes
@@ -550,7 +723,10 @@ class Controller(object):
             if not self.error_limited(node):
                 yield node
         handoffs = 0
-        for node in ring.get_more_nodes(partition):
+        handoff_nodes = ring.get_more_nodes(partition)
+        if self.app.sorting_method == 'score':
+            handoff_nodes = self.app.sort_handoffs(handoff_nodes, len(nodes))
+        for node in handoff_nodes:
             if not self.error_limited(node):
                 handoffs += 1
                 if self.app.log_handoffs:
@@ -566,18 +742,15 @@ class Controller(object):
         self.app.logger.thread_locals = logger_thread_locals
         for node in nodes:
             try:
-                start_node_timing = time.time()
-                with ConnectionTimeout(self.app.conn_timeout):
-                    conn = http_connect(node['ip'], node['port'],
-                                        node['device'], part, method, path,
-                                        headers=headers, query_string=query)
-                    conn.node = node
-                self.app.set_node_timing(node, time.time() - start_node_timing)
+                conn, resp = self.backend_response(node, part, method, path,
+                                                   headers, query)
+                conn.node = node
                 with Timeout(self.app.node_timeout):
-                    resp = conn.getresponse()
                     if not is_informational(resp.status) and \
                             not is_server_error(resp.status):
-                        return resp.status, resp.reason, resp.read()
+                        body = resp.read()
+                        self.release_conn(conn, resp)
+                        return resp.status, resp.reason, body
                     elif resp.status == HTTP_INSUFFICIENT_STORAGE:
                         self.error_limit(node)
             except (Exception, Timeout):
@@ -609,6 +782,22 @@ class Controller(object):
         return self.best_response(req, statuses, reasons, bodies,
                                   '%s %s' % (self.server_type, req.method))
 
+    def have_quorum(self, statuses, node_count):
+        """
+        Given a list of statuses from several requests, determine if a
+        quorum response can already be determined.
+
+        :param statuses: list of statuses returned so far
+        :param node_count: number of nodes being queried
+        :returns: True if a majority of node_count agree on the class of
+                  response best_response would pick
+        """
+        for hundred in (HTTP_OK, HTTP_MULTIPLE_CHOICES, HTTP_BAD_REQUEST):
+            if len([s for s in statuses
+                    if hundred <= s < hundred + 100]) > node_count / 2:
+                return True
+        return False
+
     def best_response(self, req, statuses, reasons, bodies, server_type,
                       etag=None):
         """
@@ -651,7 +840,58 @@ class Controller(object):
         """Handler for HTTP HEAD requests."""
         return self.GETorHEAD(req)
 
-    def _make_app_iter_reader(self, node, source, queue, logger_thread_locals):
+    def _resume_source(self, req, partition, nodes, path, source, offset):
+        """
+        Find another node to serve the rest of an object GET after reading
+        from source failed part-way: asks the remaining nodes for the bytes
+        from offset on with a Range request, and only accepts a response
+        for the same ETag and X-Timestamp.
+
+        :param req: the client's swob.Request
+        :param partition: partition of the object
+        :param nodes: iterator of the nodes not tried yet
+        :param path: path for the backend request
+        :param source: the response that failed
+        :param offset: number of bytes of source already read
+        :returns: tuple of (node, response), or (None, None) if no node can
+                  serve the rest
+        """
+        etag = source.getheader('etag')
+        timestamp = source.getheader('x-timestamp')
+        if source.status == HTTP_PARTIAL_CONTENT:
+            content_range = source.getheader('content-range')
+            if not content_range:
+                # multipart/byteranges can't be spliced
+                return None, None
+            first, last = content_range.split()[1].split('/')[0].split('-')
+            resume_range = 'bytes=%d-%s' % (int(first) + offset, last)
+        else:
+            resume_range = 'bytes=%d-' % offset
+        headers = dict((key, value) for key, value in req.headers.iteritems()
+                       if not key.lower().startswith('if-'))
+        headers['Range'] = resume_range
+        headers['Connection'] = 'close'
+        for node in nodes:
+            if self.error_limited(node):
+                continue
+            try:
+                conn, new_source = self.backend_response(
+                    node, partition, 'GET', path, headers, req.query_string)
+            except (Exception, Timeout):
+                self.exception_occurred(
+                    node, self.server_type,
+                    _('Trying to resume GET of %s') % req.path)
+                continue
+            new_source.swift_conn = conn
+            if new_source.status == HTTP_PARTIAL_CONTENT and \
+                    new_source.getheader('etag') == etag and \
+                    new_source.getheader('x-timestamp') == timestamp:
+                return node, new_source
+            self.close_swift_conn(new_source)
+        return None, None
+
+    def _make_app_iter_reader(self, node, source, queue, logger_thread_locals,
+                              resume=None):
         """
         Reads from the source and places data in the queue. It expects
         something else be reading from the queue and, if nothing does within
@@ -664,16 +904,42 @@ class Controller(object):
         :param logger_thread_locals: The thread local values to be set on the
                                      self.app.logger to retain transaction
                                      logging information.
+        :param resume: if not None, called as resume(source, offset) when
+                       reading from source fails after offset bytes, to get
+                       a (node, source) to carry on with; see _resume_source
         """
         self.app.logger.thread_locals = logger_thread_locals
         success = True
+        offset = 0
         try:
             try:
                 while True:
-                    with ChunkReadTimeout(self.app.node_timeout):
-                        chunk = source.read(self.app.object_chunk_size)
+                    start = time.time()
+                    try:
+                        with ChunkReadTimeout(self.app.node_timeout):
+                            chunk = source.read(self.app.object_chunk_size)
+                            if not chunk and getattr(source, 'length', None):
+                                raise ChunkReadError(
+                                    _('%d bytes short') % source.length)
+                    except (Exception, Timeout):
+                        if resume is None:
+                            raise
+                        self.exception_occurred(
+                            node, _('Object'), _('Trying to read during GET'))
+                        # a stalled connection may take a while to close
+                        spawn_n(self.close_swift_conn, source)
+                        node, source = resume(source, offset)
+                        if source is None:
+                            success = False
+                            break
+                        self.app.logger.increment('get_resumes')
+                        # the new source starts where this one stopped
+                        offset = 0
+                        continue
                     if not chunk:
                         break
+                    offset += len(chunk)
+                    queue.backend_read(time.time() - start)
                     queue.put(chunk, timeout=self.app.client_timeout)
             except Full:
                 self.app.logger.warn(
@@ -687,13 +953,18 @@ class Controller(object):
                 success = False
         finally:
             # Ensure the queue getter gets a terminator.
-            queue.resize(2)
+            queue.resize(None)
             queue.put(success)
-            # Close-out the connection as best as possible.
+            # Close-out the connection as best as possible, unless the whole
+            # response was read and it can go back to the pool.
+            if success and self.app.conn_pool is not None and \
+                    getattr(source, 'swift_conn', None) and source.isclosed():
+                self.release_conn(source.swift_conn, source)
+                source.swift_conn = None
             if getattr(source, 'swift_conn', None):
                 self.close_swift_conn(source)
 
-    def _make_app_iter(self, node, source):
+    def _make_app_iter(self, node, source, resume=None):
         """
         Returns an iterator over the contents of the source (via its read
         func).  There is also quite a bit of cleanup to ensure garbage
@@ -702,15 +973,17 @@ class Controller(object):
         :param source: The httplib.Response object this iterator should read
                        from.
         :param node: The node the source is reading from, for logging purposes.
+        :param resume: passed on to _make_app_iter_reader
         """
         try:
             # Spawn reader to read from the source and place in the queue.
             # We then drop any reference to the source or node, for garbage
             # collection purposes.
-            queue = Queue(1)
+            queue = ReadAheadQueue(self.app.object_chunk_size,
+                                   self.app.read_ahead_bytes)
             spawn_n(self._make_app_iter_reader, node, source, queue,
-                    self.app.logger.thread_locals)
-            source = node = None
+                    self.app.logger.thread_locals, resume)
+            source = node = resume = None
             while True:
                 chunk = queue.get(timeout=self.app.node_timeout)
                 if isinstance(chunk, bool):  # terminator
@@ -719,7 +992,9 @@ class Controller(object):
                         raise Exception(_('Failed to read all data'
                                           ' from the source'))
                     break
+                start = time.time()
                 yield chunk
+                queue.client_sent(len(chunk), time.time() - start)
         except Empty:
             raise ChunkReadTimeout()
         except (GeneratorExit, Timeout):
@@ -728,6 +1003,44 @@ class Controller(object):
             self.app.logger.exception(_('Trying to send to client'))
             raise
 
+    def _make_unbuffered_app_iter(self, node, source):
+        """
+        Returns an iterator over the contents of the source that only reads
+        from it as it is iterated, with no reader greenthread, read-ahead or
+        client timeout; for responses that may be left unread for a while,
+        such as prefetched segments of a large object.
+
+        :param node: The node the source is reading from, for logging
+                     purposes.
+        :param source: The httplib.Response object this iterator should read
+                       from.
+        """
+        success = False
+        try:
+            while True:
+                with ChunkReadTimeout(self.app.node_timeout):
+                    chunk = source.read(self.app.object_chunk_size)
+                    if not chunk and getattr(source, 'length', None):
+                        raise ChunkReadError(
+                            _('%d bytes short') % source.length)
+                if not chunk:
+                    break
+                yield chunk
+            success = True
+        except GeneratorExit:
+            pass
+        except (Exception, Timeout):
+            self.exception_occurred(node, _('Object'),
+                                    _('Trying to read during GET'))
+            raise
+        finally:
+            if success and self.app.conn_pool is not None and \
+                    getattr(source, 'swift_conn', None) and source.isclosed():
+                self.release_conn(source.swift_conn, source)
+                source.swift_conn = None
+            if getattr(source, 'swift_conn', None):
+                self.close_swift_conn(source)
+
     def close_swift_conn(self, src):
         try:
             src.swift_conn.close()
@@ -751,6 +1064,97 @@ class Controller(object):
         """
         return is_success(src.status) or is_redirection(src.status)
 
+    def _get_source(self, req, server_type, partition, node, path):
+        """
+        Make one backend request for GETorHEAD_base.
+
+        :returns: the response, with its connection as swift_conn, or None
+                  if the request failed
+        """
+        try:
+            headers = dict(req.headers)
+            headers['Connection'] = 'close'
+            start = time.time()
+            conn, possible_source = self.backend_response(
+                node, partition, req.method, path, headers,
+                req.query_string)
+            self.app.get_latencies.append(time.time() - start)
+            # See NOTE: swift_conn at top of file about this.
+            possible_source.swift_conn = conn
+            return possible_source
+        except (Exception, Timeout):
+            self.exception_occurred(
+                node, server_type, _('Trying to %(method)s %(path)s') %
+                {'method': req.method, 'path': req.path})
+
+    def _iter_responses(self, req, server_type, partition, nodes, path):
+        """
+        Yields (node, response) for the nodes that are not error limited,
+        asking them one after another; response is None if the request to
+        that node failed.
+        """
+        for node in nodes:
+            if self.error_limited(node):
+                continue
+            yield node, self._get_source(req, server_type, partition, node,
+                                         path)
+
+    def _put_source(self, results, req, server_type, partition, node, path,
+                    logger_thread_locals):
+        self.app.logger.thread_locals = logger_thread_locals
+        results.put((node, self._get_source(req, server_type, partition,
+                                            node, path)))
+
+    def _close_sources(self, results, count):
+        for _junk in xrange(count):
+            node, source = results.get()
+            if source is not None:
+                self.close_swift_conn(source)
+
+    def _iter_hedged_responses(self, req, server_type, partition, nodes,
+                               path):
+        """
+        Like _iter_responses, except that when the node asked has not
+        answered within app.hedge_delay() seconds, the next node is asked as
+        well and whichever answers first is yielded first.  No more than two
+        requests are in flight at a time; the responses to those still in
+        flight when the caller is done are closed as they arrive.
+        """
+        results = Queue()
+        in_flight = 0
+
+        def start_next():
+            for node in nodes:
+                if not self.error_limited(node):
+                    spawn_n(self._put_source, results, req, server_type,
+                            partition, node, path,
+                            self.app.logger.thread_locals)
+                    return True
+            return False
+
+        try:
+            delay = self.app.hedge_delay()
+            if start_next():
+                in_flight = 1
+            while in_flight:
+                try:
+                    node, source = results.get(
+                        timeout=delay if in_flight == 1 else None)
+                except Empty:
+                    if start_next():
+                        in_flight += 1
+                        self.app.logger.increment('hedged_requests')
+                    else:
+                        delay = None
+                    continue
+                in_flight -= 1
+                yield node, source
+                if not in_flight and start_next():
+                    in_flight = 1
+        finally:
+            if in_flight:
+                spawn_n(self._close_sources, results, in_flight)
+
     def GETorHEAD_base(self, req, server_type, partition, nodes, path,
                        attempts):
         """
@@ -770,58 +1174,50 @@ class Controller(object):
         sources = []
         newest = config_true_value(req.headers.get('x-newest', 'f'))
         nodes = iter(nodes)
-        while len(statuses) < attempts:
-            try:
-                node = nodes.next()
-            except StopIteration:
-                break
-            if self.error_limited(node):
-                continue
-            start_node_timing = time.time()
-            try:
-                with ConnectionTimeout(self.app.conn_timeout):
-                    headers = dict(req.headers)
-                    headers['Connection'] = 'close'
-                    conn = http_connect(
-                        node['ip'], node['port'], node['device'], partition,
-                        req.method, path, headers=headers,
-                        query_string=req.query_string)
-                self.app.set_node_timing(node, time.time() - start_node_timing)
-                with Timeout(self.app.node_timeout):
-                    possible_source = conn.getresponse()
-                    # See NOTE: swift_conn at top of file about this.
-                    possible_source.swift_conn = conn
-            except (Exception, Timeout):
-                self.exception_occurred(
-                    node, server_type, _('Trying to %(method)s %(path)s') %
-                    {'method': req.method, 'path': req.path})
-                continue
-            if self.is_good_source(possible_source):
-                # 404 if we know we don't have a synced copy
-                if not float(possible_source.getheader('X-PUT-Timestamp', 1)):
-                    statuses.append(HTTP_NOT_FOUND)
-                    reasons.append('')
-                    bodies.append('')
-                    self.close_swift_conn(possible_source)
+        if self.app.hedged_get_percentile and not newest:
+            responses = self._iter_hedged_responses(
+                req, server_type, partition, nodes, path)
+        else:
+            responses = self._iter_responses(
+                req, server_type, partition, nodes, path)
+        try:
+            for node, possible_source in responses:
+                if possible_source is None:
+                    continue
+                if self.is_good_source(possible_source):
+                    # 404 if we know we don't have a synced copy
+                    if not float(possible_source.getheader('X-PUT-Timestamp',
+                                                           1)):
+                        statuses.append(HTTP_NOT_FOUND)
+                        reasons.append('')
+                        bodies.append('')
+                        self.close_swift_conn(possible_source)
+                    else:
+                        statuses.append(possible_source.status)
+                        reasons.append(possible_source.reason)
+                        bodies.append('')
+                        sources.append(possible_source)
+                        if not newest:  # one good source is enough
+                            break
                 else:
                     statuses.append(possible_source.status)
                     reasons.append(possible_source.reason)
-                    bodies.append('')
-                    sources.append(possible_source)
-                    if not newest:  # one good source is enough
-                        break
-            else:
-                statuses.append(possible_source.status)
-                reasons.append(possible_source.reason)
-                bodies.append(possible_source.read())
-                if possible_source.status == HTTP_INSUFFICIENT_STORAGE:
-                    self.error_limit(node)
-                elif is_server_error(possible_source.status):
-                    self.error_occurred(node, _('ERROR %(status)d %(body)s '
-                                                'From %(type)s Server') %
-                                        {'status': possible_source.status,
-                                         'body': bodies[-1][:1024],
-                                         'type': server_type})
+                    bodies.append(possible_source.read())
+                    self.release_conn(possible_source.swift_conn,
+                                      possible_source)
+                    if possible_source.status == HTTP_INSUFFICIENT_STORAGE:
+                        self.error_limit(node)
+                    elif is_server_error(possible_source.status):
+                        self.error_occurred(
+                            node, _('ERROR %(status)d %(body)s '
+                                    'From %(type)s Server') %
+                            {'status': possible_source.status,
+                             'body': bodies[-1][:1024],
+                             'type': server_type})
+                if len(statuses) >= attempts:
+                    break
+        finally:
+            responses.close()
         if sources:
             sources.sort(key=source_key)
             source = sources.pop()
@@ -830,9 +1226,19 @@ class Controller(object):
             res = Response(request=req, conditional_response=True)
             if req.method == 'GET' and \
                     source.status in (HTTP_OK, HTTP_PARTIAL_CONTENT):
-                res.app_iter = self._make_app_iter(node, source)
+                resume = None
+                if self.server_type == 'Object':
+                    resume = functools.partial(
+                        self._resume_source, req, partition, nodes, path)
+                if req.environ.get('swift.proxy.read_unbuffered'):
+                    res.app_iter = self._make_unbuffered_app_iter(node,
+                                                                  source)
+                else:
+                    res.app_iter = self._make_app_iter(node, source, resume)
                 # See NOTE: swift_conn at top of file about this.
                 res.swift_conn = source.swift_conn
+            else:
+                self.release_conn(source.swift_conn, source)
             res.status = source.status
             update_headers(res, source.getheaders())
             if not res.environ:
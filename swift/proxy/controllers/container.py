@@ -75,10 +75,10 @@ class ContainerController(Controller):
             # set the memcache container size for ratelimiting
             cache_key = get_container_memcache_key(self.account_name,
                                                    self.container_name)
-            self.app.memcache.set(
+            self.set_cached_info(
                 cache_key,
                 headers_to_container_info(resp.headers, resp.status_int),
-                time=self.app.recheck_container_existence)
+                self.app.recheck_container_existence)
 
         if 'swift.authorize' in req.environ:
             req.acl = resp.headers.get('x-container-read')
@@ -138,7 +138,7 @@ class ContainerController(Controller):
         if self.app.memcache:
             cache_key = get_container_memcache_key(self.account_name,
                                                    self.container_name)
-            self.app.memcache.delete(cache_key)
+            self.clear_cached_info(cache_key)
         resp = self.make_requests(
             req, self.app.container_ring,
             container_partition, 'PUT', req.path_info, headers)
@@ -164,7 +164,7 @@ class ContainerController(Controller):
                    'Connection': 'close'}
         self.transfer_headers(req.headers, headers)
         if self.app.memcache:
-            self.app.memcache.delete(get_container_memcache_key(
+            self.clear_cached_info(get_container_memcache_key(
                 self.account_name, self.container_name))
         resp = self.make_requests(
             req, self.app.container_ring, container_partition, 'POST',
@@ -186,7 +186,7 @@ class ContainerController(Controller):
         if self.app.memcache:
             cache_key = get_container_memcache_key(self.account_name,
                                                    self.container_name)
-            self.app.memcache.delete(cache_key)
+            self.clear_cached_info(cache_key)
         resp = self.make_requests(
             req, self.app.container_ring, container_partition, 'DELETE',
             req.path_info, headers)
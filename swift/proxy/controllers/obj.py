@@ -32,17 +32,18 @@ from datetime import datetime
 from urllib import unquote, quote
 from hashlib import md5
 
-from eventlet import sleep, GreenPile
-from eventlet.queue import Queue
+from collections import deque
+
+from eventlet import sleep, spawn, spawn_n, GreenPile
+from eventlet.queue import Empty, Queue
 from eventlet.timeout import Timeout
 
 from swift.common.utils import ContextPool, normalize_timestamp, \
     config_true_value, public, json, csv_append
-from swift.common.bufferedhttp import http_connect
 from swift.common.constraints import check_metadata, check_object_creation, \
     CONTAINER_LISTING_LIMIT, MAX_FILE_SIZE
 from swift.common.exceptions import ChunkReadTimeout, \
-    ChunkWriteTimeout, ConnectionTimeout, ListingIterNotFound, \
+    ChunkWriteTimeout, ListingIterNotFound, \
     ListingIterNotAuthorized, ListingIterError, SloSegmentError
 from swift.common.http import is_success, is_client_error, HTTP_CONTINUE, \
     HTTP_CREATED, HTTP_MULTIPLE_CHOICES, HTTP_NOT_FOUND, HTTP_CONFLICT, \
@@ -86,6 +87,27 @@ def check_content_type(req):
     return None
 
 
+# number of listing entries of a DLO's segments per memcache entry
+DLO_LISTING_CACHE_PAGE_SIZE = 1000
+
+
+class SegmentPrefetch(object):
+    """
+    A segment of a SegmentedIterable's prefetch window.
+
+    :param segment_dict: the listing entry of the segment
+    :param start: the time the GET of the segment may start at
+    """
+
+    def __init__(self, segment_dict, start):
+        self.segment_dict = segment_dict
+        self.start = start
+        self.thread = None
+        self.chunks = deque()
+        self.started = False
+        self.claimed = False
+
+
 class SegmentedIterable(object):
     """
     Iterable that returns the object contents for a segmented object in Swift.
@@ -94,6 +116,11 @@ class SegmentedIterable(object):
     `status_int` will be updated (again, just for logging since the original
     status would have already been sent to the client).
 
+    When the proxy's segment_prefetch is set, the GETs of that many segments
+    following the current one are kept open, each buffering its first chunks
+    until segment_prefetch_bytes are held for the whole window; segments are
+    still returned in listing order.
+
     :param controller: The ObjectController instance to work with.
     :param container: The container the object segments are within. If
                       container is None will derive container from elements
@@ -123,6 +150,170 @@ class SegmentedIterable(object):
         if not self.response:
             self.response = Response()
         self.next_get_time = 0
+        self.prefetched = deque()
+        self.prefetch_bytes = 0
+
+    def _schedule_get(self, segment):
+        """
+        Returns the time the GET of the given segment may start at, so that
+        segments past rate_limit_after_segment of a non-SLO manifest are
+        fetched at no more than rate_limit_segments_per_sec.
+
+        :param segment: the (one-based) number of the segment
+        """
+        now = time.time()
+        start = now
+        if not self.is_slo and \
+                segment > self.controller.app.rate_limit_after_segment:
+            start = max(self.next_get_time, now)
+        self.next_get_time = \
+            start + 1.0 / self.controller.app.rate_limit_segments_per_sec
+        return start
+
+    def _get_segment(self, segment_dict, seek=0, unbuffered=False):
+        """
+        Makes the GET request for one object segment.
+
+        :param segment_dict: the listing entry of the segment
+        :param seek: the offset in the segment to start reading at
+        :param unbuffered: if True, the segment is only read from the object
+                           server as its app_iter is iterated, so it can be
+                           left unread for as long as needed
+        :returns: the swob.Response of the segment
+        :raises: SloSegmentError if the segment no longer matches the SLO
+                 manifest, Exception if it could not be loaded
+        """
+        if self.container is None:
+            container, obj = \
+                segment_dict['name'].lstrip('/').split('/', 1)
+        else:
+            container, obj = self.container, segment_dict['name']
+        partition, nodes = self.controller.app.object_ring.get_nodes(
+            self.controller.account_name, container, obj)
+        path = '/%s/%s/%s' % (self.controller.account_name, container, obj)
+        req = Request.blank(path)
+        if seek:
+            req.range = 'bytes=%s-' % seek
+        if unbuffered:
+            req.environ['swift.proxy.read_unbuffered'] = True
+        nodes = self.controller.app.sort_nodes(nodes)
+        resp = self.controller.GETorHEAD_base(
+            req, _('Object'), partition,
+            self.controller.iter_nodes(partition, nodes,
+                                       self.controller.app.object_ring),
+            path, len(nodes))
+        if self.is_slo and resp.status_int == HTTP_NOT_FOUND:
+            raise SloSegmentError(_(
+                'Could not load object segment %(path)s:'
+                ' %(status)s') % {'path': path, 'status': resp.status_int})
+        if not is_success(resp.status_int):
+            raise Exception(_(
+                'Could not load object segment %(path)s:'
+                ' %(status)s') % {'path': path, 'status': resp.status_int})
+        if self.is_slo:
+            if (resp.content_length != segment_dict['bytes'] or
+                    resp.etag != segment_dict['hash']):
+                raise SloSegmentError(_(
+                    'Object segment no longer valid: '
+                    '%(path)s etag: %(r_etag)s != %(s_etag)s or '
+                    'size: %(r_size)s != %(s_size)s') %
+                    {'path': path, 'r_etag': resp.etag,
+                     's_etag': segment_dict['hash'],
+                     'r_size': resp.content_length,
+                     's_size': segment_dict['bytes']})
+        return resp
+
+    def _prefetch_segment(self, prefetch, segment_dict,
+                          logger_thread_locals):
+        """
+        Run in its own greenthread for each segment of the prefetch window:
+        opens the segment and buffers its first chunks for as long as the
+        bytes buffered by the whole window stay under segment_prefetch_bytes
+        and the segment has not been taken over by the iterator.
+
+        :returns: the swob.Response of the segment
+        """
+        app = self.controller.app
+        app.logger.thread_locals = logger_thread_locals
+        delay = prefetch.start - time.time()
+        if delay > 0:
+            sleep(delay)
+        # The segment may wait longer than client_timeout to be sent on,
+        # and its first chunks are all it buffers.
+        resp = self._get_segment(segment_dict, unbuffered=True)
+        try:
+            while not prefetch.claimed and \
+                    self.prefetch_bytes < app.segment_prefetch_bytes:
+                with ChunkReadTimeout(app.node_timeout):
+                    chunk = resp.app_iter.next()
+                prefetch.started = True
+                prefetch.chunks.append(chunk)
+                self.prefetch_bytes += len(chunk)
+        except StopIteration:
+            pass
+        except (Exception, Timeout):
+            self._close_segment(resp, prefetch.started)
+            raise
+        return resp
+
+    def _fill_prefetch_window(self):
+        """
+        Starts the GETs of the segments following the current one until
+        segment_prefetch of them are open or the listing runs out.
+        """
+        while len(self.prefetched) < self.controller.app.segment_prefetch:
+            try:
+                segment_dict = self.listing.next()
+            except StopIteration:
+                return
+            prefetch = SegmentPrefetch(segment_dict, self._schedule_get(
+                self.segment + len(self.prefetched) + 1))
+            prefetch.thread = spawn(
+                self._prefetch_segment, prefetch, segment_dict,
+                self.controller.app.logger.thread_locals)
+            self.prefetched.append(prefetch)
+
+    def _buffered_iter(self, prefetch, app_iter):
+        while prefetch.chunks:
+            chunk = prefetch.chunks.popleft()
+            self.prefetch_bytes -= len(chunk)
+            yield chunk
+        for chunk in app_iter:
+            yield chunk
+
+    def _close_segment(self, resp, started=True):
+        # See NOTE: swift_conn at top of file about this.
+        swift_conn = getattr(resp, 'swift_conn', None)
+        if swift_conn:
+            try:
+                swift_conn.close()
+            except Exception:
+                pass
+        if started:
+            try:
+                while resp.app_iter.next():
+                    pass
+            except Exception:
+                pass
+
+    def _close_prefetched(self):
+        """
+        Abandons the segments of the prefetch window, closing their
+        connections.
+        """
+        while self.prefetched:
+            prefetch = self.prefetched.popleft()
+            prefetch.claimed = True
+            if prefetch.start > time.time():
+                # still waiting on the rate limit; nothing is open yet
+                prefetch.thread.kill()
+                continue
+            try:
+                resp = prefetch.thread.wait()
+            except (Exception, Timeout):
+                continue
+            self._close_segment(resp, prefetch.started)
+        self.prefetch_bytes = 0
 
     def _load_next_segment(self):
         """
@@ -133,51 +324,26 @@ class SegmentedIterable(object):
         """
         try:
             self.segment += 1
-            self.segment_dict = self.segment_peek or self.listing.next()
-            self.segment_peek = None
-            if self.container is None:
-                container, obj = \
-                    self.segment_dict['name'].lstrip('/').split('/', 1)
+            if self.prefetched:
+                prefetch = self.prefetched.popleft()
+                prefetch.claimed = True
+                self.segment_dict = prefetch.segment_dict
+                resp = prefetch.thread.wait()
+                self._fill_prefetch_window()
+                self.segment_iter = self._buffered_iter(prefetch,
+                                                        resp.app_iter)
             else:
-                container, obj = self.container, self.segment_dict['name']
-            partition, nodes = self.controller.app.object_ring.get_nodes(
-                self.controller.account_name, container, obj)
-            path = '/%s/%s/%s' % (self.controller.account_name, container, obj)
-            req = Request.blank(path)
-            if self.seek:
-                req.range = 'bytes=%s-' % self.seek
+                self.segment_dict = self.segment_peek or self.listing.next()
+                self.segment_peek = None
+                if not self.is_slo and self.segment > \
+                        self.controller.app.rate_limit_after_segment:
+                    sleep(max(self.next_get_time - time.time(), 0))
+                self.next_get_time = time.time() + \
+                    1.0 / self.controller.app.rate_limit_segments_per_sec
+                self._fill_prefetch_window()
+                resp = self._get_segment(self.segment_dict, self.seek)
                 self.seek = 0
-            if not self.is_slo and self.segment > \
-                    self.controller.app.rate_limit_after_segment:
-                sleep(max(self.next_get_time - time.time(), 0))
-            self.next_get_time = time.time() + \
-                1.0 / self.controller.app.rate_limit_segments_per_sec
-            nodes = self.controller.app.sort_nodes(nodes)
-            resp = self.controller.GETorHEAD_base(
-                req, _('Object'), partition,
-                self.controller.iter_nodes(partition, nodes,
-                                           self.controller.app.object_ring),
-                path, len(nodes))
-            if self.is_slo and resp.status_int == HTTP_NOT_FOUND:
-                raise SloSegmentError(_(
-                    'Could not load object segment %(path)s:'
-                    ' %(status)s') % {'path': path, 'status': resp.status_int})
-            if not is_success(resp.status_int):
-                raise Exception(_(
-                    'Could not load object segment %(path)s:'
-                    ' %(status)s') % {'path': path, 'status': resp.status_int})
-            if self.is_slo:
-                if (resp.content_length != self.segment_dict['bytes'] or
-                        resp.etag != self.segment_dict['hash']):
-                    raise SloSegmentError(_(
-                        'Object segment no longer valid: '
-                        '%(path)s etag: %(r_etag)s != %(s_etag)s or '
-                        'size: %(r_size)s != %(s_size)s') %
-                        {'path': path, 'r_etag': resp.etag,
-                         's_etag': self.segment_dict['hash'],
-                         'r_size': resp.content_length,
-                         's_size': self.segment_dict['bytes']})
-            self.segment_iter = resp.app_iter
+                self.segment_iter = resp.app_iter
             # See NOTE: swift_conn at top of file about this.
             self.segment_iter_swift_conn = getattr(resp, 'swift_conn', None)
         except StopIteration:
@@ -236,6 +402,8 @@ class SegmentedIterable(object):
                 err.swift_logged = True
                 self.response.status_int = HTTP_SERVICE_UNAVAILABLE
             raise
+        finally:
+            self._close_prefetched()
 
     def app_iter_range(self, start, stop):
         """
@@ -282,6 +450,7 @@ class SegmentedIterable(object):
                 except Exception:
                     pass
                 self.segment_iter = None
+            self._close_prefetched()
         except StopIteration:
             raise
         except (Exception, Timeout), err:
@@ -313,16 +482,18 @@ class ObjectController(Controller):
             for item in page:
                 yield item
 
-    def _listing_pages_iter(self, lcontainer, lprefix, env):
+    def _listing_request(self, lcontainer, env):
+        lreq = Request.blank('i will be overridden by env', environ=env)
+        # Don't quote PATH_INFO, by WSGI spec
+        lreq.environ['PATH_INFO'] = '/%s/%s' % (self.account_name, lcontainer)
+        lreq.environ['REQUEST_METHOD'] = 'GET'
+        return lreq
+
+    def _listing_pages_iter(self, lcontainer, lprefix, env, marker=''):
         lpartition, lnodes = self.app.container_ring.get_nodes(
             self.account_name, lcontainer)
-        marker = ''
         while True:
-            lreq = Request.blank('i will be overridden by env', environ=env)
-            # Don't quote PATH_INFO, by WSGI spec
-            lreq.environ['PATH_INFO'] = \
-                '/%s/%s' % (self.account_name, lcontainer)
-            lreq.environ['REQUEST_METHOD'] = 'GET'
+            lreq = self._listing_request(lcontainer, env)
             lreq.environ['QUERY_STRING'] = \
                 'format=json&prefix=%s&marker=%s' % (quote(lprefix),
                                                      quote(marker))
@@ -347,6 +518,103 @@ class ObjectController(Controller):
             marker = sublisting[-1]['name'].encode('utf-8')
             yield sublisting
 
+    def _dlo_listing_cache(self, lcontainer, lprefix, env):
+        """
+        Looks up the memcache entry for the listing of a DLO's segments.
+
+        The cache key includes the segment container's put timestamp, object
+        count and bytes used, so that the cached listing is no longer used
+        once the container is recreated or segments are added or removed.
+        These are read with a HEAD of the container rather than from the
+        container info cache, which may be recheck_container_existence
+        seconds out of date.  A segment overwritten with one of the same
+        size still goes unnoticed until the cached listing expires.
+
+        :returns: a tuple of (cache_key, summary); cache_key is None if the
+                  listing cannot be cached and summary is None unless the
+                  whole listing is cached
+        :raises ListingIterNotAuthorized: if the cached listing may not be
+                                          read
+        """
+        if not self.app.memcache or not self.app.dlo_listing_cache_time:
+            return None, None
+        container_info = self.container_info(self.account_name, lcontainer,
+                                             cached=False)
+        if not is_success(container_info['status']) or \
+                not container_info.get('put_timestamp'):
+            return None, None
+        cache_key = 'dlo_listing/%s/%s/%s/%s/%s/%s' % (
+            self.account_name, lcontainer, container_info['put_timestamp'],
+            container_info.get('object_count'), container_info['bytes'],
+            lprefix)
+        summary = self.app.memcache.get(cache_key)
+        if not isinstance(summary, dict):
+            return cache_key, None
+        if 'swift.authorize' in env:
+            lreq = self._listing_request(lcontainer, env)
+            lreq.acl = container_info['read_acl']
+            aresp = env['swift.authorize'](lreq)
+            if aresp:
+                raise ListingIterNotAuthorized(aresp)
+        return cache_key, summary
+
+    def _cached_listing_pages_iter(self, lcontainer, lprefix, env,
+                                   cache_key, summary):
+        """
+        Like _listing_pages_iter, but reads the pages from memcache when
+        the whole listing is cached, and caches the pages fetched from the
+        container servers otherwise.  Once a listing has been walked to the
+        end, a summary of the segments is cached along with it.
+
+        :param cache_key: the key returned by _dlo_listing_cache
+        :param summary: the summary returned by _dlo_listing_cache
+        """
+        memcache = self.app.memcache
+        cache_time = self.app.dlo_listing_cache_time
+        index = 0
+        marker = ''
+        if summary:
+            while index < summary['pages']:
+                page = memcache.get('%s/%d' % (cache_key, index))
+                if not page:
+                    # evicted; fetch the rest from the container servers
+                    break
+                index += 1
+                marker = page[-1]['name'].encode('utf-8')
+                yield page
+            else:
+                return
+        count = 0
+        content_length = 0
+        last_modified = None
+        etag = md5()
+        # the pages read from memcache are not accounted for below
+        summarize = not index
+        for page in self._listing_pages_iter(lcontainer, lprefix, env,
+                                             marker):
+            for i in xrange(0, len(page), DLO_LISTING_CACHE_PAGE_SIZE):
+                memcache.set('%s/%d' % (cache_key, index),
+                             page[i:i + DLO_LISTING_CACHE_PAGE_SIZE],
+                             time=cache_time)
+                index += 1
+            if summarize:
+                try:
+                    for item in page:
+                        content_length += item['bytes']
+                        last_modified = max(last_modified,
+                                            item['last_modified'])
+                        etag.update(item['hash'])
+                except KeyError:
+                    summarize = False
+                count += len(page)
+            yield page
+        if summarize:
+            memcache.set(cache_key, {'pages': index, 'count': count,
+                                     'bytes': content_length,
+                                     'last_modified': last_modified,
+                                     'etag': etag.hexdigest()},
+                         time=cache_time)
+
     def _remaining_items(self, listing_iter):
         """
         Returns an item-by-item iterator for a page-by-page iterator
@@ -406,6 +674,7 @@ class ObjectController(Controller):
                 resp.content_type = content_type
 
         large_object = None
+        listing_summary = None
         if config_true_value(resp.headers.get('x-static-large-object')) and \
                 req.params.get('multipart-manifest') != 'get' and \
                 self.app.allow_static_large_object:
@@ -446,11 +715,24 @@ class ObjectController(Controller):
             lcontainer = unquote(lcontainer)
             lprefix = unquote(lprefix)
             try:
-                pages_iter = iter(self._listing_pages_iter(lcontainer, lprefix,
-                                                           req.environ))
-                listing_page1 = pages_iter.next()
-                listing = itertools.chain(listing_page1,
-                                          self._remaining_items(pages_iter))
+                cache_key, listing_summary = self._dlo_listing_cache(
+                    lcontainer, lprefix, req.environ)
+                if cache_key:
+                    pages_iter = self._cached_listing_pages_iter(
+                        lcontainer, lprefix, req.environ, cache_key,
+                        listing_summary)
+                else:
+                    pages_iter = iter(self._listing_pages_iter(
+                        lcontainer, lprefix, req.environ))
+                if listing_summary:
+                    # Nothing needs reading before the response starts;
+                    # the cached pages are loaded as the segments stream.
+                    listing_page1 = ()
+                    listing = self._remaining_items(pages_iter)
+                else:
+                    listing_page1 = pages_iter.next()
+                    listing = itertools.chain(
+                        listing_page1, self._remaining_items(pages_iter))
             except ListingIterNotFound:
                 return HTTPNotFound(request=req)
             except ListingIterNotAuthorized, err:
@@ -461,7 +743,11 @@ class ObjectController(Controller):
                 listing_page1 = listing = ()
 
         if large_object:
-            if len(listing_page1) >= CONTAINER_LISTING_LIMIT:
+            if listing_summary:
+                segment_count = listing_summary['count']
+            else:
+                segment_count = len(listing_page1)
+            if segment_count >= CONTAINER_LISTING_LIMIT:
                 resp = Response(headers=resp.headers, request=req,
                                 conditional_response=True)
                 if req.method == 'HEAD':
@@ -486,7 +772,16 @@ class ObjectController(Controller):
             else:
                 # For objects with a reasonable number of segments, we'll serve
                 # them with a set content-length and computed etag.
-                if listing:
+                if listing_summary:
+                    content_length = listing_summary['bytes']
+                    last_modified = listing_summary['last_modified']
+                    if last_modified:
+                        last_modified = datetime(*map(int, re.split(
+                            '[^\d]', last_modified)[:-1]))
+                    else:
+                        last_modified = resp.last_modified
+                    etag = listing_summary['etag']
+                elif listing:
                     listing = list(listing)
                     try:
                         content_length = sum(o['bytes'] for o in listing)
@@ -618,7 +913,10 @@ class ObjectController(Controller):
     def _backend_requests(self, req, n_outgoing,
                           container_partition, containers,
                           delete_at_partition=None, delete_at_nodes=None):
-        headers = [dict(req.headers.iteritems())
+        # X-Backend-* headers are only ever set by the proxy itself, after
+        # it has authorized what they ask the object servers to do.
+        headers = [dict((key, value) for key, value in req.headers.iteritems()
+                        if not key.lower().startswith('x-backend-'))
                    for _junk in range(n_outgoing)]
 
         for header in headers:
@@ -662,20 +960,50 @@ class ObjectController(Controller):
                                             _('Trying to write to %s') % path)
             conn.queue.task_done()
 
+    def _get_put_response(self, results, conn, path, logger_thread_locals):
+        """
+        Reads the final response of one object server to a PUT and puts a
+        tuple of (status, reason, body, etag) on the results queue, or None
+        if it could not be read.
+        """
+        self.app.logger.thread_locals = logger_thread_locals
+        result = None
+        try:
+            with Timeout(self.app.node_timeout):
+                if conn.resp:
+                    response = conn.resp
+                else:
+                    response = conn.getresponse()
+                body = response.read()
+                if not conn.resp:
+                    # a final response to Expect: 100-continue leaves
+                    # the connection unfit for another request
+                    self.release_conn(conn, response)
+                etag = None
+                if response.status >= HTTP_INTERNAL_SERVER_ERROR:
+                    self.error_occurred(
+                        conn.node,
+                        _('ERROR %(status)d %(body)s From Object Server '
+                          're: %(path)s') %
+                        {'status': response.status,
+                         'body': body[:1024], 'path': path})
+                elif is_success(response.status):
+                    etag = response.getheader('etag').strip('"')
+                result = (response.status, response.reason, body, etag)
+        except (Exception, Timeout):
+            self.exception_occurred(
+                conn.node, _('Object'),
+                _('Trying to get final status of PUT to %s') % path)
+        results.put(result)
+
     def _connect_put_node(self, nodes, part, path, headers,
                           logger_thread_locals):
         """Method for a file PUT connect"""
         self.app.logger.thread_locals = logger_thread_locals
         for node in nodes:
             try:
-                start_time = time.time()
-                with ConnectionTimeout(self.app.conn_timeout):
-                    conn = http_connect(
-                        node['ip'], node['port'], node['device'], part, 'PUT',
-                        path, headers)
-                self.app.set_node_timing(node, time.time() - start_time)
-                with Timeout(self.app.node_timeout):
-                    resp = conn.getexpect()
+                conn, resp = self.backend_response(node, part, 'PUT', path,
+                                                   headers, expect=True)
                 if resp.status == HTTP_CONTINUE:
                     conn.resp = None
                     conn.node = node
@@ -833,37 +1161,31 @@ class ObjectController(Controller):
             orig_container_name = self.container_name
             self.object_name = src_obj_name
             self.container_name = src_container_name
+            if self.app.backend_copy and \
+                    req.params.get('multipart-manifest') != 'get':
+                source_resp, new_req, resp = self._backend_copy(
+                    req, source_req, partition, nodes,
+                    content_type_manually_set, container_partition,
+                    containers, delete_at_part, delete_at_nodes)
+                if resp:
+                    self.object_name = orig_obj_name
+                    self.container_name = orig_container_name
+                    return self._put_response(resp, new_req, source_header,
+                                              source_resp)
             source_resp = self.GET(source_req)
             if source_resp.status_int >= HTTP_MULTIPLE_CHOICES:
                 return source_resp
             self.object_name = orig_obj_name
             self.container_name = orig_container_name
-            new_req = Request.blank(req.path_info,
-                                    environ=req.environ, headers=req.headers)
             data_source = source_resp.app_iter
-            new_req.content_length = source_resp.content_length
-            if new_req.content_length is None:
+            if source_resp.content_length is None:
                 # This indicates a transfer-encoding: chunked source object,
                 # which currently only happens because there are more than
                 # CONTAINER_LISTING_LIMIT segments in a segmented object. In
                 # this case, we're going to refuse to do the server-side copy.
                 return HTTPRequestEntityTooLarge(request=req)
-            new_req.etag = source_resp.etag
-            # we no longer need the X-Copy-From header
-            del new_req.headers['X-Copy-From']
-            if not content_type_manually_set:
-                new_req.headers['Content-Type'] = \
-                    source_resp.headers['Content-Type']
-            if not config_true_value(
-                    new_req.headers.get('x-fresh-metadata', 'false')):
-                copy_headers_into(source_resp, new_req)
-                copy_headers_into(req, new_req)
-            # copy over x-static-large-object for POSTs and manifest copies
-            if 'X-Static-Large-Object' in source_resp.headers and \
-                    req.params.get('multipart-manifest') == 'get':
-                new_req.headers['X-Static-Large-Object'] = \
-                    source_resp.headers['X-Static-Large-Object']
-
+            new_req = self._copy_request(req, source_resp,
+                                         content_type_manually_set)
             req = new_req
         node_iter = self.iter_nodes(partition, nodes, self.app.object_ring)
         pile = GreenPile(len(nodes))
@@ -905,11 +1227,12 @@ class ObjectController(Controller):
                     bytes_transferred += len(chunk)
                     if bytes_transferred > MAX_FILE_SIZE:
                         return HTTPRequestEntityTooLarge(request=req)
+                    if chunked:
+                        # framed once; every connection sends the same string
+                        chunk = '%x\r\n%s\r\n' % (len(chunk), chunk)
                     for conn in list(conns):
                         if not conn.failed:
-                            conn.queue.put(
-                                '%x\r\n%s\r\n' % (len(chunk), chunk)
-                                if chunked else chunk)
+                            conn.queue.put(chunk)
                         else:
                             conns.remove(conn)
                     if len(conns) <= len(nodes) / 2:
@@ -941,29 +1264,33 @@ class ObjectController(Controller):
         reasons = []
         bodies = []
         etags = set()
+        results = Queue()
         for conn in conns:
+            spawn_n(self._get_put_response, results, conn, req.path,
+                    self.app.logger.thread_locals)
+        pending = len(conns)
+        deadline = None
+        while pending:
             try:
-                with Timeout(self.app.node_timeout):
-                    if conn.resp:
-                        response = conn.resp
-                    else:
-                        response = conn.getresponse()
-                    statuses.append(response.status)
-                    reasons.append(response.reason)
-                    bodies.append(response.read())
-                    if response.status >= HTTP_INTERNAL_SERVER_ERROR:
-                        self.error_occurred(
-                            conn.node,
-                            _('ERROR %(status)d %(body)s From Object Server '
-                              're: %(path)s') %
-                            {'status': response.status,
-                             'body': bodies[-1][:1024], 'path': req.path})
-                    elif is_success(response.status):
-                        etags.add(response.getheader('etag').strip('"'))
-            except (Exception, Timeout):
-                self.exception_occurred(
-                    conn.node, _('Object'),
-                    _('Trying to get final status of PUT to %s') % req.path)
+                if deadline is None:
+                    result = results.get()
+                else:
+                    result = results.get(
+                        timeout=max(deadline - time.time(), 0))
+            except Empty:
+                # the stragglers are still read and logged in the background
+                break
+            pending -= 1
+            if not result:
+                continue
+            status, reason, body, etag = result
+            statuses.append(status)
+            reasons.append(reason)
+            bodies.append(body)
+            if etag:
+                etags.add(etag)
+            if deadline is None and self.have_quorum(statuses, len(nodes)):
+                deadline = time.time() + self.app.post_quorum_timeout
         if len(etags) > 1:
             self.app.logger.error(
                 _('Object servers returned %s mismatched etags'), len(etags))
@@ -975,6 +1302,18 @@ class ObjectController(Controller):
             bodies.append('')
         resp = self.best_response(req, statuses, reasons, bodies,
                                   _('Object PUT'), etag=etag)
+        return self._put_response(resp, req, source_header, source_resp)
+
+    def _put_response(self, resp, req, source_header=None, source_resp=None):
+        """
+        Finishes the response to an object PUT, with the X-Copied-From
+        headers of a copy.
+
+        :param resp: the swob.Response from the object servers' responses
+        :param req: the PUT request as sent to the object servers
+        :param source_header: the source of a copy, as /account/container/obj
+        :param source_resp: the response the source was read from
+        """
         if source_header:
             resp.headers['X-Copied-From'] = quote(
                 source_header.split('/', 2)[2])
@@ -985,6 +1324,138 @@ class ObjectController(Controller):
         resp.last_modified = float(req.headers['X-Timestamp'])
         return resp
 
+    def _copy_request(self, req, source_resp, content_type_manually_set):
+        """
+        Builds the request that writes the copy of an object for a COPY or
+        a PUT with X-Copy-From.
+
+        :param req: the client's request
+        :param source_resp: the GET or HEAD response of the source object
+        :param content_type_manually_set: whether the client set the
+                                          Content-Type of the copy
+        """
+        new_req = Request.blank(req.path_info,
+                                environ=req.environ, headers=req.headers)
+        new_req.content_length = source_resp.content_length
+        new_req.etag = source_resp.etag
+        # we no longer need the X-Copy-From header
+        del new_req.headers['X-Copy-From']
+        if not content_type_manually_set:
+            new_req.headers['Content-Type'] = \
+                source_resp.headers['Content-Type']
+        if not config_true_value(
+                new_req.headers.get('x-fresh-metadata', 'false')):
+            copy_headers_into(source_resp, new_req)
+            copy_headers_into(req, new_req)
+        # copy over x-static-large-object for POSTs and manifest copies
+        if 'X-Static-Large-Object' in source_resp.headers and \
+                req.params.get('multipart-manifest') == 'get':
+            new_req.headers['X-Static-Large-Object'] = \
+                source_resp.headers['X-Static-Large-Object']
+        return new_req
+
+    def _backend_copy(self, req, source_req, partition, nodes,
+                      content_type_manually_set, container_partition,
+                      containers, delete_at_part, delete_at_nodes):
+        """
+        Has the object servers duplicate the source of a COPY (or a PUT with
+        X-Copy-From) on their own disks, rather than streaming it through
+        the proxy.  That is only tried when the source lives on the same
+        devices as the destination and is not a large object manifest; the
+        object servers refuse with a 409 when they do not have the version
+        of the source found here, or the copy would change its key id.
+
+        self.container_name and self.object_name must name the source.
+
+        :returns: a tuple of (source HEAD response, request for the copy,
+                  swob.Response); the response is None if the copy has to go
+                  through the proxy
+        """
+        src_partition, src_nodes = self.app.object_ring.get_nodes(
+            self.account_name, self.container_name, self.object_name)
+        if set((n['ip'], n['port'], n['device']) for n in src_nodes) != \
+                set((n['ip'], n['port'], n['device']) for n in nodes):
+            return None, None, None
+        hreq = source_req.copy_get()
+        hreq.method = 'HEAD'
+        container_info = self.container_info(self.account_name,
+                                             self.container_name)
+        hreq.acl = container_info['read_acl']
+        if 'swift.authorize' in hreq.environ and \
+                hreq.environ['swift.authorize'](hreq):
+            return None, None, None
+        hresp = self.GETorHEAD_base(
+            hreq, _('Object'), src_partition,
+            self.iter_nodes(src_partition, src_nodes, self.app.object_ring),
+            hreq.path_info, len(src_nodes))
+        if not is_success(hresp.status_int) or \
+                'x-object-manifest' in hresp.headers or \
+                config_true_value(
+                    hresp.headers.get('x-static-large-object')) or \
+                hresp.content_length is None:
+            return None, None, None
+        new_req = self._copy_request(req, hresp, content_type_manually_set)
+        outgoing_headers = self._backend_requests(
+            new_req, len(nodes), container_partition, containers,
+            delete_at_part, delete_at_nodes)
+        pile = GreenPile(len(nodes))
+        for node, headers in zip(nodes, outgoing_headers):
+            headers['Content-Length'] = '0'
+            headers.pop('Transfer-Encoding', None)
+            headers['X-Backend-Copy-From'] = quote('%s/%s/%s' % (
+                src_partition, self.container_name, self.object_name))
+            headers['X-Backend-Copy-From-Timestamp'] = \
+                hresp.environ['swift_x_timestamp']
+            pile.spawn(self._backend_copy_node, node, partition,
+                       new_req.path_info, headers,
+                       self.app.logger.thread_locals)
+        statuses = []
+        reasons = []
+        bodies = []
+        etags = set()
+        for result in pile:
+            if result and is_success(result[0]):
+                status, reason, body, etag = result
+                statuses.append(status)
+                reasons.append(reason)
+                bodies.append(body)
+                etags.add(etag)
+        if len(statuses) <= len(nodes) / 2 or len(etags) > 1:
+            return hresp, new_req, None
+        self.app.logger.increment('backend_copies')
+        return hresp, new_req, self.best_response(
+            new_req, statuses, reasons, bodies, _('Object PUT'),
+            etag=etags.pop())
+
+    def _backend_copy_node(self, node, part, path, headers,
+                           logger_thread_locals):
+        """
+        Sends the PUT of a backend copy to one object server.
+
+        :returns: a tuple of (status, reason, body, etag), or None if the
+                  request failed
+        """
+        self.app.logger.thread_locals = logger_thread_locals
+        if self.error_limited(node):
+            return None
+        try:
+            conn, resp = self.backend_response(node, part, 'PUT', path,
+                                               headers)
+            with Timeout(self.app.node_timeout):
+                body = resp.read()
+            self.release_conn(conn, resp)
+            if resp.status >= HTTP_INTERNAL_SERVER_ERROR:
+                self.error_occurred(
+                    node, _('ERROR %(status)d %(body)s From Object Server '
+                            're: %(path)s') %
+                    {'status': resp.status, 'body': body[:1024],
+                     'path': path})
+            return (resp.status, resp.reason, body,
+                    (resp.getheader('etag') or '').strip('"'))
+        except (Exception, Timeout):
+            self.exception_occurred(
+                node, _('Object'), _('Trying to copy to %s') % path)
+
     @public
     @cors_validation
     @delay_denial
@@ -26,16 +26,20 @@
 
 import mimetypes
 import os
+from collections import deque
 from ConfigParser import ConfigParser
 import uuid
-from random import shuffle
+from itertools import islice
+from random import shuffle, uniform
 from time import time
 
-from eventlet import Timeout
+from eventlet import sleep, spawn, Timeout
 
+from swift.common.bufferedhttp import BufferedHTTPConnectionPool
 from swift.common.ring import Ring
 from swift.common.utils import cache_from_env, get_logger, \
-    get_remote_client, split_path, config_true_value
+    get_remote_client, split_path, config_true_value, dump_recon_cache, \
+    LRUCache
 from swift.common.constraints import check_utf8
 from swift.proxy.controllers import AccountController, ObjectController, \
     ContainerController
@@ -44,6 +48,14 @@ from swift.common.swob import HTTPBadRequest, HTTPForbidden, \
     HTTPServerError, Request
 
 
+# number of recent backend GET/HEAD response times hedge_delay() looks at,
+# and how many it needs before it hedges at all
+HEDGE_SAMPLES = 1000
+HEDGE_MIN_SAMPLES = 20
+# how often the node scores are written to the recon cache, in seconds
+NODE_SCORES_DUMP_INTERVAL = 30
+
+
 class Application(object):
     """WSGI application for the proxy server."""
 
@@ -61,14 +73,18 @@ class Application(object):
         self.conn_timeout = float(conf.get('conn_timeout', 0.5))
         self.client_timeout = int(conf.get('client_timeout', 60))
         self.put_queue_depth = int(conf.get('put_queue_depth', 10))
+        self.post_quorum_timeout = float(conf.get('post_quorum_timeout', 0.5))
         self.object_chunk_size = int(conf.get('object_chunk_size', 65536))
         self.client_chunk_size = int(conf.get('client_chunk_size', 65536))
+        self.read_ahead_bytes = int(conf.get('read_ahead_bytes', 1048576))
         self.error_suppression_interval = \
             int(conf.get('error_suppression_interval', 60))
         self.error_suppression_limit = \
             int(conf.get('error_suppression_limit', 10))
         self.recheck_container_existence = \
             int(conf.get('recheck_container_existence', 60))
+        self.dlo_listing_cache_time = \
+            int(conf.get('dlo_listing_cache_time', 0))
         self.recheck_account_existence = \
             int(conf.get('recheck_account_existence', 60))
         self.allow_account_management = \
@@ -83,6 +99,12 @@ class Application(object):
         self.account_ring = account_ring or Ring(swift_dir,
                                                  ring_name='account')
         self.memcache = memcache
+        info_cache_size = int(conf.get('info_cache_size', 0))
+        if info_cache_size > 0:
+            self.info_cache = LRUCache(
+                info_cache_size, float(conf.get('info_cache_time', 2)))
+        else:
+            self.info_cache = None
         mimetypes.init(mimetypes.knownfiles +
                        [os.path.join(swift_dir, 'mime.types')])
         self.account_autocreate = \
@@ -105,16 +127,37 @@ class Application(object):
             int(conf.get('rate_limit_after_segment', 10))
         self.rate_limit_segments_per_sec = \
             int(conf.get('rate_limit_segments_per_sec', 1))
+        self.segment_prefetch = int(conf.get('segment_prefetch', 0))
+        self.segment_prefetch_bytes = \
+            int(conf.get('segment_prefetch_bytes', 8388608))
         self.log_handoffs = config_true_value(conf.get('log_handoffs', 'true'))
         self.cors_allow_origin = [
             a.strip()
             for a in conf.get('cors_allow_origin', '').split(',')
             if a.strip()]
         self.node_timings = {}
+        self.hedged_get_percentile = float(
+            conf.get('hedged_get_percentile', 0))
+        self.get_latencies = deque(maxlen=HEDGE_SAMPLES)
         self.timing_expiry = int(conf.get('timing_expiry', 300))
         self.sorting_method = conf.get('sorting_method', 'shuffle').lower()
+        self.node_scores = {}
+        self.node_score_decay = float(conf.get('node_score_decay', 0.3))
+        self.node_score_jitter = float(conf.get('node_score_jitter', 0.1))
+        self.rcache = os.path.join(
+            conf.get('recon_cache_path', '/var/cache/swift'), 'proxy.recon')
+        self.node_scores_dumper = None
         self.allow_static_large_object = config_true_value(
             conf.get('allow_static_large_object', 'true'))
+        self.backend_copy = config_true_value(
+            conf.get('backend_copy', 'false'))
+        if config_true_value(conf.get('backend_keepalive', 'false')):
+            self.conn_pool = BufferedHTTPConnectionPool(
+                max_idle_per_node=int(
+                    conf.get('backend_max_idle_per_node', 8)),
+                idle_timeout=float(conf.get('backend_idle_timeout', 30)))
+        else:
+            self.conn_pool = None
 
     def get_controller(self, path):
         """
@@ -267,8 +310,121 @@ class Application(object):
                 timing, expires = self.node_timings.get(node['ip'], (-1.0, 0))
                 return timing if expires > now else -1.0
             nodes.sort(key=key_func)
+        elif self.sorting_method == 'score':
+            now = time()
+            nodes.sort(key=lambda node: self.node_score(node, now) * uniform(
+                1 - self.node_score_jitter, 1 + self.node_score_jitter))
         return nodes
 
+    def sort_handoffs(self, handoffs, batch_size):
+        """
+        Sorts handoff nodes with :meth:`sort_nodes`, batch_size at a time, so
+        that the generator of handoffs from the ring is not exhausted.
+
+        :param handoffs: iterator of handoff nodes
+        :param batch_size: number of handoffs sorted together
+        """
+        while True:
+            batch = list(islice(handoffs, max(batch_size, 1)))
+            if not batch:
+                return
+            for node in self.sort_nodes(batch):
+                yield node
+
+    def node_score(self, node, now=None):
+        """
+        Expected seconds to get an answer from a node's device: the moving
+        average of its first-byte latency, with the error rate's share of
+        requests costing node_timeout instead.  Devices nothing has been
+        heard from in timing_expiry seconds score 0, so they are tried again.
+
+        :param node: dictionary of the node
+        :param now: current time, defaults to time()
+        """
+        if now is None:
+            now = time()
+        latency, error_rate, updated = self.node_scores.get(
+            (node['ip'], node.get('device')), (0.0, 0.0, 0))
+        if updated + self.timing_expiry < now:
+            return 0.0
+        return (1 - error_rate) * latency + error_rate * self.node_timeout
+
+    def _update_node_score(self, node, latency, error):
+        key = (node['ip'], node.get('device'))
+        now = time()
+        decay = self.node_score_decay
+        old_latency, error_rate, updated = self.node_scores.get(
+            key, (None, 0.0, 0))
+        if latency is None:
+            latency = old_latency or 0.0
+        elif old_latency is not None and updated + self.timing_expiry >= now:
+            latency = decay * latency + (1 - decay) * old_latency
+        error_rate = decay * error + (1 - decay) * error_rate
+        self.node_scores[key] = (latency, error_rate, now)
+        if self.node_scores_dumper is None:
+            self.node_scores_dumper = spawn(self.dump_node_scores_forever)
+
+    def record_node_latency(self, node, latency):
+        """
+        Record how long a node took to send the headers of a response.
+
+        :param node: dictionary of the node
+        :param latency: seconds from connecting to the response headers
+        """
+        if self.sorting_method == 'score':
+            self._update_node_score(node, latency, 0)
+
+    def record_node_error(self, node):
+        """
+        Record that a request to a node failed or timed out.
+
+        :param node: dictionary of the node
+        """
+        if self.sorting_method == 'score':
+            self._update_node_score(node, None, 1)
+
+    def dump_node_scores_forever(self):
+        """
+        Write this worker's node scores to the recon cache every
+        NODE_SCORES_DUMP_INTERVAL seconds, away from the request path.
+        """
+        while True:
+            sleep(NODE_SCORES_DUMP_INTERVAL)
+            self.dump_node_scores()
+
+    def dump_node_scores(self, now=None):
+        """
+        Write the current node scores to the recon cache, for
+        /recon/node_scores.  Each worker only knows the scores of the
+        requests it made, so they are written under a key of their own;
+        recon merges them.
+        """
+        if now is None:
+            now = time()
+        scores = {}
+        for (ip, device), (latency, error_rate, updated) in \
+                self.node_scores.items():
+            if updated + self.timing_expiry >= now:
+                scores['%s/%s' % (ip, device)] = {
+                    'latency': latency, 'error_rate': error_rate,
+                    'score': self.node_score({'ip': ip, 'device': device},
+                                             now),
+                    'updated': updated}
+        dump_recon_cache({'proxy_node_scores_%d' % os.getpid(): scores},
+                         self.rcache, self.logger)
+
+    def hedge_delay(self):
+        """
+        Seconds to wait for a backend GET or HEAD response before asking
+        another node as well: the hedged_get_percentile percentile of the
+        recent response times, or None until enough of them have been seen.
+        """
+        if len(self.get_latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        latencies = sorted(self.get_latencies)
+        index = int(len(latencies) * self.hedged_get_percentile / 100)
+        return latencies[min(index, len(latencies) - 1)]
+
     def set_node_timing(self, node, timing):
         if self.sorting_method != 'timing':
             return
@@ -76,9 +76,14 @@ def _getxattr(fd, k):
         raise IOError
     return data
 
+
+def _listxattr(fd):
+    return xattr_data.get(_get_inode(fd), {}).keys()
+
 import xattr
 xattr.setxattr = _setxattr
 xattr.getxattr = _getxattr
+xattr.listxattr = _listxattr
 
 
 @contextmanager
@@ -347,6 +347,34 @@ class TestAccountController(unittest.TestCase):
         resp = self.controller.GET(req)
         self.assertEquals(resp.status_int, 412)
 
+    def test_GET_streams_long_listings(self):
+        req = Request.blank('/sda1/p/a', environ={'REQUEST_METHOD': 'PUT',
+            'HTTP_X_TIMESTAMP': '0'})
+        self.controller.PUT(req)
+        for i in xrange(150):
+            req = Request.blank(
+                '/sda1/p/a/c%03d' % i, environ={'REQUEST_METHOD': 'PUT'},
+                headers={'X-Put-Timestamp': '1', 'X-Delete-Timestamp': '0',
+                         'X-Object-Count': str(i), 'X-Bytes-Used': '0',
+                         'X-Timestamp': normalize_timestamp(0)})
+            self.controller.PUT(req)
+        req = Request.blank('/sda1/p/a?format=json',
+                            environ={'REQUEST_METHOD': 'GET'})
+        resp = self.controller.GET(req)
+        self.assertEquals(resp.status_int, 200)
+        self.assertEquals(resp.content_length, None)
+        chunks = list(resp.app_iter)
+        self.assertEquals(len(chunks), 2)
+        self.assertEquals(simplejson.loads(''.join(chunks)),
+                          [{'name': 'c%03d' % i, 'count': i, 'bytes': 0}
+                           for i in xrange(150)])
+        req = Request.blank('/sda1/p/a?format=xml&limit=100',
+                            environ={'REQUEST_METHOD': 'GET'})
+        resp = self.controller.GET(req)
+        self.assertEquals(resp.content_length, len(resp.body))
+        dom = xml.dom.minidom.parseString(resp.body)
+        self.assertEquals(len(dom.getElementsByTagName('container')), 100)
+
     def test_GET_with_containers_plain(self):
         req = Request.blank('/sda1/p/a', environ={'REQUEST_METHOD': 'PUT',
             'HTTP_X_TIMESTAMP': '0'})
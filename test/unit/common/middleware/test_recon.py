@@ -21,6 +21,7 @@ import os
 
 import swift.common.constraints
 from swift.common.swob import Request
+from swift.common.utils import json
 from swift.common.middleware import recon
 
 
@@ -161,6 +162,9 @@ class FakeRecon(object):
     def fake_sockstat(self):
         return {'sockstattest': "1"}
 
+    def fake_node_scores(self):
+        return {'nodescorestest': "1"}
+
     def nocontent(self):
         return None
 
@@ -379,6 +383,27 @@ class TestReconSuccess(TestCase):
         rv = self.app.get_async_info()
         self.assertEquals(rv, {'async_pending': 5})
 
+    def test_get_node_scores(self):
+        sda_old = {'latency': 0.02, 'error_rate': 0.0, 'score': 0.02,
+                   'updated': 100.0}
+        sda_new = {'latency': 0.01, 'error_rate': 0.0, 'score': 0.01,
+                   'updated': 200.0}
+        sdb = {'latency': 0.5, 'error_rate': 0.5, 'score': 1.75,
+               'updated': 150.0}
+        recondata = {'proxy_node_scores_101': {'10.0.0.1/sda': sda_old,
+                                               '10.0.0.1/sdb': sdb},
+                     'proxy_node_scores_102': {'10.0.0.1/sda': sda_new},
+                     'async_pending': 5}
+        oart = OpenAndReadTester([json.dumps(recondata)])
+        rv = self.app.get_node_scores(openr=oart.open)
+        self.assertEquals(oart.open_calls,
+                          [(('/var/cache/swift/proxy.recon', 'r'), {})])
+        self.assertEquals(rv, {'proxy_node_scores': {
+            '10.0.0.1/sda': sda_new, '10.0.0.1/sdb': sdb}})
+        self.assertEquals(
+            self.app.get_node_scores(openr=self.frecon.raise_IOError),
+            {'proxy_node_scores': None})
+
     def test_get_replication_info_account(self):
         from_cache_response = {"replication_stats": {
                                     "attempted": 1, "diff": 0,
@@ -444,7 +469,8 @@ class TestReconSuccess(TestCase):
         rv = self.app.get_replication_info('object')
         self.assertEquals(self.fakecache.fakeout_calls,
                             [((['object_replication_time',
-                                'object_replication_last'],
+                                'object_replication_last',
+                                'object_replication_queue'],
                                 '/var/cache/swift/object.recon'), {})])
         self.assertEquals(rv, {'object_replication_time': 200.0,
                                'object_replication_last': 1357962809.15})
@@ -651,6 +677,7 @@ class TestReconMiddleware(unittest.TestCase):
         self.app.get_ring_md5 = self.frecon.fake_ringmd5
         self.app.get_quarantine_count = self.frecon.fake_quarantined
         self.app.get_socket_info = self.frecon.fake_sockstat
+        self.app.get_node_scores = self.frecon.fake_node_scores
 
     def test_recon_get_mem(self):
         get_mem_resp = ['{"memtest": "1"}']
@@ -664,6 +691,13 @@ class TestReconMiddleware(unittest.TestCase):
         resp = self.app(req.environ, start_response)
         self.assertEquals(resp, get_load_resp)
 
+    def test_recon_get_node_scores(self):
+        get_node_scores_resp = ['{"nodescorestest": "1"}']
+        req = Request.blank('/recon/node_scores',
+                            environ={'REQUEST_METHOD': 'GET'})
+        resp = self.app(req.environ, start_response)
+        self.assertEquals(resp, get_node_scores_resp)
+
     def test_recon_get_async(self):
         get_async_resp = ['{"asynctest": "1"}']
         req = Request.blank('/recon/async', environ={'REQUEST_METHOD': 'GET'})
@@ -68,6 +68,87 @@ class TestBufferedHTTP(unittest.TestCase):
                 if err:
                     raise Exception(err)
 
+    def test_http_connect_pooled(self):
+        bindsock = listen(('127.0.0.1', 0))
+        port = bindsock.getsockname()[1]
+
+        def accept():
+            try:
+                with Timeout(3):
+                    sock, addr = bindsock.accept()
+                    fp = sock.makefile()
+                    for body in ('ONE', 'TWO'):
+                        self.assertEquals(fp.readline(),
+                                          'GET /dev/1/path HTTP/1.1\r\n')
+                        while fp.readline() != '\r\n':
+                            pass
+                        fp.write('HTTP/1.1 200 OK\r\nContent-Length: 3'
+                                 '\r\n\r\n%s' % body)
+                        fp.flush()
+            except BaseException, err:
+                return err
+            return None
+        event = spawn(accept)
+        pool = bufferedhttp.BufferedHTTPConnectionPool()
+        try:
+            with Timeout(3):
+                for body, reused in (('ONE', False), ('TWO', True)):
+                    conn = bufferedhttp.http_connect_pooled(
+                        pool, '127.0.0.1', port, 'dev', 1, 'GET', '/path')
+                    self.assertEquals(conn.reused, reused)
+                    resp = conn.getresponse()
+                    self.assertEquals(resp.read(), body)
+                    pool.put(conn)
+        finally:
+            pool.close()
+            err = event.wait()
+            if err:
+                raise Exception(err)
+
+    def test_pool_limits(self):
+        pool = bufferedhttp.BufferedHTTPConnectionPool(max_idle_per_node=1,
+                                                       idle_timeout=10)
+        conns = [pool.get('127.0.0.1', 6000) for _junk in xrange(2)]
+        for conn in conns:
+            conn.sock = 'fake'
+            conn.close = lambda conn=conn: setattr(conn, 'sock', None)
+            pool.put(conn)
+        # only one is kept
+        self.assertEquals(conns[1].sock, None)
+        self.assertTrue(pool.get('127.0.0.1', '6000') is conns[0])
+        self.assertFalse(pool.get('127.0.0.1', 6000) is conns[0])
+        # closed connections are not kept
+        pool.put(conns[1])
+        self.assertFalse(pool.get('127.0.0.1', 6000) is conns[1])
+        # nor idle ones past idle_timeout
+        pool.put(conns[0])
+        pool._idle[('127.0.0.1', 6000)][0] = (conns[0], 0)
+        self.assertFalse(pool.get('127.0.0.1', 6000) is conns[0])
+        self.assertEquals(conns[0].sock, None)
+
+    def test_pool_evict_and_purge(self):
+        pool = bufferedhttp.BufferedHTTPConnectionPool(max_idle_per_node=2,
+                                                       idle_timeout=10)
+        conns = [pool.get('127.0.0.1', port)
+                 for port in (6000, 6000, 6001)]
+        for conn in conns:
+            conn.sock = 'fake'
+            conn.close = lambda conn=conn: setattr(conn, 'sock', None)
+            pool.put(conn)
+        pool._idle[('127.0.0.1', 6000)][0] = (conns[0], 0)
+        pool.evict_idle()
+        self.assertEquals(conns[0].sock, None)
+        self.assertTrue(pool.get('127.0.0.1', 6000) is conns[1])
+        # put() sweeps every idle_timeout seconds
+        pool._idle[('127.0.0.1', 6001)][0] = (conns[2], 0)
+        pool._last_eviction = 0
+        pool.put(conns[1])
+        self.assertEquals(conns[2].sock, None)
+        self.assertFalse(('127.0.0.1', 6001) in pool._idle)
+        pool.purge('127.0.0.1', '6000')
+        self.assertEquals(conns[1].sock, None)
+        self.assertEquals(pool._idle, {})
+
     def test_nonstr_header_values(self):
 
         class MockHTTPSConnection(object):
@@ -21,17 +21,22 @@ import os
 import unittest
 from shutil import rmtree, copy
 from StringIO import StringIO
+from tempfile import mkdtemp
 from time import sleep, time
 from uuid import uuid4
 
+import cPickle as pickle
+import eventlet
 import simplejson
 import sqlite3
 
 import swift.common.db
 from swift.common.db import AccountBroker, chexor, ContainerBroker, \
-    DatabaseBroker, DatabaseConnectionError, dict_factory, get_db_connection
-from swift.common.utils import normalize_timestamp
+    DatabaseBroker, DatabaseConnectionError, dict_factory, get_db_connection, \
+    iter_pending_entries, pending_entry, PendingFlusher, StatCache
+from swift.common.utils import normalize_timestamp, lock_parent_directory
 from swift.common.exceptions import LockTimeout
+from test.unit import FakeLogger
 
 
 class TestDatabaseConnectionError(unittest.TestCase):
@@ -79,6 +84,207 @@ class TestChexor(unittest.TestCase):
             'd41d8cd98f00b204e9800998ecf8427e', None, normalize_timestamp(1))
 
 
+class TestIterPendingEntries(unittest.TestCase):
+
+    def setUp(self):
+        self.orig_framed = swift.common.db.PENDING_FRAMED
+        swift.common.db.PENDING_FRAMED = True
+
+    def tearDown(self):
+        swift.common.db.PENDING_FRAMED = self.orig_framed
+
+    def test_pending_entry(self):
+        self.assertEquals(pending_entry('abc')[:4], '\x00\xffSP')
+        swift.common.db.PENDING_FRAMED = False
+        self.assertEquals(pending_entry('abc'), ':YWJj\n')
+
+    def test_framed_entries(self):
+        entries = ['x' * size for size in (0, 1, 10, 100)]
+        data = ''.join(pending_entry(e) for e in entries)
+        for chunk_size in (1, 3, 7, 65536):
+            self.assertEquals(
+                list(iter_pending_entries(StringIO(data), chunk_size)),
+                entries)
+
+    def test_legacy_entries(self):
+        entries = ['first', 'second' * 50, 'third']
+        data = ''.join(':' + e.encode('base64') for e in entries)
+        for chunk_size in (1, 5, 65536):
+            self.assertEquals(
+                list(iter_pending_entries(StringIO(data), chunk_size)),
+                entries)
+
+    def test_legacy_then_framed_entries(self):
+        data = ':' + 'old'.encode('base64') + ':' + \
+            'older'.encode('base64') + pending_entry('new') + \
+            pending_entry('')
+        for chunk_size in (1, 4, 65536):
+            self.assertEquals(
+                list(iter_pending_entries(StringIO(data), chunk_size)),
+                ['old', 'older', 'new', ''])
+
+    def test_truncated_entry(self):
+        data = pending_entry('abc') + pending_entry('defgh')[:-2]
+        skipped = []
+        self.assertEquals(list(iter_pending_entries(StringIO(data), 2,
+                                                    skipped.append)),
+                          ['abc'])
+        self.assertEquals(skipped, [len(pending_entry('defgh')) - 2])
+        data = pending_entry('abc') + '\x00\x00'
+        self.assertEquals(list(iter_pending_entries(StringIO(data))),
+                          ['abc'])
+
+    def test_torn_entry_is_skipped(self):
+        # an append cut short by a crash, then more appends after it
+        torn = pending_entry('defgh' * 20)[:30]
+        data = pending_entry('abc') + torn + pending_entry('ijk') + \
+            ':' + 'old'.encode('base64') + pending_entry('lmn')
+        for chunk_size in (1, 5, 65536):
+            skipped = []
+            self.assertEquals(
+                list(iter_pending_entries(StringIO(data), chunk_size,
+                                          skipped.append)),
+                ['abc', 'ijk', 'old', 'lmn'])
+            self.assertEquals(skipped, [30])
+
+    def test_bad_checksum_is_skipped(self):
+        bad = pending_entry('abc')[:-1] + 'x'
+        data = bad + pending_entry('def') + 'junk' + pending_entry('ghi')
+        for chunk_size in (1, 65536):
+            skipped = []
+            self.assertEquals(
+                list(iter_pending_entries(StringIO(data), chunk_size,
+                                          skipped.append)),
+                ['def', 'ghi'])
+            self.assertEquals(skipped, [len(bad) + 4])
+
+
+class TestPendingFlusher(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = mkdtemp()
+        self.broker = ContainerBroker(os.path.join(self.testdir, 'c.db'),
+                                      account='a', container='c',
+                                      defer_pending=True)
+        self.broker.initialize(normalize_timestamp('1'))
+
+    def tearDown(self):
+        rmtree(self.testdir)
+
+    def test_deferred_reads(self):
+        self.broker.put_object('o', normalize_timestamp(2), 3, 'text/plain',
+                               'etag')
+        self.assertEquals(self.broker.get_info()['object_count'], 0)
+        self.assertEquals(self.broker.list_objects_iter(10, '', '', '', ''),
+                          [])
+        # the operations that need the pending updates still merge them
+        self.assertFalse(self.broker.empty())
+        self.assertEquals(self.broker.get_info()['object_count'], 1)
+
+    def test_flush(self):
+        flusher = PendingFlusher(60, 65536, None)
+        self.broker.put_object('o', normalize_timestamp(2), 3, 'text/plain',
+                               'etag')
+        flusher.add(self.broker)
+        flusher.add(self.broker)
+        self.assertEquals(flusher.dirty.keys(), [self.broker.pending_file])
+        self.assertFalse(flusher.wakeup.ready())
+        flusher.flush()
+        self.assertEquals(flusher.dirty, {})
+        self.assertEquals(self.broker.get_info()['object_count'], 1)
+        # a busy lock leaves the file for the next flush
+        self.broker.pending_timeout = 0.01
+        self.broker.put_object('p', normalize_timestamp(3), 3, 'text/plain',
+                               'etag')
+        flusher.add(self.broker)
+        with lock_parent_directory(self.broker.pending_file):
+            flusher.flush()
+        self.assertEquals(flusher.dirty.keys(), [self.broker.pending_file])
+        flusher.thread.kill()
+
+    def test_watermark(self):
+        flusher = PendingFlusher(60, 100, None)
+        for i in xrange(5):
+            self.broker.put_object('o%d' % i, normalize_timestamp(2), 3,
+                                   'text/plain', 'etag')
+            flusher.add(self.broker)
+        self.assertTrue(flusher.wakeup.ready())
+        eventlet.sleep()
+        self.assertFalse(flusher.wakeup.ready())
+        self.assertEquals(flusher.dirty, {})
+        self.assertEquals(self.broker.get_info()['object_count'], 5)
+        flusher.thread.kill()
+
+
+class TestStatCache(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = mkdtemp()
+        self.db_file = os.path.join(self.testdir, 'c.db')
+        broker = ContainerBroker(self.db_file, account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+
+    def tearDown(self):
+        rmtree(self.testdir)
+
+    def _broker(self, **kwargs):
+        broker = ContainerBroker(self.db_file, account='a', container='c',
+                                 **kwargs)
+        reads = []
+        orig_get_info = broker.get_info
+
+        def get_info():
+            reads.append(1)
+            return orig_get_info()
+
+        broker.get_info = get_info
+        return broker, reads
+
+    def test_get(self):
+        cache = StatCache(10, 60)
+        broker, reads = self._broker()
+        deleted, info, metadata = cache.get(broker)
+        self.assertFalse(deleted)
+        self.assertEquals(info['object_count'], 0)
+        self.assertEquals(metadata, {})
+        broker, reads = self._broker()
+        self.assertEquals(cache.get(broker), (deleted, info, metadata))
+        self.assertEquals(reads, [])
+        # writes to the database show in its mtime and size
+        broker.update_metadata({'X-Container-Meta-Test': ('v', '2')})
+        os.utime(self.db_file, (1, 1))
+        deleted, info, metadata = cache.get(broker)
+        self.assertEquals(reads, [1])
+        self.assertEquals(metadata, {'X-Container-Meta-Test': ['v', '2']})
+        cache.invalidate(broker)
+        cache.get(broker)
+        self.assertEquals(reads, [1, 1])
+
+    def test_pending_updates(self):
+        cache = StatCache(10, 60)
+        broker, reads = self._broker()
+        cache.get(broker)
+        broker.put_object('o', normalize_timestamp(2), 3, 'text/plain', 'e')
+        # merging the pending update changes the stamp: not cached
+        self.assertEquals(cache.get(broker)[1]['object_count'], 1)
+        self.assertEquals(cache.get(broker)[1]['object_count'], 1)
+        self.assertEquals(cache.get(broker)[1]['object_count'], 1)
+        self.assertEquals(reads, [1, 1, 1])
+        # deferred pending updates are not read, so they do not count
+        broker, reads = self._broker(defer_pending=True)
+        cache.get(broker)
+        broker.put_object('p', normalize_timestamp(3), 3, 'text/plain', 'e')
+        self.assertEquals(cache.get(broker)[1]['object_count'], 1)
+        self.assertEquals(reads, [1])
+
+    def test_deleted(self):
+        cache = StatCache(10, 60)
+        broker = ContainerBroker(os.path.join(self.testdir, 'x.db'),
+                                 account='a', container='x')
+        self.assertEquals(cache.get(broker), (True, None, None))
+        self.assertEquals(len(cache.entries.entries), 0)
+
+
 class TestGetDBConnection(unittest.TestCase):
 
     def test_normal_case(self):
@@ -1191,6 +1397,54 @@ class TestContainerBroker(unittest.TestCase):
         self.assertEquals([row[0] for row in listing],
                           ['/pets/fish/a', '/pets/fish/b'])
 
+    def test_list_objects_iter_skip_scan(self):
+        """ Test swift.common.db.ContainerBroker.list_objects_iter reading
+            through small subdirectories instead of seeking past them """
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        for i in xrange(20):
+            for j in xrange(i % 5 * 4):
+                broker.put_object('d%02d/%02d' % (i, j),
+                                  normalize_timestamp(0), 0, 'text/plain',
+                                  'd41d8cd98f00b204e9800998ecf8427e')
+            broker.put_object('d%02d' % i, normalize_timestamp(0), 0,
+                              'text/plain', 'd41d8cd98f00b204e9800998ecf8427e')
+            broker.put_object('d%02dx' % i, normalize_timestamp(0), 0,
+                              'text/plain', 'd41d8cd98f00b204e9800998ecf8427e')
+        queries = []
+        orig_execute = swift.common.db.GreenDBConnection.execute
+
+        def execute(conn, *args, **kwargs):
+            queries.append(args[0])
+            return orig_execute(conn, *args, **kwargs)
+
+        orig_scan_rows = swift.common.db.DELIMITER_SCAN_ROWS
+        listings = {}
+        try:
+            swift.common.db.GreenDBConnection.execute = execute
+            for scan_rows in (1, 16):
+                swift.common.db.DELIMITER_SCAN_ROWS = scan_rows
+                del queries[:]
+                listings[scan_rows] = (
+                    broker.list_objects_iter(1000, '', '', '', '/'),
+                    broker.list_objects_iter(7, 'd03/', '', 'd', '/'),
+                    broker.list_objects_iter(1000, '', '', None, None, ''),
+                    len(queries))
+        finally:
+            swift.common.db.GreenDBConnection.execute = orig_execute
+            swift.common.db.DELIMITER_SCAN_ROWS = orig_scan_rows
+        self.assertEquals(listings[1][:3], listings[16][:3])
+        self.assertEquals(len(listings[1][0]), 20 + 20 + 16)
+        self.assertEquals([row[0] for row in listings[1][1]],
+                          ['d03x', 'd04', 'd04/', 'd04x', 'd05', 'd05x',
+                           'd06'])
+        self.assertEquals([row[0] for row in listings[1][2]],
+                          ['d%02d%s' % (i, s) for i in xrange(20)
+                           for s in ('', 'x')])
+        # one query per subdirectory, against one per subdirectory with
+        # more than DELIMITER_SCAN_ROWS rows
+        self.assertTrue(listings[16][3] < listings[1][3] / 2)
+
     def test_double_check_trailing_delimiter(self):
         """ Test swift.common.db.ContainerBroker.list_objects_iter for a
             container that has an odd file with a trailing delimiter """
@@ -1283,6 +1537,92 @@ class TestContainerBroker(unittest.TestCase):
         broker2.merge_syncs(broker1.get_syncs())
         self.assertEquals(broker2.get_sync('12345'), 3)
 
+    def test_pending_file(self):
+        testdir = mkdtemp()
+        orig_batch = swift.common.db.PENDING_COMMIT_BATCH
+        try:
+            broker = ContainerBroker(os.path.join(testdir, 'c.db'),
+                                     account='a', container='c')
+            broker.initialize(normalize_timestamp('1'))
+            for i in xrange(5):
+                broker.put_object('o%d' % i, normalize_timestamp(i + 1), i,
+                                  'text/plain', 'etag')
+            with open(broker.pending_file, 'rb') as fp:
+                entries = list(iter_pending_entries(fp))
+            self.assertEquals(len(entries), 5)
+            self.assertEquals(pickle.loads(entries[2]),
+                              ('o2', normalize_timestamp(3), 2, 'text/plain',
+                               'etag', 0))
+            # entries left by older versions are still read
+            with open(broker.pending_file, 'ab') as fp:
+                fp.write(':' + pickle.dumps(
+                    ('o5', normalize_timestamp(6), 5, 'text/plain', 'etag',
+                     0), protocol=2).encode('base64'))
+            merged = []
+            orig_merge_items = broker.merge_items
+
+            def merge_items(item_list, source=None):
+                merged.append(len(item_list))
+                orig_merge_items(item_list, source)
+
+            broker.merge_items = merge_items
+            swift.common.db.PENDING_COMMIT_BATCH = 4
+            self.assertEquals(broker.get_info()['object_count'], 6)
+            self.assertEquals(merged, [4, 2])
+            self.assertEquals(os.path.getsize(broker.pending_file), 0)
+        finally:
+            swift.common.db.PENDING_COMMIT_BATCH = orig_batch
+            rmtree(testdir)
+
+    def test_pending_file_torn_entry(self):
+        testdir = mkdtemp()
+        orig_framed = swift.common.db.PENDING_FRAMED
+        try:
+            swift.common.db.PENDING_FRAMED = True
+            logger = FakeLogger()
+            broker = ContainerBroker(os.path.join(testdir, 'c.db'),
+                                     account='a', container='c',
+                                     logger=logger)
+            broker.initialize(normalize_timestamp('1'))
+            broker.put_object('o0', normalize_timestamp(1), 0, 'text/plain',
+                              'etag')
+            # an append cut short by a crash
+            with open(broker.pending_file, 'ab') as fp:
+                fp.write(pending_entry('x' * 50)[:20])
+            broker.put_object('o1', normalize_timestamp(2), 0, 'text/plain',
+                              'etag')
+            self.assertEquals(broker.get_info()['object_count'], 2)
+            self.assertEquals(len(logger.log_dict['error']), 1)
+            self.assertEquals(logger.log_dict['error'][0][0][1]['size'], 20)
+            self.assertEquals(os.path.getsize(broker.pending_file), 0)
+        finally:
+            swift.common.db.PENDING_FRAMED = orig_framed
+            rmtree(testdir)
+
+    def test_pending_file_group_commit(self):
+        testdir = mkdtemp()
+        try:
+            broker = ContainerBroker(os.path.join(testdir, 'c.db'),
+                                     account='a', container='c')
+            broker.initialize(normalize_timestamp('1'))
+            pool = eventlet.GreenPool()
+            with lock_parent_directory(broker.pending_file):
+                for i in xrange(10):
+                    pool.spawn(broker.put_object, 'o%d' % i,
+                               normalize_timestamp(i + 1), 0, 'text/plain',
+                               'etag')
+                eventlet.sleep(0.05)
+                # the first put waits for the lock, the others queue behind
+                self.assertEquals(len(swift.common.db._pending_groups[
+                    broker.pending_file]), 10)
+            pool.waitall()
+            self.assertFalse(swift.common.db._pending_groups)
+            with open(broker.pending_file, 'rb') as fp:
+                self.assertEquals(len(list(iter_pending_entries(fp))), 10)
+            self.assertEquals(broker.get_info()['object_count'], 10)
+        finally:
+            rmtree(testdir)
+
     def test_merge_items(self):
         broker1 = ContainerBroker(':memory:', account='a', container='c')
         broker1.initialize(normalize_timestamp('1'))
@@ -1307,6 +1647,27 @@ class TestContainerBroker(unittest.TestCase):
         self.assertEquals(['a', 'b', 'c'],
                           sorted([rec['name'] for rec in items]))
 
+    def test_merge_items_repeated_names(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(normalize_timestamp('1'))
+        broker.put_object('b', normalize_timestamp(5), 5, 'text/plain', 'e5')
+
+        def rec(name, timestamp, deleted=0):
+            return {'name': name, 'created_at': normalize_timestamp(timestamp),
+                    'size': timestamp, 'content_type': 'text/plain',
+                    'etag': 'e%d' % timestamp, 'deleted': deleted, 'ROWID': 1}
+
+        broker.merge_items([rec('a', 2), rec('b', 4), rec('c', 3),
+                            rec('a', 3), rec('b', 6, 1), rec('a', 1),
+                            rec('c', 3, 1)])
+        items = broker.get_items_since(-1, 1000)
+        self.assertEquals(
+            [(i['name'], i['etag'], i['deleted']) for i in items],
+            [('c', 'e3', 0), ('a', 'e3', 0), ('b', 'e6', 1)])
+        info = broker.get_info()
+        self.assertEquals(info['object_count'], 2)
+        self.assertEquals(info['bytes_used'], 12)
+
     def test_merge_items_overwrite(self):
         """test DatabaseBroker.merge_items"""
         broker1 = ContainerBroker(':memory:', account='a', container='c')
@@ -1975,6 +2336,31 @@ class TestAccountBroker(unittest.TestCase):
         self.assertEquals(['a', 'b', 'c'],
                           sorted([rec['name'] for rec in items]))
 
+    def test_merge_items_repeated_names(self):
+        broker = AccountBroker(':memory:', account='a')
+        broker.initialize(normalize_timestamp('1'))
+        broker.put_container('b', normalize_timestamp(5), 0, 5, 50)
+
+        def rec(name, put, delete, count, deleted=0):
+            return {'name': name, 'put_timestamp': normalize_timestamp(put),
+                    'delete_timestamp': normalize_timestamp(delete),
+                    'object_count': count, 'bytes_used': count * 10,
+                    'deleted': deleted, 'ROWID': 1}
+
+        broker.merge_items([rec('a', 2, 0, 1), rec('b', 4, 0, 3),
+                            rec('a', 1, 3, 0), rec('c', 1, 0, 1),
+                            rec('b', 0, 6, 0)])
+        items = broker.get_items_since(-1, 1000)
+        self.assertEquals(
+            [(i['name'], i['put_timestamp'], i['delete_timestamp'],
+              i['object_count'], i['deleted']) for i in items],
+            [('a', normalize_timestamp(2), normalize_timestamp(3), 0, 1),
+             ('c', normalize_timestamp(1), normalize_timestamp(0), 1, 0),
+             ('b', normalize_timestamp(5), normalize_timestamp(6), 0, 1)])
+        info = broker.get_info()
+        self.assertEquals(info['container_count'], 1)
+        self.assertEquals(info['object_count'], 1)
+
 
 def premetadata_create_account_stat_table(self, conn, put_timestamp):
     """
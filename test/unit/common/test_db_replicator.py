@@ -18,9 +18,13 @@ from contextlib import contextmanager
 import os
 import logging
 import errno
+import zlib
 from shutil import rmtree
 from tempfile import mkdtemp, NamedTemporaryFile
 
+import simplejson
+from eventlet import sleep
+
 from swift.common import db_replicator
 from swift.common import utils
 from swift.common.utils import normalize_timestamp
@@ -212,6 +216,24 @@ class TestDBReplicator(unittest.TestCase):
         conn.request = other_req
         self.assertEquals(conn.replicate(1, 2, 3), None)
 
+    def test_repl_connection_compress(self):
+        node = {'ip': '127.0.0.1', 'port': 80, 'device': 'sdb1'}
+        conn = db_replicator.ReplConnection(node, '1234567890', 'abcdefg',
+                    logging.getLogger(), compress=True)
+        sent = []
+
+        def req(method, path, body, headers):
+            self.assertEquals(headers['Content-Encoding'], 'deflate')
+            sent.append(simplejson.loads(zlib.decompress(body)))
+
+        class Resp:
+            def read(self):
+                return 'data'
+        conn.request = req
+        conn.getresponse = lambda *args: Resp()
+        conn.replicate(1, 2, 3)
+        self.assertEquals(sent, [[1, 2, 3]])
+
     def test_rsync_file(self):
         replicator = TestReplicator({})
         with _mock_process(-1):
@@ -248,11 +270,112 @@ class TestDBReplicator(unittest.TestCase):
         replicator = TestReplicator({})
         replicator.run_once()
 
+    def test_replicate_in_workers(self):
+        replicator = TestReplicator({'device_workers': '2'})
+        testdir = mkdtemp()
+        try:
+            dirs = []
+            for dev in xrange(3):
+                datadir = os.path.join(testdir, 'sd%d' % dev, 'containers')
+                for part in xrange(dev + 1):
+                    hash_dir = os.path.join(datadir, str(part), 'abc',
+                                            '%d%dabc' % (dev, part))
+                    os.makedirs(hash_dir)
+                    open(os.path.join(hash_dir, '%d%dabc.db' % (dev, part)),
+                         'w').close()
+                dirs.append((datadir, dev))
+
+            def replicate_object(part, object_file, node_id):
+                replicator.stats['attempted'] += 1
+                replicator.stats['success' if node_id else 'failure'] += 1
+
+            replicator._replicate_object = replicate_object
+            replicator._replicate_in_workers(dirs)
+            self.assertEquals(replicator.stats['attempted'], 6)
+            self.assertEquals(replicator.stats['success'], 5)
+            self.assertEquals(replicator.stats['failure'], 1)
+            self.assertEquals(replicator.stats['remove'], 0)
+        finally:
+            rmtree(testdir, ignore_errors=1)
+
     def test_usync(self):
         fake_http = ReplHttp()
         replicator = TestReplicator({})
         replicator._usync_db(0, FakeBroker(), fake_http, '12345', '67890')
 
+    def test_usync_compact(self):
+        replicator = TestReplicator({'compact_diffs': 'yes'})
+        calls = []
+
+        class FakeHttp(ReplHttp):
+            def replicate(self, *args):
+                calls.append(args)
+                return ReplHttp.replicate(self, *args)
+
+        self.assertTrue(replicator._usync_db(
+            0, FakeBroker(), FakeHttp(), '12345', '67890'))
+        self.assertEquals(calls, [('merge_rows', ['ROWID'], [[1]], '67890'),
+                                  ('merge_syncs', [])])
+
+    def test_usync_pipelined(self):
+        replicator = TestReplicator({'diffs_in_flight': '3',
+                                     'per_diff': '2', 'max_diffs': '4'})
+        conns = []
+
+        class FakeHttp(ReplHttp):
+            def __init__(self, status=200):
+                ReplHttp.__init__(self)
+                self.status = status
+                self.calls = []
+                conns.append(self)
+
+            def replicate(self, *args):
+                self.calls.append(args)
+                sleep()  # the request is on the wire
+                resp = ReplHttp.replicate(self, *args)
+                resp.status = self.status
+                return resp
+
+        class Broker(FakeBroker):
+            rows = 7
+
+            def get_items_since(self, point, count):
+                return [{'ROWID': i} for i in
+                        xrange(point + 1, min(point + count, self.rows) + 1)]
+
+        http = FakeHttp()
+        self.assertTrue(replicator._usync_db(
+            0, Broker(), http, '12345', '67890', connect=FakeHttp))
+        self.assertEquals(len(conns), 3)
+        merges = sorted(call for conn in conns for call in conn.calls
+                        if call[0] == 'merge_items')
+        self.assertEquals(merges, [
+            ('merge_items', [{'ROWID': 1}, {'ROWID': 2}], None),
+            ('merge_items', [{'ROWID': 3}, {'ROWID': 4}], None),
+            ('merge_items', [{'ROWID': 5}, {'ROWID': 6}], None),
+            ('merge_items', [{'ROWID': 7}], None)])
+        # the remote learns the sync point once every batch is in
+        self.assertEquals(http.calls[-1], (
+            'merge_syncs', [{'remote_id': '67890', 'sync_point': 7}]))
+
+        # capped; the progress made is kept for the next pass
+        del conns[:]
+        Broker.rows = 9
+        http = FakeHttp()
+        self.assertFalse(replicator._usync_db(
+            0, Broker(), http, '12345', '67890', connect=FakeHttp))
+        self.assertEquals(http.calls[-1], (
+            'merge_syncs', [{'remote_id': '67890', 'sync_point': 8}]))
+
+        # a failed batch fails the sync without recording any point
+        del conns[:]
+        http = FakeHttp()
+        self.assertFalse(replicator._usync_db(
+            0, Broker(), http, '12345', '67890',
+            connect=lambda: FakeHttp(500)))
+        self.assertFalse([call for conn in conns for call in conn.calls
+                          if call[0] == 'merge_syncs'])
+
     def test_repl_to_node(self):
         replicator = TestReplicator({})
         fake_node = {'ip': '127.0.0.1', 'device': 'sda1', 'port': 1000}
@@ -413,6 +536,15 @@ class TestDBReplicator(unittest.TestCase):
         rpc.merge_items(fake_broker, args)
         self.assertEquals(fake_broker.args, args)
 
+    def test_merge_rows(self):
+        rpc = db_replicator.ReplicatorRpc('/', '/', FakeBroker, False)
+        fake_broker = FakeBroker()
+        rpc.merge_rows(fake_broker,
+                       (['ROWID', 'name'], [[1, 'a'], [2, 'b']], 'c'))
+        self.assertEquals(fake_broker.args,
+                          ([{'ROWID': 1, 'name': 'a'},
+                            {'ROWID': 2, 'name': 'b'}], 'c'))
+
     def test_merge_syncs(self):
         rpc = db_replicator.ReplicatorRpc('/', '/', FakeBroker, False)
         fake_broker = FakeBroker()
@@ -1167,6 +1167,45 @@ log_name = %(yarr)s'''
         finally:
             utils._sys_fallocate = orig__sys_fallocate
 
+    def test_sendfile(self):
+        with TemporaryFile() as src:
+            src.write('0123456789' * 10)
+            src.flush()
+            reader, writer = socket.socketpair()
+            try:
+                self.assertEquals(
+                    utils.sendfile(writer.fileno(), src.fileno(), 10, 20),
+                    20)
+                self.assertEquals(reader.recv(100), '01234567890123456789')
+                # sendfile does not move the input file's position
+                self.assertEquals(
+                    utils.sendfile(writer.fileno(), src.fileno(), 95, 20), 5)
+                self.assertEquals(reader.recv(100), '56789')
+                self.assertEquals(
+                    utils.sendfile(writer.fileno(), src.fileno(), 100, 20), 0)
+            finally:
+                reader.close()
+                writer.close()
+            try:
+                utils.sendfile(-1, src.fileno(), 0, 10)
+            except OSError, err:
+                self.assertEquals(err.errno, errno.EBADF)
+            else:
+                self.fail('sendfile to a bad fd did not raise')
+
+    def test_sendfile_not_available(self):
+        orig__sys_sendfile = utils._sys_sendfile
+        try:
+            utils._sys_sendfile = utils.noop_libc_function
+            try:
+                utils.sendfile(1, 2, 0, 10)
+            except OSError, err:
+                self.assertEquals(err.errno, errno.ENOSYS)
+            else:
+                self.fail('sendfile did not raise ENOSYS')
+        finally:
+            utils._sys_sendfile = orig__sys_sendfile
+
     def test_import_class_builtin(self):
         self.assertEqual(utils.import_class('__builtin__.object'), object)
 
@@ -1185,6 +1224,64 @@ log_name = %(yarr)s'''
         self.assertRaises(ValueError, utils.create_instance,
                           '__builtin__.object', type)
 
+    def test_joined_chunks(self):
+        self.assertEquals(list(utils.joined_chunks([], 2)), [])
+        self.assertEquals(list(utils.joined_chunks('abcde', 2)),
+                          ['ab', 'cd', 'e'])
+        self.assertEquals(list(utils.joined_chunks(iter('abcd'), 4)),
+                          ['abcd'])
+
+    def test_iter_listing(self):
+        rows = [(str(i),) for i in xrange(7)]
+        calls = []
+
+        def list_page(marker, limit):
+            calls.append((marker, limit))
+            return [r for r in rows if r[0] > marker][:limit]
+
+        self.assertEquals(list(utils.iter_listing(list_page, rows[:3], 10, 3)),
+                          rows)
+        self.assertEquals(calls, [('2', 3), ('5', 3)])
+        del calls[:]
+        self.assertEquals(list(utils.iter_listing(list_page, rows[:3], 5, 3)),
+                          rows[:5])
+        self.assertEquals(calls, [('2', 2)])
+        self.assertEquals(list(utils.iter_listing(list_page, [], 5, 3)), [])
+
+    def test_lru_cache(self):
+        with patch('time.time', return_value=1000.0):
+            cache = utils.LRUCache(2, 5)
+            cache.set('a', 1)
+            cache.set('b', 2)
+            self.assertEquals(cache.get('a'), 1)
+            # 'b' is now the least recently used entry
+            cache.set('c', 3)
+            self.assertEquals(cache.get('b'), None)
+            self.assertEquals(cache.get('a'), 1)
+            self.assertEquals(cache.get('c'), 3)
+            cache.delete('a')
+            cache.delete('a')
+            self.assertEquals(cache.get('a'), None)
+        with patch('time.time', return_value=1004.0):
+            self.assertEquals(cache.get('c'), 3)
+        with patch('time.time', return_value=1005.0):
+            self.assertEquals(cache.get('c'), None)
+        self.assertEquals(len(cache.entries), 0)
+
+    def test_lru_cache_order_kept_over_many_uses(self):
+        cache = utils.LRUCache(3, 60)
+        for key in 'abc':
+            cache.set(key, key)
+        for _junk in xrange(100):
+            cache.get('a')
+            cache.get('b')
+        self.assertTrue(len(cache.uses) <= 2 * 3 + 16)
+        cache.set('d', 'd')
+        self.assertEquals(sorted(cache.entries), ['a', 'b', 'd'])
+        cache.get('a')
+        cache.set('e', 'e')
+        self.assertEquals(sorted(cache.entries), ['a', 'd', 'e'])
+
 
 class TestStatsdLogging(unittest.TestCase):
     def test_get_logger_statsd_client_not_specified(self):
@@ -17,6 +17,7 @@ import operator
 import os
 import sys
 import unittest
+import zlib
 from shutil import rmtree
 from StringIO import StringIO
 from time import time
@@ -27,7 +28,7 @@ import simplejson
 
 from swift.common.swob import Request
 from swift.container import server as container_server
-from swift.common.utils import normalize_timestamp, mkdirs
+from swift.common.utils import normalize_timestamp, mkdirs, hash_path
 
 
 class TestContainerController(unittest.TestCase):
@@ -106,6 +107,83 @@ class TestContainerController(unittest.TestCase):
         self.assertEquals(int(response.headers['x-container-bytes-used']), 42)
         self.assertEquals(int(response.headers['x-container-object-count']), 1)
 
+    def test_HEAD_pending_flusher(self):
+        self.controller = container_server.ContainerController(
+            {'devices': self.testdir, 'mount_check': 'false',
+             'pending_flush_interval': '60'})
+        flusher = self.controller.pending_flusher
+        self.assertEquals(flusher.interval, 60)
+        self.assertEquals(flusher.watermark, 65536)
+        req = Request.blank('/sda1/p/a/c', environ={'REQUEST_METHOD': 'PUT',
+            'HTTP_X_TIMESTAMP': '0'})
+        self.controller.PUT(req)
+        req2 = Request.blank('/sda1/p/a/c/o', environ=
+                {'HTTP_X_TIMESTAMP': '1', 'HTTP_X_SIZE': 42,
+                 'HTTP_X_CONTENT_TYPE': 'text/plain', 'HTTP_X_ETAG': 'x'})
+        self.controller.PUT(req2)
+        broker = self.controller._get_container_broker('sda1', 'p', 'a', 'c')
+        self.assertTrue(broker.defer_pending)
+        self.assertEquals(flusher.dirty.keys(), [broker.pending_file])
+        # the update is left to the flusher
+        response = self.controller.HEAD(req)
+        self.assertEquals(int(response.headers['x-container-object-count']), 0)
+        flusher.flush()
+        self.assertEquals(flusher.dirty, {})
+        response = self.controller.HEAD(req)
+        self.assertEquals(int(response.headers['x-container-bytes-used']), 42)
+        self.assertEquals(int(response.headers['x-container-object-count']), 1)
+        flusher.thread.kill()
+
+    def test_REPLICATE_deflated(self):
+        req = Request.blank('/sda1/p/a/c', environ={'REQUEST_METHOD': 'PUT',
+            'HTTP_X_TIMESTAMP': '0'})
+        self.controller.PUT(req)
+        path = '/sda1/p/%s' % hash_path('a', 'c')
+        args = ['merge_rows',
+                ['ROWID', 'name', 'created_at', 'size', 'content_type',
+                 'etag', 'deleted'],
+                [[1, 'o', normalize_timestamp(1), 0, 'text/plain',
+                  'd41d8cd98f00b204e9800998ecf8427e', 0]], 'remote']
+        req = Request.blank(path, environ={'REQUEST_METHOD': 'REPLICATE'},
+            headers={'Content-Type': 'application/json',
+                     'Content-Encoding': 'deflate'},
+            body=zlib.compress(simplejson.dumps(args)))
+        resp = self.controller.REPLICATE(req)
+        self.assertEquals(resp.status_int, 202)
+        req = Request.blank('/sda1/p/a/c', environ={'REQUEST_METHOD': 'HEAD'})
+        resp = self.controller.HEAD(req)
+        self.assertEquals(resp.headers['x-container-object-count'], '1')
+        req = Request.blank(path, environ={'REQUEST_METHOD': 'REPLICATE'},
+            headers={'Content-Encoding': 'deflate'},
+            body=simplejson.dumps(args))
+        resp = self.controller.REPLICATE(req)
+        self.assertEquals(resp.status_int, 400)
+
+    def test_HEAD_stat_cache(self):
+        self.controller = container_server.ContainerController(
+            {'devices': self.testdir, 'mount_check': 'false',
+             'stat_cache_size': '10'})
+        req = Request.blank('/sda1/p/a/c', environ={'REQUEST_METHOD': 'PUT',
+            'HTTP_X_TIMESTAMP': '0'})
+        self.controller.PUT(req)
+        req = Request.blank('/sda1/p/a/c', environ={'REQUEST_METHOD': 'HEAD'})
+        resp = self.controller.HEAD(req)
+        self.assertEquals(resp.status_int, 204)
+        self.assertEquals(len(self.controller.stat_cache.entries.entries), 1)
+        req = Request.blank('/sda1/p/a/c', environ={'REQUEST_METHOD': 'POST'},
+            headers={'X-Timestamp': '1', 'X-Container-Meta-Test': 'Value'})
+        self.controller.POST(req)
+        self.assertEquals(len(self.controller.stat_cache.entries.entries), 0)
+        req = Request.blank('/sda1/p/a/c', environ={'REQUEST_METHOD': 'HEAD'})
+        resp = self.controller.HEAD(req)
+        self.assertEquals(resp.headers['X-Container-Meta-Test'], 'Value')
+        req = Request.blank('/sda1/p/a/c', environ={'REQUEST_METHOD': 'DELETE',
+            'HTTP_X_TIMESTAMP': '2'})
+        self.controller.DELETE(req)
+        req = Request.blank('/sda1/p/a/c', environ={'REQUEST_METHOD': 'HEAD'})
+        resp = self.controller.HEAD(req)
+        self.assertEquals(resp.status_int, 404)
+
     def test_HEAD_not_found(self):
         req = Request.blank('/sda1/p/a/c', environ={'REQUEST_METHOD': 'HEAD'})
         resp = self.controller.HEAD(req)
@@ -604,6 +682,53 @@ class TestContainerController(unittest.TestCase):
             self.assertEquals(resp.content_type, 'application/json',
                 'Invalid content_type for Accept: %s' % accept)
 
+    def test_GET_streams_long_listings(self):
+        req = Request.blank('/sda1/p/a/c', environ={'REQUEST_METHOD': 'PUT',
+            'HTTP_X_TIMESTAMP': '0'})
+        self.controller.PUT(req)
+        for i in xrange(250):
+            req = Request.blank('/sda1/p/a/c/%03d' % i, environ=
+                    {'REQUEST_METHOD': 'PUT',
+                    'HTTP_X_TIMESTAMP': '1',
+                    'HTTP_X_CONTENT_TYPE': 'text/plain',
+                    'HTTP_X_ETAG': 'x',
+                    'HTTP_X_SIZE': i})
+            self.controller.PUT(req)
+        req = Request.blank('/sda1/p/a/c?format=json',
+                            environ={'REQUEST_METHOD': 'GET'})
+        resp = self.controller.GET(req)
+        self.assertEquals(resp.status_int, 200)
+        self.assertEquals(resp.content_length, None)
+        chunks = list(resp.app_iter)
+        self.assertEquals(len(chunks), 3)
+        self.assertEquals(simplejson.loads(''.join(chunks)),
+                          [{'name': '%03d' % i, 'hash': 'x', 'bytes': i,
+                            'content_type': 'text/plain',
+                            'last_modified': '1970-01-01T00:00:01.000000'}
+                           for i in xrange(250)])
+        req = Request.blank('/sda1/p/a/c?format=xml',
+                            environ={'REQUEST_METHOD': 'GET'})
+        resp = self.controller.GET(req)
+        self.assertEquals(resp.content_length, None)
+        self.assertTrue(resp.body.startswith(
+            '<?xml version="1.0" encoding="UTF-8"?>\n<container name="c">'
+            '<object><name>000</name>'))
+        self.assertEquals(resp.body.count('<object>'), 250)
+        req = Request.blank('/sda1/p/a/c', environ={'REQUEST_METHOD': 'GET'})
+        resp = self.controller.GET(req)
+        self.assertEquals(resp.body,
+                          ''.join('%03d\n' % i for i in xrange(250)))
+        req = Request.blank('/sda1/p/a/c?limit=150&marker=010',
+                            environ={'REQUEST_METHOD': 'GET'})
+        resp = self.controller.GET(req)
+        self.assertEquals(resp.content_length, None)
+        self.assertEquals(resp.body,
+                          ''.join('%03d\n' % i for i in xrange(11, 161)))
+        req = Request.blank('/sda1/p/a/c?limit=100',
+                            environ={'REQUEST_METHOD': 'GET'})
+        resp = self.controller.GET(req)
+        self.assertEquals(resp.content_length, 400)
+
     def test_GET_plain(self):
         # make a container
         req = Request.blank('/sda1/p/a/plainc', environ={'REQUEST_METHOD': 'PUT',
@@ -21,7 +21,7 @@ from gzip import GzipFile
 from shutil import rmtree
 from tempfile import mkdtemp
 
-from eventlet import spawn, Timeout, listen
+from eventlet import spawn, sleep, Timeout, listen
 
 from swift.common import utils
 from swift.container import updater as container_updater
@@ -152,6 +152,46 @@ class TestContainerUpdater(unittest.TestCase):
         self.assertEquals(info['reported_object_count'], 1)
         self.assertEquals(info['reported_bytes_used'], 3)
 
+    def test_update_concurrency(self):
+        cu = container_updater.ContainerUpdater({
+            'devices': self.devices_dir,
+            'mount_check': 'false',
+            'swift_dir': self.testdir,
+            'interval': '1',
+            'concurrency': '1',
+            'update_concurrency': '4',
+            'slowdown': '0',
+            })
+        containers_dir = os.path.join(self.sda1, container_server.DATADIR)
+        for account, container in (('a', 'c1'), ('a', 'c2'), ('b', 'c1')):
+            subdir = os.path.join(containers_dir, 'subdir', account, container)
+            os.makedirs(subdir)
+            cb = ContainerBroker(os.path.join(subdir, 'hash.db'),
+                                 account=account, container=container)
+            cb.initialize(normalize_timestamp(1))
+            cb.put_object('o', normalize_timestamp(2), 3, 'text/plain',
+                          '68b329da9893e34099c7d8ad5cb9c940')
+        in_flight = []
+        reports = []
+
+        def container_report(node, part, container, *args):
+            in_flight.append(container)
+            reports.append(list(in_flight))
+            sleep(0.01)
+            in_flight.remove(container)
+            return 201
+
+        cu.container_report = container_report
+        cu.run_once()
+        self.assertEquals(cu.successes, 3)
+        self.assertEquals(len(reports), 6)
+        # both accounts are updated at once, each one container at a time
+        self.assertEquals(max(len(set(r)) for r in reports), 2)
+        for report in reports:
+            self.assert_(len(set(c.split('/')[1] for c in report)) ==
+                         len(set(report)))
+        self.assertEquals(cu.account_locks, {})
+
     def test_unicode(self):
         cu = container_updater.ContainerUpdater({
             'devices': self.devices_dir,
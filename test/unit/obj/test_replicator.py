@@ -25,13 +25,19 @@ import fcntl
 import time
 import tempfile
 from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 from eventlet.green import subprocess
-from eventlet import Timeout, tpool
+import eventlet
+from eventlet import Timeout, tpool, listen, spawn, wsgi
 from test.unit import FakeLogger, mock
+from test.unit import _getxattr as getxattr
+from test.unit import _setxattr as setxattr
 from swift.common import utils
-from swift.common.utils import hash_path, mkdirs, normalize_timestamp
+from swift.common.utils import hash_path, mkdirs, normalize_timestamp, \
+    NullLogger
 from swift.common import ring
 from swift.obj import replicator as object_replicator
+from swift.obj import server as object_server
 from swift.obj.server import DiskFile
 
 
@@ -210,6 +216,42 @@ class TestObjectReplicator(unittest.TestCase):
         self.assertEquals(hashed, 1)
         self.assert_('a83' in hashes)
 
+    def test_get_hashes_with_hash_pool(self):
+        for obj in ('o1', 'o2', 'o3', 'o4'):
+            df = DiskFile(self.devices, 'sda', '0', 'a', 'c', obj,
+                          FakeLogger())
+            mkdirs(df.datadir)
+            with open(os.path.join(df.datadir, normalize_timestamp(
+                        time.time()) + '.ts'), 'wb') as f:
+                f.write('1234567890')
+        part = os.path.join(self.objects, '0')
+        hashed, serial_hashes = object_replicator.get_hashes(part)
+        self.assertEquals(hashed, 4)
+        pool = ThreadPool(3)
+        try:
+            hashed, hashes = object_replicator.get_hashes(
+                part, recalculate=serial_hashes.keys(), hash_pool=pool)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEquals(hashed, 4)
+        self.assertEquals(hashes, serial_hashes)
+
+    def test_get_suffix_hash_pool(self):
+        self.assertEquals(self.replicator.get_suffix_hash_pool('sda'), None)
+        conf = dict(self.conf, suffix_hash_threads_per_disk='4')
+        replicator = object_replicator.ObjectReplicator(conf)
+        pool = replicator.get_suffix_hash_pool('sda')
+        try:
+            self.assertTrue(isinstance(pool, ThreadPool))
+            self.assertTrue(replicator.get_suffix_hash_pool('sda') is pool)
+            other = replicator.get_suffix_hash_pool('sdb')
+            self.assertTrue(other is not pool)
+        finally:
+            for pool in replicator.suffix_hash_pools.values():
+                pool.close()
+                pool.join()
+
     def test_get_hashes_bad_dir(self):
         df = DiskFile(self.devices, 'sda', '0', 'a', 'c', 'o', FakeLogger())
         mkdirs(df.datadir)
@@ -360,12 +402,6 @@ class TestObjectReplicator(unittest.TestCase):
         self.assertEquals(len(os.listdir(whole_hsh_path)), 2)
 
     def test_invalidate_hash(self):
-
-        def assertFileData(file_path, data):
-            with open(file_path, 'r') as fp:
-                fdata = fp.read()
-                self.assertEquals(pickle.loads(fdata), pickle.loads(data))
-
         df = DiskFile(self.devices, 'sda', '0', 'a', 'c', 'o', FakeLogger())
         mkdirs(df.datadir)
         ohash = hash_path('a', 'c', 'o')
@@ -373,17 +409,121 @@ class TestObjectReplicator(unittest.TestCase):
         whole_path_from = os.path.join(self.objects, '0', data_dir)
         hashes_file = os.path.join(self.objects, '0',
                                    object_replicator.HASH_FILE)
-        # test that non existent file except caught
+        inv_file = os.path.join(self.objects, '0',
+                                object_replicator.HASH_INVALIDATIONS_FILE)
+        with open(hashes_file, 'wb') as fp:
+            pickle.dump({data_dir: 'abcdefg'}, fp,
+                        object_replicator.PICKLE_PROTOCOL)
         self.assertEquals(object_replicator.invalidate_hash(whole_path_from),
                           None)
-        # test that hashes get cleared
-        check_pickle_data = pickle.dumps({data_dir: None},
-                                         object_replicator.PICKLE_PROTOCOL)
-        for data_hash in [{data_dir: None}, {data_dir: 'abcdefg'}]:
-            with open(hashes_file, 'wb') as fp:
-                pickle.dump(data_hash, fp, object_replicator.PICKLE_PROTOCOL)
-            object_replicator.invalidate_hash(whole_path_from)
-            assertFileData(hashes_file, check_pickle_data)
+        object_replicator.invalidate_hash(whole_path_from)
+        # the hashes file is left alone, suffixes go to the journal
+        with open(hashes_file, 'rb') as fp:
+            self.assertEquals(pickle.load(fp), {data_dir: 'abcdefg'})
+        with open(inv_file, 'rb') as fp:
+            self.assertEquals(fp.read(), '%s\n%s\n' % (data_dir, data_dir))
+
+    def test_consolidate_hashes(self):
+        part = os.path.join(self.objects, '0')
+        hashes_file = os.path.join(part, object_replicator.HASH_FILE)
+        inv_file = os.path.join(part,
+                                object_replicator.HASH_INVALIDATIONS_FILE)
+        with open(hashes_file, 'wb') as fp:
+            pickle.dump({'abc': 'hash1', 'def': 'hash2'}, fp,
+                        object_replicator.PICKLE_PROTOCOL)
+        object_replicator.invalidate_hash(os.path.join(part, 'abc'))
+        object_replicator.invalidate_hash(os.path.join(part, '123'))
+        hashes = object_replicator.consolidate_hashes(part)
+        self.assertEquals(hashes, {'abc': None, 'def': 'hash2', '123': None})
+        with open(hashes_file, 'rb') as fp:
+            self.assertEquals(pickle.load(fp), hashes)
+        self.assertEquals(os.path.getsize(inv_file), 0)
+        # a torn record is ignored
+        with open(inv_file, 'ab') as fp:
+            fp.write('de')
+        self.assertEquals(object_replicator.consolidate_hashes(part), hashes)
+
+    def test_consolidate_hashes_no_hashes_file(self):
+        part = os.path.join(self.objects, '0')
+        inv_file = os.path.join(part,
+                                object_replicator.HASH_INVALIDATIONS_FILE)
+        self.assertEquals(object_replicator.consolidate_hashes(part), None)
+        object_replicator.invalidate_hash(os.path.join(part, 'abc'))
+        self.assertEquals(object_replicator.consolidate_hashes(part), None)
+        self.assertEquals(os.path.getsize(inv_file), 0)
+
+    def test_get_hashes_consolidates_invalidations(self):
+        df = DiskFile(self.devices, 'sda', '0', 'a', 'c', 'o', FakeLogger())
+        mkdirs(df.datadir)
+        with open(os.path.join(df.datadir, normalize_timestamp(
+                    time.time()) + '.ts'), 'wb') as f:
+            f.write('1234567890')
+        part = os.path.join(self.objects, '0')
+        hashed, hashes = object_replicator.get_hashes(part)
+        self.assertEquals(hashed, 1)
+        hashed, hashes = object_replicator.get_hashes(part)
+        self.assertEquals(hashed, 0)
+        object_replicator.invalidate_hash(os.path.dirname(df.datadir))
+        hashed, hashes = object_replicator.get_hashes(part)
+        self.assertEquals(hashed, 1)
+        self.assert_(hashes['a83'])
+
+    def _ssync_server(self):
+        mkdirs(os.path.join(self.devices, 'sdb', 'tmp'))
+        server = object_server.ObjectController(
+            {'devices': self.devices, 'mount_check': 'false',
+             'log_requests': 'false'})
+        sock = listen(('127.0.0.1', 0))
+        accepted = []
+        orig_accept = sock.accept
+
+        def accept():
+            conn = orig_accept()
+            accepted.append(conn)
+            return conn
+        sock.accept = accept
+        server_thread = spawn(wsgi.server, sock, server, NullLogger())
+        node = {'ip': '127.0.0.1', 'port': sock.getsockname()[1],
+                'device': 'sdb'}
+        return node, accepted, server_thread
+
+    def test_ssync(self):
+        node, accepted, server_thread = self._ssync_server()
+        try:
+            df = DiskFile(self.devices, 'sda', '0', 'a', 'c', 'o',
+                          FakeLogger())
+            mkdirs(df.datadir)
+            for name in ('1.00000.data', '2.00000.meta'):
+                with open(os.path.join(df.datadir, name), 'wb') as fp:
+                    fp.write(name)
+                    setxattr(fp.fileno(), object_server.METADATA_KEY, name)
+            suffix = os.path.basename(os.path.dirname(df.datadir))
+            replicator = object_replicator.ObjectReplicator(
+                dict(self.conf, sync_method='ssync'))
+            job = {'path': self.parts['0'], 'partition': '0'}
+            self.assertTrue(replicator.sync(node, job, [suffix]))
+            dst_dir = df.datadir.replace('/sda/', '/sdb/')
+            self.assertEquals(sorted(os.listdir(dst_dir)),
+                              ['1.00000.data', '2.00000.meta'])
+            with open(os.path.join(dst_dir, '2.00000.meta')) as fp:
+                self.assertEquals(fp.read(), '2.00000.meta')
+                self.assertEquals(
+                    getxattr(fp.fileno(), object_server.METADATA_KEY),
+                    '2.00000.meta')
+            # nothing left to send, over the same connection
+            self.assertTrue(replicator.sync(node, job, [suffix]))
+            self.assertEquals(len(accepted), 1)
+            # no local files under the suffix
+            self.assertFalse(replicator.sync(node, job, ['fff']))
+            # a bad response is a failure
+            node['device'] = '..'
+            self.assertFalse(replicator.sync(node, job, [suffix]))
+        finally:
+            server_thread.kill()
+
+    def test_bad_sync_method(self):
+        self.assertRaises(ValueError, object_replicator.ObjectReplicator,
+                          dict(self.conf, sync_method='ftp'))
 
     def test_check_ring(self):
         self.assertTrue(self.replicator.check_ring())
@@ -442,6 +582,60 @@ class TestObjectReplicator(unittest.TestCase):
             self.assertEquals(jobs_by_part[part]['path'],
                               os.path.join(self.objects, part))
 
+    def test_collect_jobs_priority(self):
+        failed = self.ring.devs[3]
+        self.replicator.last_failed_nodes = set(
+            [(failed['ip'], failed['port'], failed['device'])])
+        jobs = self.replicator.collect_jobs()
+        # the handoff first, then the partitions with a replica on the
+        # failed node
+        self.assertEquals(jobs[0]['partition'], '1')
+        self.assertEquals(sorted(job['partition'] for job in jobs[1:3]),
+                          ['2', '3'])
+        self.assertEquals(jobs[3]['partition'], '0')
+        self.replicator.pending_jobs = jobs
+        self.assertEquals(self.replicator.queue_stats(),
+                          {'handoff': 1, 'degraded': 2, 'primary': 1,
+                           'devices': {'sda': 4}})
+
+    def test_next_job_per_device_limit(self):
+        jobs = [{'device': 'sda', 'partition': '0'},
+                {'device': 'sda', 'partition': '1'},
+                {'device': 'sdb', 'partition': '2'}]
+        self.replicator.pending_jobs = list(jobs)
+        self.assertEquals(self.replicator.next_job({'sda': 5}), jobs[0])
+        self.replicator.max_jobs_per_device = 1
+        self.assertEquals(self.replicator.next_job({'sda': 1}), jobs[2])
+        self.assertEquals(self.replicator.next_job({'sda': 1, 'sdb': 1}),
+                          None)
+        self.assertEquals(self.replicator.next_job({}), jobs[1])
+        self.assertEquals(self.replicator.pending_jobs, [])
+
+    def test_replicate_max_jobs_per_device(self):
+        replicator = object_replicator.ObjectReplicator(
+            dict(self.conf, concurrency='4', max_jobs_per_device='1'))
+        running = [0]
+        max_running = [0]
+
+        def fake_update(job):
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+            eventlet.sleep(0.01)
+            running[0] -= 1
+        replicator.update = replicator.update_deleted = fake_update
+        replicator.replicate()
+        self.assertEquals(replicator.replication_count, 0)
+        self.assertEquals(max_running[0], 1)
+        self.assertEquals(replicator.pending_jobs, [])
+
+    def test_node_failed(self):
+        node = self.ring.devs[1]
+        self.replicator.node_failed(node)
+        self.replicator.replicate(override_devices=['sdz'])
+        self.assertEquals(self.replicator.last_failed_nodes,
+                          set([(node['ip'], node['port'], node['device'])]))
+        self.assertEquals(self.replicator.failed_nodes, set())
+
     def test_collect_jobs_removes_zbf(self):
         """
         After running xfs_repair, a partition directory could become a
@@ -18,6 +18,8 @@
 import cPickle as pickle
 import operator
 import os
+import socket
+import ssl
 import unittest
 import email
 from shutil import rmtree
@@ -26,12 +28,13 @@ from time import gmtime, sleep, strftime, time
 from tempfile import mkdtemp
 from hashlib import md5
 
+import mock
 from eventlet import sleep, spawn, wsgi, listen, Timeout
 from test.unit import FakeLogger
 from test.unit import _getxattr as getxattr
 from test.unit import _setxattr as setxattr
 from test.unit import connect_tcp, readuntil2crlfs
-from swift.obj import server as object_server, replicator
+from swift.obj import server as object_server, replicator, encryptor
 from swift.common import utils
 from swift.common.utils import hash_path, mkdirs, normalize_timestamp, \
                                NullLogger, storage_directory
@@ -79,6 +82,59 @@ class TestDiskFile(unittest.TestCase):
                                     FakeLogger(), keep_data_fp=True)
         self.assertEqual(''.join(df.app_iter_range(5, None)), '67890')
 
+    def _sendfile_pair(self, df):
+        reader, writer = socket.socketpair()
+        df.sendfile_sock = writer
+        self.addCleanup(reader.close)
+        self.addCleanup(writer.close)
+        return reader
+
+    def _read_all(self, reader):
+        reader.shutdown(socket.SHUT_WR)
+        data = []
+        reader.settimeout(1)
+        while True:
+            try:
+                chunk = reader.recv(65536)
+            except socket.timeout:
+                break
+            if not chunk:
+                break
+            data.append(chunk)
+        return ''.join(data)
+
+    def test_disk_file_sendfile_iter(self):
+        data = '0123456789' * 20000
+        df = self._create_test_file(data)
+        df.disk_chunk_size = 10
+        reader = self._sendfile_pair(df)
+        # only the first chunk goes through the iterator, the rest is
+        # written straight to the socket
+        chunks = []
+        for chunk in df:
+            chunks.append(chunk)
+        self.assertEquals(chunks, ['0123456789'])
+        self.assertEquals(self._read_all(reader), data[10:])
+        self.assertEquals(df.fp, None)
+
+    def test_disk_file_sendfile_app_iter_range(self):
+        df = self._create_test_file('012345678911234567892123456789')
+        df.disk_chunk_size = 4
+        reader = self._sendfile_pair(df)
+        self.assertEquals(''.join(df.app_iter_range(5, 25)), '5678')
+        self.assertEquals(self._read_all(reader), '9112345678921234')
+
+    def test_disk_file_sendfile_app_iter_ranges(self):
+        df = self._create_test_file('012345678911234567892123456789')
+        reader = self._sendfile_pair(df)
+        it = df.app_iter_ranges([(0, 10), (10, 20)], 'plain/text',
+                                '\r\n--someheader\r\n', 30)
+        value = ''.join(it)
+        self.assert_('0123456789' in value)
+        self.assert_('1123456789' in value)
+        self.assertEquals(df.sendfile_sock, None)
+        self.assertEquals(self._read_all(reader), '')
+
     def test_disk_file_app_iter_ranges(self):
         df = self._create_test_file('012345678911234567892123456789')
         it = df.app_iter_ranges([(0, 10), (10, 20), (20, 30)], 'plain/text',
@@ -763,6 +819,80 @@ class TestObjectController(unittest.TestCase):
                            'X-Object-Meta-1': 'One',
                            'X-Object-Meta-Two': 'Two'})
 
+    def test_PUT_backend_copy(self):
+        timestamp = normalize_timestamp(time())
+        req = Request.blank('/sda1/p/a/c/o', environ={'REQUEST_METHOD': 'PUT'},
+                            headers={'X-Timestamp': timestamp,
+                                     'Content-Type': 'text/plain',
+                                     'X-Object-Meta-Key-Id': '1',
+                                     'X-Object-Meta-1': 'One'})
+        req.body = 'VERIFY'
+        resp = self.object_controller.PUT(req)
+        self.assertEquals(resp.status_int, 201)
+
+        copy_timestamp = normalize_timestamp(float(timestamp) + 1)
+        headers = {'X-Timestamp': copy_timestamp,
+                   'Content-Type': 'application/x-copy',
+                   'Content-Length': '0',
+                   'ETag': md5('VERIFY').hexdigest(),
+                   'X-Object-Meta-Key-Id': '1',
+                   'X-Object-Meta-Two': 'Two',
+                   'X-Backend-Copy-From': 'p/c/o',
+                   'X-Backend-Copy-From-Timestamp': timestamp}
+        for bad_headers in ({'X-Backend-Copy-From': 'p/c/missing'},
+                            {'X-Backend-Copy-From-Timestamp': '1'},
+                            {'X-Object-Meta-Key-Id': '2'}):
+            req = Request.blank('/sda1/q/a/c/o2',
+                                environ={'REQUEST_METHOD': 'PUT'},
+                                headers=dict(headers, **bad_headers))
+            resp = self.object_controller.PUT(req)
+            self.assertEquals(resp.status_int, 409)
+
+        req = Request.blank('/sda1/q/a/c/o2',
+                            environ={'REQUEST_METHOD': 'PUT'},
+                            headers=headers)
+        resp = self.object_controller.PUT(req)
+        self.assertEquals(resp.status_int, 201)
+        self.assertEquals(resp.etag, md5('VERIFY').hexdigest())
+        req = Request.blank('/sda1/q/a/c/o2')
+        resp = self.object_controller.GET(req)
+        self.assertEquals(resp.status_int, 200)
+        self.assertEquals(resp.body, 'VERIFY')
+        self.assertEquals(resp.headers['Content-Type'], 'application/x-copy')
+        self.assertEquals(resp.headers['X-Timestamp'], copy_timestamp)
+        self.assertEquals(resp.headers['X-Object-Meta-Two'], 'Two')
+        self.assert_('X-Object-Meta-1' not in resp.headers)
+        # the source is left alone
+        req = Request.blank('/sda1/p/a/c/o')
+        resp = self.object_controller.GET(req)
+        self.assertEquals(resp.body, 'VERIFY')
+        self.assertEquals(resp.headers['X-Object-Meta-1'], 'One')
+
+    def test_clone_data_fallbacks(self):
+        src_path = os.path.join(self.testdir, 'src')
+        with open(src_path, 'wb') as fp:
+            fp.write('x' * 100000)
+        for sendfile_works in (True, False):
+            dst_path = os.path.join(self.testdir, 'dst')
+            src_fd = os.open(src_path, os.O_RDONLY)
+            dst_fd = os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+            try:
+                with mock.patch('swift.obj.server.reflink',
+                                side_effect=IOError(95, 'EOPNOTSUPP')):
+                    if sendfile_works:
+                        self.object_controller._clone_data(src_fd, dst_fd,
+                                                           90000)
+                    else:
+                        with mock.patch('swift.obj.server.sendfile',
+                                        side_effect=OSError(38, 'ENOSYS')):
+                            self.object_controller._clone_data(
+                                src_fd, dst_fd, 90000)
+            finally:
+                os.close(src_fd)
+                os.close(dst_fd)
+            with open(dst_path, 'rb') as fp:
+                self.assertEquals(fp.read(), 'x' * 90000)
+
     def test_PUT_container_connection(self):
 
         def mock_http_connect(response, with_exc=False):
@@ -1460,6 +1590,86 @@ class TestObjectController(unittest.TestCase):
         self.assertEquals(response, 'oh hai')
         killer.kill()
 
+    def test_GET_zero_copy(self):
+        self.object_controller = object_server.ObjectController(
+            {'devices': self.testdir, 'mount_check': 'false',
+             'zero_copy_gets': 'true', 'disk_chunk_size': '16'})
+        self.assert_(self.object_controller.zero_copy_gets)
+        body = 'VERIFY' * 1000
+        req = Request.blank('/sda1/p/a/c/o',
+                            environ={'REQUEST_METHOD': 'PUT'},
+                            headers={'X-Timestamp': normalize_timestamp(1),
+                                     'Content-Type': 'application/x-test'})
+        req.body = body
+        resp = self.object_controller.PUT(req)
+        self.assertEquals(resp.status_int, 201)
+
+        listener = listen(('localhost', 0))
+        port = listener.getsockname()[1]
+        killer = spawn(wsgi.server, listener, self.object_controller,
+                       NullLogger())
+        try:
+            for headers, expected in (('', body),
+                                      ('Range: bytes=10-5009\r\n',
+                                       body[10:5010])):
+                sock = connect_tcp(('localhost', port))
+                fd = sock.makefile()
+                fd.write('GET /sda1/p/a/c/o HTTP/1.1\r\nHost: localhost\r\n'
+                         '%sConnection: close\r\n\r\n' % headers)
+                fd.flush()
+                resp_headers = readuntil2crlfs(fd)
+                self.assert_('Content-Length: %d' % len(expected)
+                             in resp_headers)
+                self.assertEquals(fd.read(), expected)
+        finally:
+            killer.kill()
+
+    def test_zero_copy_gets_needs_transparent_driver(self):
+        conf = {'devices': self.testdir, 'mount_check': 'false',
+                'zero_copy_gets': 'true'}
+        with mock.patch.object(encryptor.DummyDriver, 'transparent', False):
+            controller = object_server.ObjectController(conf)
+        self.assertFalse(controller.zero_copy_gets)
+
+    def test_zero_copy_gets_off_with_ssl(self):
+        conf = {'devices': self.testdir, 'mount_check': 'false',
+                'zero_copy_gets': 'true', 'cert_file': 'server.crt'}
+        controller = object_server.ObjectController(conf)
+        self.assertFalse(controller.zero_copy_gets)
+
+    def test_GET_zero_copy_skips_ssl_socket(self):
+        req = Request.blank('/sda1/p/a/c/o',
+                            environ={'REQUEST_METHOD': 'PUT'},
+                            headers={'X-Timestamp': normalize_timestamp(1),
+                                     'Content-Type': 'application/x-test'})
+        req.body = 'VERIFY'
+        resp = self.object_controller.PUT(req)
+        self.assertEquals(resp.status_int, 201)
+        self.object_controller.zero_copy_gets = True
+
+        class FakeSSLSocket(ssl.SSLSocket):
+            def __init__(self):
+                pass
+
+        class FakeInput(object):
+            def __init__(self, sock):
+                self.sock = sock
+
+            def get_socket(self):
+                return self.sock
+
+        plain_sock = socket.socket()
+        for sock, sendfile_used in ((FakeSSLSocket(), False),
+                                    (plain_sock, True)):
+            req = Request.blank('/sda1/p/a/c/o',
+                                environ={'eventlet.input': FakeInput(sock)})
+            resp = self.object_controller.GET(req)
+            self.assertEquals(resp.status_int, 200)
+            self.assertEquals(resp.app_iter.sendfile_sock is sock,
+                              sendfile_used)
+            resp.app_iter.close()
+        plain_sock.close()
+
     def test_max_object_name_length(self):
         timestamp = normalize_timestamp(time())
         max_name_len = constraints.MAX_OBJECT_NAME_LENGTH
@@ -2448,6 +2658,57 @@ class TestObjectController(unittest.TestCase):
             tpool.execute = was_tpool_exe
             object_server.get_hashes = was_get_hashes
 
+    def test_REPLICATE_ssync_missing_check(self):
+        ohash = hash_path('a', 'c', 'o')
+        hash_dir = os.path.join(self.testdir, 'sda1',
+                                storage_directory(object_server.DATADIR, 'p',
+                                                  ohash))
+        mkdirs(hash_dir)
+        open(os.path.join(hash_dir, '1.00000.data'), 'wb').close()
+        hash_path_ = '%s/%s' % (ohash[-3:], ohash)
+        listing = {hash_path_: ['1.00000.data', '2.00000.meta']}
+
+        def my_tpool_execute(func, *args, **kwargs):
+            return func(*args, **kwargs)
+
+        was_tpool_exe = tpool.execute
+        tpool.execute = my_tpool_execute
+        try:
+            req = Request.blank('/sda1/p',
+                                environ={'REQUEST_METHOD': 'REPLICATE'},
+                                headers={'X-Ssync-Op': 'missing_check'},
+                                body=utils.json.dumps(listing))
+            resp = self.object_controller.REPLICATE(req)
+            self.assertEquals(resp.status_int, 200)
+            self.assertEquals(utils.json.loads(resp.body),
+                              [hash_path_ + '/2.00000.meta'])
+        finally:
+            tpool.execute = was_tpool_exe
+
+    def test_REPLICATE_ssync_push(self):
+        ohash = hash_path('a', 'c', 'o')
+        relpath = '%s/%s/1.00000.data' % (ohash[-3:], ohash)
+        body = '%s 4 1\nuser.swift.metadata 4\nmetaDATA' % relpath
+        req = Request.blank('/sda1/p',
+                            environ={'REQUEST_METHOD': 'REPLICATE'},
+                            headers={'X-Ssync-Op': 'push'}, body=body)
+        resp = self.object_controller.REPLICATE(req)
+        self.assertEquals(resp.status_int, 204)
+        path = os.path.join(self.testdir, 'sda1', 'objects', 'p', relpath)
+        with open(path) as fp:
+            self.assertEquals(fp.read(), 'DATA')
+            self.assertEquals(getxattr(fp.fileno(), 'user.swift.metadata'),
+                              'meta')
+
+    def test_REPLICATE_ssync_bad_requests(self):
+        for op, body in (('missing_check', 'not json'), ('push', 'bad\n'),
+                         ('nope', '')):
+            req = Request.blank('/sda1/p',
+                                environ={'REQUEST_METHOD': 'REPLICATE'},
+                                headers={'X-Ssync-Op': op}, body=body)
+            resp = self.object_controller.REPLICATE(req)
+            self.assertEquals(resp.status_int, 400)
+
     def test_PUT_with_full_drive(self):
 
         class IgnoredBody():
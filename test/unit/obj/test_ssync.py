@@ -0,0 +1,120 @@
+# Copyright (c) 2010-2012 OpenStack, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import with_statement
+
+import os
+import unittest
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp
+
+from test.unit import _getxattr as getxattr
+from test.unit import _setxattr as setxattr
+from swift.common.utils import mkdirs
+from swift.obj import server as object_server
+from swift.obj import ssync
+
+HASH = 'd41d8cd98f00b204e9800998ecf8427e'
+SUFFIX = HASH[-3:]
+
+
+class TestSsync(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = mkdtemp()
+        self.src = os.path.join(self.testdir, 'src', 'objects', '0')
+        self.dst = os.path.join(self.testdir, 'dst', 'objects', '0')
+        self.tmp = os.path.join(self.testdir, 'dst', 'tmp')
+        mkdirs(self.src)
+        mkdirs(self.dst)
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=1)
+
+    def _make_file(self, part_dir, name, data='', metadata='pickled'):
+        hash_dir = os.path.join(part_dir, SUFFIX, HASH)
+        mkdirs(hash_dir)
+        with open(os.path.join(hash_dir, name), 'wb') as fp:
+            fp.write(data)
+            setxattr(fp.fileno(), object_server.METADATA_KEY, metadata)
+
+    def test_list_suffix_files(self):
+        self._make_file(self.src, '1.00000.data')
+        self._make_file(self.src, '2.00000.meta')
+        listing = ssync.list_suffix_files(self.src, [SUFFIX, 'fff'])
+        self.assertEquals(listing.keys(), ['%s/%s' % (SUFFIX, HASH)])
+        self.assertEquals(sorted(listing.values()[0]),
+                          ['1.00000.data', '2.00000.meta'])
+
+    def test_find_missing(self):
+        self._make_file(self.src, '1.00000.data')
+        self._make_file(self.src, '2.00000.meta')
+        self._make_file(self.dst, '1.00000.data')
+        listing = ssync.list_suffix_files(self.src, [SUFFIX])
+        self.assertEquals(ssync.find_missing(self.dst, listing),
+                          ['%s/%s/2.00000.meta' % (SUFFIX, HASH)])
+        rmtree(os.path.join(self.dst, SUFFIX))
+        self.assertEquals(len(ssync.find_missing(self.dst, listing)), 2)
+
+    def test_records_round_trip(self):
+        self._make_file(self.src, '1.00000.data', 'x' * 1000, 'meta1')
+        self._make_file(self.src, '2.00000.ts', '', 'meta2')
+        relpaths = ['%s/%s/1.00000.data' % (SUFFIX, HASH),
+                    '%s/%s/2.00000.ts' % (SUFFIX, HASH),
+                    '%s/%s/3.00000.ts' % (SUFFIX, HASH)]
+        stream = ''.join(ssync.iter_records(self.src, relpaths, 64))
+        self.assertEquals(ssync.receive_records(
+            self.dst, self.tmp, StringIO(stream), 64), 2)
+        hash_dir = os.path.join(self.dst, SUFFIX, HASH)
+        self.assertEquals(sorted(os.listdir(hash_dir)),
+                          ['1.00000.data', '2.00000.ts'])
+        with open(os.path.join(hash_dir, '1.00000.data'), 'rb') as fp:
+            self.assertEquals(fp.read(), 'x' * 1000)
+            self.assertEquals(
+                getxattr(fp.fileno(), object_server.METADATA_KEY), 'meta1')
+        self.assertEquals(os.listdir(self.tmp), [])
+        # existing files are left alone
+        self.assertEquals(ssync.receive_records(
+            self.dst, self.tmp, StringIO(stream), 64), 0)
+
+    def test_records_skip_non_user_xattrs(self):
+        self._make_file(self.src, '1.00000.data', 'x', 'meta1')
+        relpath = '%s/%s/1.00000.data' % (SUFFIX, HASH)
+        with open(os.path.join(self.src, relpath), 'rb') as fp:
+            setxattr(fp.fileno(), 'security.selinux', 'system_u:object_r')
+        stream = ''.join(ssync.iter_records(self.src, [relpath]))
+        self.assertTrue('security.selinux' not in stream)
+        self.assertEquals(ssync.receive_records(
+            self.dst, self.tmp, StringIO(stream)), 1)
+        with open(os.path.join(self.dst, relpath), 'rb') as fp:
+            self.assertEquals(
+                getxattr(fp.fileno(), object_server.METADATA_KEY), 'meta1')
+
+    def test_receive_records_bad_stream(self):
+        for stream in ('%s/%s/1.00000.data 5 0\nabc' % (SUFFIX, HASH),
+                       '../../etc/passwd 0 0\n',
+                       '%s/%s/1.00000.data 0\n' % (SUFFIX, HASH),
+                       '%s/%s/1.00000.data 0 1\ntrusted.x 1\nx' %
+                       (SUFFIX, HASH),
+                       'x' * (ssync.MAX_LINE_LENGTH + 1)):
+            self.assertRaises(ssync.SsyncProtocolError,
+                              ssync.receive_records, self.dst, self.tmp,
+                              StringIO(stream))
+        self.assertEquals(os.listdir(self.dst), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
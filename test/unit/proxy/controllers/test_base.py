@@ -18,9 +18,9 @@ import unittest
 import swift.proxy.controllers.base
 from swift.proxy.controllers.base import headers_to_container_info, \
     headers_to_account_info, get_container_info, get_container_memcache_key, \
-    get_account_info, get_account_memcache_key
+    get_account_info, get_account_memcache_key, ReadAheadQueue, Controller
 from swift.common.swob import Request
-from swift.common.utils import split_path
+from swift.common.utils import split_path, LRUCache
 
 
 class FakeResponse(object):
@@ -49,6 +49,28 @@ class FakeCache(object):
         return self.val
 
 
+class FakeMemcache(object):
+    def __init__(self):
+        self.store = {}
+        self.gets = 0
+
+    def get(self, key):
+        self.gets += 1
+        return self.store.get(key)
+
+    def set(self, key, value, time=0):
+        self.store[key] = value
+
+    def delete(self, key):
+        self.store.pop(key, None)
+
+
+class FakeApp(object):
+    def __init__(self, info_cache=None):
+        self.memcache = FakeMemcache()
+        self.info_cache = info_cache
+
+
 class TestFuncs(unittest.TestCase):
     def test_get_container_info_no_cache(self):
         swift.proxy.controllers.base.make_pre_authed_request = FakeRequest
@@ -128,11 +150,13 @@ class TestFuncs(unittest.TestCase):
             'x-container-read': 'readvalue',
             'x-container-write': 'writevalue',
             'x-container-sync-key': 'keyvalue',
+            'x-put-timestamp': '0000000001.00000',
             'x-container-meta-access-control-allow-origin': 'here',
         }
         resp = headers_to_container_info(headers.items(), 200)
         self.assertEquals(resp['read_acl'], 'readvalue')
         self.assertEquals(resp['write_acl'], 'writevalue')
+        self.assertEquals(resp['put_timestamp'], '0000000001.00000')
         self.assertEquals(resp['cors']['allow_origin'], 'here')
 
         headers['x-unused-header'] = 'blahblahblah'
@@ -167,3 +191,68 @@ class TestFuncs(unittest.TestCase):
         self.assertEquals(
             resp,
             headers_to_account_info(headers.items(), 200))
+
+    def test_read_ahead_queue(self):
+        queue = ReadAheadQueue(10, 100)
+        self.assertEquals(queue.maxsize, 1)
+        # nothing is known about the client yet
+        queue.backend_read(5)
+        self.assertEquals(queue.maxsize, 1)
+        # a client taking 40 bytes/s needs 200 bytes to ride out a 5s stall,
+        # but the queue is capped at 100 bytes
+        queue.client_sent(20, 0.5)
+        queue.backend_read(0.1)
+        self.assertEquals(queue.maxsize, 10)
+        # a slower client needs less
+        queue.client_sent(20, 7.5)
+        queue.backend_read(0.1)
+        self.assertEquals(queue.maxsize, 3)
+        # a client that takes forever still gets one chunk
+        queue.client_sent(0, 1000)
+        queue.backend_read(0.1)
+        self.assertEquals(queue.maxsize, 1)
+        # once the terminator's room has been made it is left alone
+        queue.resize(None)
+        queue.backend_read(10)
+        self.assertEquals(queue.maxsize, None)
+
+    def test_have_quorum(self):
+        controller = Controller(None)
+        self.assertFalse(controller.have_quorum([201], 3))
+        self.assertFalse(controller.have_quorum([201, 404], 3))
+        self.assertTrue(controller.have_quorum([201, 201], 3))
+        self.assertTrue(controller.have_quorum([404, 404], 3))
+        self.assertFalse(controller.have_quorum([503, 503, 503], 3))
+        self.assertFalse(controller.have_quorum([201, 201], 4))
+        self.assertTrue(controller.have_quorum([201, 202, 204], 4))
+
+    def test_cached_info_local_tier(self):
+        app = FakeApp(LRUCache(10, 60))
+        controller = Controller(app)
+        key = get_container_memcache_key('a', 'c')
+        self.assertEquals(controller.get_cached_info(key), None)
+        self.assertEquals(app.memcache.gets, 1)
+        info = {'status': 200, 'count': 1}
+        controller.set_cached_info(key, info, 60)
+        info['partition'] = 1
+        for _junk in xrange(3):
+            self.assertEquals(controller.get_cached_info(key),
+                              {'status': 200, 'count': 1})
+        self.assertEquals(app.memcache.gets, 1)
+        controller.clear_cached_info(key)
+        self.assertEquals(controller.get_cached_info(key), None)
+        self.assertEquals(app.memcache.gets, 2)
+        # memcache hits fill the local tier
+        app.memcache.store[key] = {'status': 404}
+        self.assertEquals(controller.get_cached_info(key), {'status': 404})
+        self.assertEquals(controller.get_cached_info(key), {'status': 404})
+        self.assertEquals(app.memcache.gets, 3)
+
+    def test_cached_info_no_local_tier(self):
+        app = FakeApp()
+        controller = Controller(app)
+        key = get_account_memcache_key('a')
+        controller.set_cached_info(key, {'status': 200}, 60)
+        self.assertEquals(controller.get_cached_info(key), {'status': 200})
+        self.assertEquals(controller.get_cached_info(key), {'status': 200})
+        self.assertEquals(app.memcache.gets, 2)
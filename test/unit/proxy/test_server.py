@@ -24,6 +24,7 @@ import urlparse
 import signal
 from ConfigParser import ConfigParser
 from contextlib import contextmanager
+from functools import partial
 from cStringIO import StringIO
 from gzip import GzipFile
 from httplib import HTTPException
@@ -44,6 +45,7 @@ from swift.account import server as account_server
 from swift.container import server as container_server
 from swift.obj import server as object_server
 from swift.common import ring
+from swift.common.bufferedhttp import BufferedHTTPConnectionPool
 from swift.common.exceptions import ChunkReadTimeout
 from swift.common.constraints import MAX_META_NAME_LENGTH, \
     MAX_META_VALUE_LENGTH, MAX_META_COUNT, MAX_META_OVERALL_SIZE, \
@@ -155,12 +157,9 @@ def setup():
     ts = normalize_timestamp(time.time())
     partition, nodes = prosrv.account_ring.get_nodes('a')
     for node in nodes:
-        conn = swift.proxy.controllers.obj.http_connect(node['ip'],
-                                                        node['port'],
-                                                        node['device'],
-                                                        partition, 'PUT', '/a',
-                                                        {'X-Timestamp': ts,
-                                                         'x-trans-id': 'test'})
+        conn = swift.proxy.controllers.base.http_connect(
+            node['ip'], node['port'], node['device'], partition, 'PUT', '/a',
+            {'X-Timestamp': ts, 'x-trans-id': 'test'})
         resp = conn.getresponse()
         assert(resp.status == 201)
     # Create container
@@ -763,6 +762,77 @@ class TestProxyServer(unittest.TestCase):
         finally:
             rmtree(swift_dir, ignore_errors=True)
 
+    def test_hedge_delay(self):
+        baseapp = proxy_server.Application({'hedged_get_percentile': '90'},
+                                           FakeMemcache(),
+                                           container_ring=FakeRing(),
+                                           object_ring=FakeRing(),
+                                           account_ring=FakeRing())
+        self.assertEquals(baseapp.hedge_delay(), None)
+        baseapp.get_latencies.extend(
+            [0.01 * i for i in xrange(proxy_server.HEDGE_MIN_SAMPLES)])
+        self.assertAlmostEquals(baseapp.hedge_delay(), 0.18)
+        baseapp.hedged_get_percentile = 100
+        self.assertAlmostEquals(baseapp.hedge_delay(), 0.19)
+
+    def test_node_scores(self):
+        recon_dir = mkdtemp()
+        try:
+            baseapp = proxy_server.Application(
+                {'sorting_method': 'score', 'node_score_jitter': '0',
+                 'node_score_decay': '0.5', 'node_timeout': '10',
+                 'recon_cache_path': recon_dir},
+                FakeMemcache(), container_ring=FakeRing(),
+                object_ring=FakeRing(), account_ring=FakeRing())
+            sda = {'ip': '10.0.0.1', 'port': 6000, 'device': 'sda'}
+            sdb = {'ip': '10.0.0.1', 'port': 6000, 'device': 'sdb'}
+            sdc = {'ip': '10.0.0.2', 'port': 6000, 'device': 'sdc'}
+            self.assertEquals(baseapp.node_score(sda), 0)
+            baseapp.record_node_latency(sda, 0.2)
+            baseapp.record_node_latency(sda, 0.4)
+            self.assertAlmostEquals(baseapp.node_score(sda), 0.3)
+            # devices on the same host are scored apart
+            baseapp.record_node_latency(sdb, 0.1)
+            self.assertAlmostEquals(baseapp.node_score(sdb), 0.1)
+            # half the requests failing costs half a node_timeout
+            baseapp.record_node_error(sdb)
+            self.assertAlmostEquals(baseapp.node_score(sdb),
+                                    0.5 * 0.1 + 0.5 * 10)
+            # unknown and expired devices are tried first
+            self.assertEquals(baseapp.sort_nodes([sdb, sda, sdc]),
+                              [sdc, sda, sdb])
+            self.assertEquals(
+                baseapp.node_score(sda, time.time() + baseapp.timing_expiry
+                                   + 1), 0)
+            self.assertEquals(
+                list(baseapp.sort_handoffs(iter([sdb, sda, sdc]), 2)),
+                [sda, sdb, sdc])
+
+            # scores are dumped from a greenthread, not by the requests
+            self.assertNotEquals(baseapp.node_scores_dumper, None)
+            baseapp.node_scores_dumper.kill()
+            baseapp.dump_node_scores()
+            with open(os.path.join(recon_dir, 'proxy.recon')) as f:
+                scores = simplejson.load(f)[
+                    'proxy_node_scores_%d' % os.getpid()]
+            self.assertEquals(sorted(scores), ['10.0.0.1/sda',
+                                               '10.0.0.1/sdb'])
+            self.assertAlmostEquals(scores['10.0.0.1/sda']['latency'], 0.3)
+            self.assertAlmostEquals(scores['10.0.0.1/sdb']['error_rate'],
+                                    0.5)
+        finally:
+            rmtree(recon_dir)
+
+    def test_node_scores_off(self):
+        baseapp = proxy_server.Application({}, FakeMemcache(),
+                                           container_ring=FakeRing(),
+                                           object_ring=FakeRing(),
+                                           account_ring=FakeRing())
+        baseapp.record_node_latency({'ip': '10.0.0.1', 'device': 'sda'}, 1)
+        baseapp.record_node_error({'ip': '10.0.0.1', 'device': 'sda'})
+        self.assertEquals(baseapp.node_scores, {})
+        self.assertEquals(baseapp.node_scores_dumper, None)
+
     def test_node_timing(self):
         baseapp = proxy_server.Application({'sorting_method': 'timing'},
                                            FakeMemcache(),
@@ -1312,6 +1382,116 @@ class TestObjectController(unittest.TestCase):
                  ['HEAD', '/a/c/manifest', {}],
                  ['GET', '/a/c/manifest', {}]])
 
+    def test_GET_HEAD_manifest_cached_listing(self):
+        listing = [{"hash": "454dfc73af632012ce3e6217dc464241",
+                    "last_modified": "2012-11-08T04:05:37.866820",
+                    "bytes": 2,
+                    "name": "seg01",
+                    "content_type": "application/octet-stream"},
+                   {"hash": "474bab96c67528d42d5c0c52b35228eb",
+                    "last_modified": "2012-11-08T04:05:37.846710",
+                    "bytes": 2,
+                    "name": "seg02",
+                    "content_type": "application/octet-stream"}]
+        headers = {'X-Object-Manifest': 'segments/seg',
+                   'X-PUT-Timestamp': '1352347537.84671',
+                   'X-Container-Object-Count': '2',
+                   'X-Container-Bytes-Used': '4'}
+        self.app.dlo_listing_cache_time = 60
+        requested = []
+
+        def capture_requested_paths(ipaddr, port, device, partition,
+                                    method, path, headers=None,
+                                    query_string=None):
+            qs_dict = dict(urlparse.parse_qsl(query_string or ''))
+            requested.append([method, path, qs_dict])
+
+        with save_globals():
+            controller = proxy_server.ObjectController(
+                self.app, 'a', 'c', 'manifest')
+            set_http_connect(
+                200,    # HEAD /a
+                200,    # HEAD /a/c
+                200,    # HEAD manifest
+                200,    # HEAD /a/segments
+                200,    # GET listing
+                200,    # GET final empty listing
+                headers=headers,
+                body_iter=('', '', '', '', simplejson.dumps(listing),
+                           simplejson.dumps([])),
+                give_connect=capture_requested_paths)
+            req = Request.blank('/a/c/manifest',
+                                environ={'REQUEST_METHOD': 'HEAD'})
+            resp = controller.HEAD(req)
+            self.assertEqual(resp.status_int, 200)
+            self.assertEqual(resp.content_length, 4)
+            etag = resp.etag
+            self.assertEqual(
+                requested,
+                [['HEAD', '/a', {}],
+                 ['HEAD', '/a/c', {}],
+                 ['HEAD', '/a/c/manifest', {}],
+                 ['HEAD', '/a/segments', {}],
+                 ['GET', '/a/segments',
+                  {'format': 'json', 'prefix': 'seg'}],
+                 ['GET', '/a/segments',
+                  {'format': 'json', 'prefix': 'seg', 'marker': 'seg02'}]])
+
+            # the listing now comes from memcache
+            del requested[:]
+            controller = proxy_server.ObjectController(
+                self.app, 'a', 'c', 'manifest')
+            set_http_connect(200, 200, headers=headers,
+                             give_connect=capture_requested_paths)
+            req = Request.blank('/a/c/manifest',
+                                environ={'REQUEST_METHOD': 'HEAD'})
+            resp = controller.HEAD(req)
+            self.assertEqual(resp.status_int, 200)
+            self.assertEqual(resp.content_length, 4)
+            self.assertEqual(resp.etag, etag)
+            self.assertEqual(resp.headers['last-modified'],
+                             'Thu, 08 Nov 2012 04:05:37 GMT')
+            self.assertEqual(requested, [['HEAD', '/a/c/manifest', {}],
+                                         ['HEAD', '/a/segments', {}]])
+
+            del requested[:]
+            controller = proxy_server.ObjectController(
+                self.app, 'a', 'c', 'manifest')
+            set_http_connect(200, 200, 200, 200, headers=headers,
+                             body_iter=('', '', 'Aa', 'Bb'),
+                             give_connect=capture_requested_paths)
+            req = Request.blank('/a/c/manifest')
+            resp = controller.GET(req)
+            self.assertEqual(resp.status_int, 200)
+            self.assertEqual(resp.body, 'AaBb')
+            self.assertEqual(resp.etag, etag)
+            self.assertEqual(
+                requested,
+                [['GET', '/a/c/manifest', {}],
+                 ['HEAD', '/a/segments', {}],
+                 ['GET', '/a/segments/seg01', {}],
+                 ['GET', '/a/segments/seg02', {}]])
+
+            # a new segment changes the key the listing is cached under,
+            # even while the old container info is still cached
+            del requested[:]
+            controller = proxy_server.ObjectController(
+                self.app, 'a', 'c', 'manifest')
+            headers['X-Container-Object-Count'] = '3'
+            set_http_connect(200, 200, 200, headers=headers,
+                             body_iter=('', '', simplejson.dumps([])),
+                             give_connect=capture_requested_paths)
+            req = Request.blank('/a/c/manifest',
+                                environ={'REQUEST_METHOD': 'HEAD'})
+            resp = controller.HEAD(req)
+            self.assertEqual(resp.content_length, 0)
+            self.assertEqual(
+                requested,
+                [['HEAD', '/a/c/manifest', {}],
+                 ['HEAD', '/a/segments', {}],
+                 ['GET', '/a/segments',
+                  {'format': 'json', 'prefix': 'seg'}]])
+
     def test_PUT_auto_content_type(self):
         with save_globals():
             controller = proxy_server.ObjectController(self.app, 'account',
@@ -1461,6 +1641,39 @@ class TestObjectController(unittest.TestCase):
             test_status_map((200, 200, 201, -1, -1), 503)
             test_status_map((200, 200, 503, 503, -1), 503)
 
+    def test_PUT_returns_at_quorum(self):
+        with save_globals():
+            self.app.post_quorum_timeout = 0.01
+            controller = proxy_server.ObjectController(self.app, 'account',
+                                                       'container', 'object')
+            set_http_connect(200, 200, 201, 201, 201)
+            fake_connect = swift.proxy.controllers.base.http_connect
+            slow_reads = []
+
+            def connect(*args, **kwargs):
+                conn = fake_connect(*args, **kwargs)
+                if args[4] == 'PUT' and args[1] == 1002:
+                    getresponse = conn.getresponse
+
+                    def slow_getresponse():
+                        sleep(0.5)
+                        slow_reads.append(True)
+                        return getresponse()
+                    conn.getresponse = slow_getresponse
+                return conn
+            swift.proxy.controllers.base.http_connect = connect
+            req = Request.blank('/a/c/o', environ={'REQUEST_METHOD': 'PUT'},
+                                body='some data')
+            self.app.update_request(req)
+            start = time.time()
+            res = controller.PUT(req)
+            self.assertEquals(res.status_int, 201)
+            self.assert_(time.time() - start < 0.4)
+            self.assertEquals(slow_reads, [])
+            # the straggler is still read in the background
+            sleep(0.6)
+            self.assertEquals(slow_reads, [True])
+
     def test_POST(self):
         with save_globals():
             self.app.object_post_as_copy = False
@@ -1880,6 +2093,198 @@ class TestObjectController(unittest.TestCase):
                 got_exc = True
             self.assert_(got_exc)
 
+    def test_GET_resumes_mid_stream(self):
+
+        class FailingSource(object):
+            def __init__(self, chunks):
+                self.chunks = chunks
+
+            def read(self, amt=None):
+                chunk = self.chunks.pop(0)
+                if chunk is None:
+                    raise Exception('disk went away')
+                return chunk
+
+            def close(self):
+                pass
+
+        controller = proxy_server.ObjectController(self.app, 'account',
+                                                   'container', 'object')
+        resumed = []
+
+        def resume(source, offset):
+            resumed.append(offset)
+            if len(resumed) == 1:
+                return {'ip': '10.0.0.1', 'port': 1001, 'device': 'sdb'}, \
+                    FailingSource(['3456', None])
+            return {'ip': '10.0.0.2', 'port': 1002, 'device': 'sdc'}, \
+                FailingSource(['789', ''])
+
+        node = {'ip': '10.0.0.0', 'port': 1000, 'device': 'sda'}
+        app_iter = controller._make_app_iter(
+            node, FailingSource(['012', None]), resume)
+        self.assertEquals(''.join(app_iter), '0123456789')
+        # offsets are counted from the start of each source
+        self.assertEquals(resumed, [3, 4])
+
+        # no node to carry on with
+        app_iter = controller._make_app_iter(
+            node, FailingSource(['012', None]), lambda *a: (None, None))
+        self.assertRaises(Exception, ''.join, app_iter)
+
+    def test_GET_resumes_twice(self):
+        body = '0123456789'
+
+        class RangeSource(object):
+            def __init__(self, status, headers, chunks):
+                self.status = status
+                self.headers = headers
+                self.chunks = chunks
+
+            def getheader(self, name, default=None):
+                return self.headers.get(name, default)
+
+            def read(self, amt=None):
+                chunk = self.chunks.pop(0)
+                if chunk is None:
+                    raise Exception('disk went away')
+                return chunk
+
+        class FakeConn(object):
+            def close(self):
+                pass
+
+        ranges = []
+
+        def backend_response(node, part, method, path, headers, qs):
+            ranges.append(headers['Range'])
+            first, last = headers['Range'][6:].split('-')
+            last = int(last or len(body) - 1)
+            data = body[int(first):last + 1]
+            # the first resumed source fails after two bytes too
+            chunks = [data[:2], None] if len(ranges) == 1 else [data, '']
+            return FakeConn(), RangeSource(
+                206, {'etag': 'x', 'x-timestamp': '1',
+                      'content-range': 'bytes %s-%d/%d' % (
+                          first, last, len(body))}, chunks)
+
+        with save_globals():
+            controller = proxy_server.ObjectController(self.app, 'account',
+                                                       'container', 'object')
+            controller.backend_response = backend_response
+            req = Request.blank('/a/c/o')
+            nodes = iter([{'ip': '10.0.0.%d' % i, 'port': 1000 + i,
+                           'device': 'sda'} for i in xrange(3)])
+            resume = partial(controller._resume_source, req, 1,
+                             nodes, '/a/c/o')
+            source = RangeSource(200, {'etag': 'x', 'x-timestamp': '1'},
+                                 ['012', None])
+            app_iter = controller._make_app_iter(
+                {'ip': '10.0.0.9', 'port': 1009, 'device': 'sda'}, source,
+                resume)
+            self.assertEquals(''.join(app_iter), body)
+            self.assertEquals(ranges, ['bytes=3-', 'bytes=5-9'])
+
+    def test_GET_unbuffered(self):
+        with save_globals():
+            controller = proxy_server.ObjectController(self.app, 'account',
+                                                       'container', 'object')
+            self.app.client_timeout = 0.01
+            self.app.object_chunk_size = 2
+            req = Request.blank('/a/c/o')
+            req.environ['swift.proxy.read_unbuffered'] = True
+            set_http_connect(200, body='abcdef')
+            resp = controller.GETorHEAD_base(
+                req, 'Object', 1, self.app.object_ring.get_nodes('a')[1],
+                '/a/c/o', 3)
+            app_iter = iter(resp.app_iter)
+            self.assertEquals(app_iter.next(), 'ab')
+            # nothing gives up on a response left unread for a while
+            sleep(0.05)
+            self.assertEquals(''.join(app_iter), 'cdef')
+
+    def test_GET_hedged(self):
+        with save_globals():
+            controller = proxy_server.ObjectController(self.app, 'account',
+                                                       'container', 'object')
+            self.app.hedged_get_percentile = 50
+            self.app.get_latencies.extend(
+                [0.01] * proxy_server.HEDGE_MIN_SAMPLES)
+            answered = []
+
+            def slow_first(ipaddr, port, *args):
+                if port == 1000:
+                    sleep(0.3)
+                answered.append(port)
+
+            set_http_connect(200, 200, body_iter=['hedged', 'slow'],
+                             give_connect=slow_first)
+            req = Request.blank('/a/c/o')
+            start = time.time()
+            resp = controller.GETorHEAD_base(
+                req, 'Object', 1, self.app.object_ring.get_nodes('a')[1],
+                '/a/c/o', 3)
+            self.assertTrue(time.time() - start < 0.3)
+            self.assertEquals(resp.status_int, 200)
+            self.assertEquals(resp.body, 'hedged')
+            self.assertEquals(answered, [1001])
+            # the slow node's response is picked up and closed later
+            sleep(0.4)
+            self.assertEquals(answered, [1001, 1000])
+
+            # without enough samples there is no hedging
+            self.app.get_latencies.clear()
+            answered = []
+            set_http_connect(200, 200, body_iter=['slow', 'hedged'],
+                             give_connect=slow_first)
+            resp = controller.GETorHEAD_base(
+                req, 'Object', 1, self.app.object_ring.get_nodes('a')[1],
+                '/a/c/o', 3)
+            self.assertEquals(resp.body, 'slow')
+            self.assertEquals(answered, [1000])
+
+    def test_resume_source(self):
+
+        class FakeSource(object):
+            def __init__(self, status, headers):
+                self.status = status
+                self.headers = headers
+
+            def getheader(self, name, default=None):
+                return self.headers.get(name, default)
+
+        with save_globals():
+            controller = proxy_server.ObjectController(self.app, 'account',
+                                                       'container', 'object')
+            req = Request.blank('/a/c/o', headers={'If-None-Match': 'x'})
+            self.app.update_request(req)
+            source = FakeSource(206, {'etag': 'x', 'x-timestamp': '1',
+                                        'content-range': 'bytes 10-99/100'})
+            requested = []
+
+            def capture(ipaddr, port, device, partition, method, path,
+                        headers=None, query_string=None):
+                requested.append((port, headers))
+
+            # the first node has a different version of the object
+            set_http_connect(206, 206, etags=['y', 'x'],
+                             timestamps=['1', '1'], give_connect=capture)
+            nodes = iter(self.app.object_ring.get_nodes('a')[1])
+            node, new_source = controller._resume_source(
+                req, 1, nodes, '/a/c/o', source, 20)
+            self.assertEquals(node['port'], 1001)
+            self.assertEquals(new_source.getheader('etag'), 'x')
+            self.assertEquals([port for port, headers in requested],
+                              [1000, 1001])
+            headers = requested[0][1]
+            self.assertEquals(headers['Range'], 'bytes=30-99')
+            self.assertFalse('If-None-Match' in headers)
+
+            # nothing to splice onto a multipart response
+            source = FakeSource(206, {'etag': 'x', 'x-timestamp': '1'})
+            self.assertEquals(controller._resume_source(
+                req, 1, nodes, '/a/c/o', source, 20), (None, None))
+
     def test_node_write_timeout(self):
         with save_globals():
             self.app.account_ring.get_nodes('account')
@@ -2405,6 +2810,95 @@ class TestObjectController(unittest.TestCase):
                               'testing')
             self.assertEquals(resp.headers.get('x-object-meta-ours'), 'okay')
 
+    def test_COPY_backend_copy(self):
+        self.app.backend_copy = True
+        requested = []
+
+        def capture_requested(ipaddr, port, device, partition, method, path,
+                              headers=None, query_string=None):
+            requested.append((method, path, headers.get('X-Backend-Copy-From'),
+                              headers.get('X-Backend-Copy-From-Timestamp')))
+
+        with save_globals():
+            controller = proxy_server.ObjectController(self.app, 'a', 'c', 'o')
+            req = Request.blank('/a/c/o', environ={'REQUEST_METHOD': 'COPY'},
+                                headers={'Destination': 'c/o2'})
+            set_http_connect(200, 200, 200, 200, 200, 201, 201, 201,
+                             timestamps=['1'] * 5 + ['2'] * 3,
+                             give_connect=capture_requested)
+            #                acct cont objh objh objh obj  obj  obj
+            resp = controller.COPY(req)
+            self.assertEquals(resp.status_int, 201)
+            self.assertEquals(resp.headers['x-copied-from'], 'c/o')
+            self.assertEquals(
+                [r[:2] for r in requested],
+                [('HEAD', '/a'), ('HEAD', '/a/c'),
+                 ('HEAD', '/a/c/o'), ('HEAD', '/a/c/o'), ('HEAD', '/a/c/o'),
+                 ('PUT', '/a/c/o2'), ('PUT', '/a/c/o2'), ('PUT', '/a/c/o2')])
+            for method, path, copy_from, copy_from_ts in requested[-3:]:
+                self.assertEquals(copy_from, '1/c/o')
+                self.assertEquals(copy_from_ts, '1')
+
+            # the object servers do not have that source: back to a copy
+            # through the proxy
+            del requested[:]
+            controller = proxy_server.ObjectController(self.app, 'a', 'c', 'o')
+            req = Request.blank('/a/c/o', environ={'REQUEST_METHOD': 'COPY'},
+                                headers={'Destination': 'c/o2'})
+            set_http_connect(200, 200, 200, 409, 409, 409,
+                             200, 200, 200, 201, 201, 201,
+                             give_connect=capture_requested)
+            #                objh objh objh obj  obj  obj
+            #                objc objc objc obj  obj  obj
+            resp = controller.COPY(req)
+            self.assertEquals(resp.status_int, 201)
+            self.assertEquals(
+                [r[:2] for r in requested],
+                [('HEAD', '/a/c/o'), ('HEAD', '/a/c/o'), ('HEAD', '/a/c/o'),
+                 ('PUT', '/a/c/o2'), ('PUT', '/a/c/o2'), ('PUT', '/a/c/o2'),
+                 ('GET', '/a/c/o'), ('GET', '/a/c/o'), ('GET', '/a/c/o'),
+                 ('PUT', '/a/c/o2'), ('PUT', '/a/c/o2'), ('PUT', '/a/c/o2')])
+            self.assertEquals(requested[-1][2], None)
+
+            # not tried for a manifest
+            del requested[:]
+            controller = proxy_server.ObjectController(self.app, 'a', 'c', 'o')
+            req = Request.blank('/a/c/o', environ={'REQUEST_METHOD': 'COPY'},
+                                headers={'Destination': 'c/o2'})
+            set_http_connect(200, 200, 200, 200, 200, 200, 200, 200,
+                             201, 201, 201,
+                             headers={'X-Object-Manifest': 'segs/seg'},
+                             body_iter=['', '', '', '', '', '',
+                                        simplejson.dumps([]), '',
+                                        '', '', ''],
+                             give_connect=capture_requested)
+            resp = controller.COPY(req)
+            self.assertEquals(resp.status_int, 201)
+            self.assertEquals(
+                [r[0] for r in requested if r[2]], [])
+
+    def test_PUT_ignores_client_backend_headers(self):
+        requested = []
+
+        def capture_requested(ipaddr, port, device, partition, method, path,
+                              headers=None, query_string=None):
+            requested.append((method, [h for h in headers
+                                       if h.lower().startswith('x-backend-')]))
+
+        with save_globals():
+            controller = proxy_server.ObjectController(self.app, 'a', 'c', 'o')
+            req = Request.blank('/a/c/o', environ={'REQUEST_METHOD': 'PUT'},
+                                headers={'Content-Length': '0',
+                                         'X-Backend-Copy-From': '1/c2/o',
+                                         'X-Backend-Copy-From-Timestamp': '1'})
+            set_http_connect(200, 200, 201, 201, 201,
+                             give_connect=capture_requested)
+            #                acct cont obj  obj  obj
+            resp = controller.PUT(req)
+            self.assertEquals(resp.status_int, 201)
+            self.assertEquals([r for r in requested if r[0] == 'PUT'],
+                              [('PUT', [])] * 3)
+
     def test_COPY(self):
         with save_globals():
             controller = proxy_server.ObjectController(self.app, 'a', 'c', 'o')
@@ -2582,6 +3076,47 @@ class TestObjectController(unittest.TestCase):
             finally:
                 swift.proxy.controllers.obj.MAX_FILE_SIZE = MAX_FILE_SIZE
 
+    def test_backend_keepalive(self):
+        (prolis, acc1lis, acc2lis, con1lis, con2lis, obj1lis,
+         obj2lis) = _test_sockets
+        prosrv = _test_servers[0]
+        pool = BufferedHTTPConnectionPool()
+        reused = []
+        orig_get = pool.get
+
+        def get(ipaddr, port):
+            conn = orig_get(ipaddr, port)
+            reused.append(conn.reused)
+            return conn
+
+        pool.get = get
+        prosrv.conn_pool = pool
+        try:
+            for method, body in (('PUT', 'keep me'), ('GET', ''),
+                                 ('GET', ''), ('HEAD', '')):
+                sock = connect_tcp(('localhost', prolis.getsockname()[1]))
+                fd = sock.makefile()
+                fd.write('%s /v1/a/c/keepalive HTTP/1.1\r\n'
+                         'Host: localhost\r\nConnection: close\r\n'
+                         'X-Storage-Token: t\r\nContent-Length: %d\r\n'
+                         '\r\n%s' % (method, len(body), body))
+                fd.flush()
+                headers = readuntil2crlfs(fd)
+                exp = 'HTTP/1.1 20'
+                self.assertEquals(headers[:len(exp)], exp)
+                if method == 'GET':
+                    self.assertEquals(fd.read(), 'keep me')
+                fd.close()
+                sock.close()
+            # the object PUT, after the first account and container HEADs,
+            # and everything after it ran on connections from the pool
+            self.assertTrue(True in reused)
+            self.assertTrue(reused[-1])
+            self.assertTrue(pool._idle)
+        finally:
+            prosrv.conn_pool = None
+            pool.close()
+
     def test_chunked_put_bad_version(self):
         # Check bad version
         (prolis, acc1lis, acc2lis, con1lis, con2lis, obj1lis,
@@ -3256,6 +3791,59 @@ class TestObjectController(unittest.TestCase):
         body = fd.read()
         self.assertEquals(body, '234 1')
 
+    def test_chunked_get_long_container_listing(self):
+        # Listings over LISTING_CHUNK_ROWS come back from the container
+        # server chunked; the proxy does its own framing for the client.
+        (prosrv, acc1srv, acc2srv, con1srv, con2srv, obj1srv,
+         obj2srv) = _test_servers
+        (prolis, acc1lis, acc2lis, con1lis, con2lis, obj1lis,
+         obj2lis) = _test_sockets
+        sock = connect_tcp(('localhost', prolis.getsockname()[1]))
+        fd = sock.makefile()
+        fd.write('PUT /v1/a/longlisting HTTP/1.1\r\nHost: localhost\r\n'
+                 'Connection: close\r\nX-Storage-Token: t\r\n'
+                 'Content-Length: 0\r\n\r\n')
+        fd.flush()
+        headers = readuntil2crlfs(fd)
+        exp = 'HTTP/1.1 201'
+        self.assertEquals(headers[:len(exp)], exp)
+        partition, nodes = prosrv.container_ring.get_nodes('a', 'longlisting')
+        for node in nodes:
+            for i in xrange(150):
+                req = Request.blank(
+                    '/%s/%s/a/longlisting/o%03d' % (node['device'],
+                                                    partition, i),
+                    environ={'REQUEST_METHOD': 'PUT'},
+                    headers={'X-Timestamp': normalize_timestamp(1),
+                             'X-Size': '0', 'X-Content-Type': 'text/plain',
+                             'X-Etag': 'x'})
+                self.assertEquals(con1srv.PUT(req).status_int, 201)
+        listing = ''.join('o%03d\n' % i for i in xrange(150))
+
+        sock = connect_tcp(('localhost', prolis.getsockname()[1]))
+        fd = sock.makefile()
+        fd.write('GET /v1/a/longlisting HTTP/1.1\r\nHost: localhost\r\n'
+                 'Connection: close\r\nX-Storage-Token: t\r\n\r\n')
+        fd.flush()
+        headers = readuntil2crlfs(fd)
+        exp = 'HTTP/1.1 200'
+        self.assertEquals(headers[:len(exp)], exp)
+        self.assertEquals(headers.lower().count('transfer-encoding'), 1)
+        body = fd.read()
+        self.assertTrue(body.endswith('0\r\n\r\n'))
+        self.assertEquals(body.count('o'), 150)
+
+        sock = connect_tcp(('localhost', prolis.getsockname()[1]))
+        fd = sock.makefile()
+        fd.write('GET /v1/a/longlisting HTTP/1.0\r\nHost: localhost\r\n'
+                 'X-Storage-Token: t\r\n\r\n')
+        fd.flush()
+        headers = readuntil2crlfs(fd)
+        exp = 'HTTP/1.1 200'
+        self.assertEquals(headers[:len(exp)], exp)
+        self.assertTrue('transfer-encoding' not in headers.lower())
+        self.assertEquals(fd.read(), listing)
+
     def test_chunked_put_lobjects(self):
         # Create a container for our segmented/manifest object testing
         (prolis, acc1lis, acc2lis, con1lis, con2lis, obj1lis,
@@ -5470,6 +6058,11 @@ class FakeObjectController(object):
         self.node_timeout = 1
         self.rate_limit_after_segment = 3
         self.rate_limit_segments_per_sec = 2
+        self.segment_prefetch = 0
+        self.segment_prefetch_bytes = 8388608
+        self.thread_locals = None
+        self.GETorHEAD_base_paths = []
+        self.unbuffered_paths = []
 
     def exception(self, *args):
         self.exception_args = args
@@ -5477,7 +6070,10 @@ class FakeObjectController(object):
 
     def GETorHEAD_base(self, *args):
         self.GETorHEAD_base_args = args
+        self.GETorHEAD_base_paths.append(args[4])
         req = args[0]
+        if req.environ.get('swift.proxy.read_unbuffered'):
+            self.unbuffered_paths.append(args[4])
         path = args[4]
         body = data = path[-1] * int(path[-1])
         if req.range:
@@ -5588,6 +6184,54 @@ class TestSegmentedIterable(unittest.TestCase):
         data = ''.join(segit.segment_iter)
         self.assertEquals(data, '22')
 
+    def test_load_next_segment_prefetch(self):
+        self.controller.segment_prefetch = 2
+        self.controller.rate_limit_after_segment = 10
+        segit = SegmentedIterable(self.controller, 'lc', [
+            {'name': 'o1'}, {'name': 'o2'}, {'name': 'o3'}, {'name': 'o4'}])
+        segit._load_next_segment()
+        sleep()
+        # the next two segments are opened while the first is served
+        self.assertEquals(self.controller.GETorHEAD_base_paths,
+                          ['/a/lc/o1', '/a/lc/o2', '/a/lc/o3'])
+        self.assertEquals(len(segit.prefetched), 2)
+        self.assertEquals(segit.prefetch_bytes, 5)
+        self.assertEquals(''.join(segit.segment_iter), '1')
+        segit._load_next_segment()
+        sleep()
+        self.assertEquals(self.controller.GETorHEAD_base_paths[-1],
+                          '/a/lc/o4')
+        self.assertEquals(''.join(segit.segment_iter), '22')
+        segit.segment_iter = None
+        self.assertEquals(''.join(segit), '3334444')
+        self.assertEquals(segit.prefetch_bytes, 0)
+        # only prefetched segments are read without a reader of their own
+        self.assertEquals(self.controller.unbuffered_paths,
+                          ['/a/lc/o2', '/a/lc/o3', '/a/lc/o4'])
+
+    def test_load_next_segment_prefetch_byte_cap(self):
+        self.controller.segment_prefetch = 3
+        self.controller.segment_prefetch_bytes = 4
+        self.controller.rate_limit_after_segment = 10
+        segit = SegmentedIterable(self.controller, 'lc', [
+            {'name': 'o1'}, {'name': 'o2'}, {'name': 'o3'}, {'name': 'o4'}])
+        segit._load_next_segment()
+        sleep()
+        self.assertEquals(segit.prefetch_bytes, 4)
+        self.assertEquals(
+            sum(len(p.chunks) for p in segit.prefetched), 4)
+        self.assertEquals(''.join(segit), '1223334444')
+
+    def test_app_iter_range_closes_prefetched(self):
+        self.controller.segment_prefetch = 2
+        self.controller.rate_limit_after_segment = 10
+        segit = SegmentedIterable(self.controller, 'lc', [
+            {'name': 'o1', 'bytes': 1}, {'name': 'o2', 'bytes': 2},
+            {'name': 'o3', 'bytes': 3}, {'name': 'o4', 'bytes': 4}])
+        self.assertEquals(''.join(segit.app_iter_range(1, 3)), '22')
+        self.assertEquals(len(segit.prefetched), 0)
+        self.assertEquals(segit.prefetch_bytes, 0)
+
     def test_load_next_segment_with_seek(self):
         segit = SegmentedIterable(self.controller, 'lc', [{'name':
                                   'o1'}, {'name': 'o2'}])